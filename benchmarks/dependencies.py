@@ -0,0 +1,67 @@
+# Compares the identity-formatting dependency query (sql/dependencies.sql)
+# with the oid pairs query (sql/dependency_oids.sql) plus client-side
+# identity resolution, on a live database:
+#
+#     poetry run python benchmarks/dependencies.py postgresql:///mydb -n 5
+#
+# Objects are fetched once up front and are not part of the timings,
+# since inspection fetches them either way.
+import statistics
+import time
+import typing as t
+
+import click
+
+from pgdiff import helpers
+from pgdiff.utils import quick_cursor
+
+
+def _timed(fn: t.Callable[[], t.Any], repeat: int) -> t.Tuple[float, t.Any]:
+    timings = []
+    rv = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rv = fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), rv
+
+
+@click.command()
+@click.argument("dsn", type=str)
+@click.option("--repeat", "-n", type=click.IntRange(min=1), default=5)
+def main(dsn: str, repeat: int) -> None:
+    with quick_cursor(dsn) as cursor:
+        objects = list(helpers.query_objects(cursor))
+        identities = {o.identity for o in objects}
+
+        def identity_query():
+            return [
+                d for d in helpers.query_dependencies(cursor)
+                if d.identity in identities
+                and d.dependency_identity in identities
+            ]
+
+        def oid_pairs():
+            return helpers.resolve_dependencies(
+                objects, helpers.query_dependency_oids(cursor))
+
+        old_time, old = _timed(identity_query, repeat)
+        new_time, new = _timed(oid_pairs, repeat)
+        cursor.connection.rollback()
+
+    old_edges = {(d.identity, d.dependency_identity) for d in old}
+    new_edges = {(d.identity, d.dependency_identity) for d in new}
+    click.echo("objects:                %d" % len(objects))
+    click.echo("dependencies.sql:       %.3fs, %d edges" % (
+        old_time, len(old_edges)))
+    click.echo("dependency_oids.sql:    %.3fs, %d edges" % (
+        new_time, len(new_edges)))
+    click.echo("speedup:                %.1fx" % (old_time / new_time))
+    click.echo("only in dependencies:   %d" % len(old_edges - new_edges))
+    click.echo("only in dependency_oids: %d" % len(new_edges - old_edges))
+    for i, di in sorted(old_edges ^ new_edges)[:20]:
+        click.echo("  %s -> %s" % (i, di))
+
+
+if __name__ == "__main__":
+    main()
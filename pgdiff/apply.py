@@ -0,0 +1,249 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import itertools
+import threading
+import time
+import typing as t
+
+from .utils import db_connect
+
+if t.TYPE_CHECKING:
+    from .plan import Task
+
+
+LOCK_WAIT = """
+    SELECT wait_event_type = 'Lock' FROM pg_catalog.pg_stat_activity
+    WHERE pid = %s
+"""
+
+
+class Timing(t.NamedTuple):
+    statement: str
+    duration: float
+    lock_wait: float
+
+
+class ApplyError(RuntimeError):
+
+    # A parallel apply failed. `committed` names the tasks that were
+    # committed before it did, in full or in part.
+
+    def __init__(self, message: str, committed: t.List[str]) -> None:
+        super().__init__(message)
+        self.committed = committed
+
+
+class LockMonitor:
+
+    # Polls pg_stat_activity from a connection of its own and adds up
+    # how long the backend `pid` spends waiting on locks, per statement.
+    # Waits shorter than `interval` can go unnoticed.
+
+    def __init__(self, dsn: str, pid: int, interval: float = 0.05) -> None:
+        self.dsn = dsn
+        self.pid = pid
+        self.interval = interval
+        self.current: t.Optional[int] = None
+        self._waits: t.Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def begin(self, index: int) -> None:
+        with self._lock:
+            self.current = index
+
+    def end(self, index: int) -> float:
+        # Returns the time statement `index` spent waiting on locks.
+        with self._lock:
+            self.current = None
+            return self._waits.pop(index, 0.0)
+
+    def _run(self) -> None:
+        conn = db_connect(self.dsn)
+        conn.autocommit = True
+        try:
+            cursor = conn.cursor()
+            last = time.perf_counter()
+            while not self._stopped.wait(self.interval):
+                cursor.execute(LOCK_WAIT, (self.pid,))
+                row = cursor.fetchone()
+                now = time.perf_counter()
+                with self._lock:
+                    current = self.current
+                    if row is not None and row[0] and current is not None:
+                        self._waits[current] = (
+                            self._waits.get(current, 0.0) + now - last)
+                last = now
+        finally:
+            conn.close()
+
+
+def apply(
+    conn,
+    statements: t.Iterable[str],
+    dsn: t.Optional[str] = None,
+    rollback: bool = False,
+    interval: float = 0.05,
+) -> t.Iterator[Timing]:
+    # Executes `statements` in a single transaction on `conn` and
+    # yields the timing of each one as soon as it completes. Lock waits
+    # are only measured when given a `dsn` to monitor from. The
+    # transaction is committed once all statements succeed, unless
+    # `rollback` is set; on any error it is rolled back. Deferred
+    # statements run after the commit, each in autocommit, and are
+    # skipped altogether when rolling back. Statements are sent one
+    # round trip at a time, not pipelined, so that each is timed on
+    # its own.
+    monitor = None
+    if dsn is not None:
+        monitor = LockMonitor(dsn, conn.get_backend_pid(), interval)
+        monitor.start()
+    deferred: t.List[str] = []
+    counter = itertools.count()
+    try:
+        cursor = conn.cursor()
+        done = False
+        try:
+            cursor.execute("SET LOCAL check_function_bodies = false")
+            for statement in statements:
+                if getattr(statement, "deferred", False):
+                    deferred.append(statement)
+                    continue
+                yield _execute(cursor, statement, next(counter), monitor)
+            done = True
+        finally:
+            cursor.close()
+            if done and not rollback:
+                conn.commit()
+            else:
+                conn.rollback()
+        if rollback or not deferred:
+            return
+        autocommit = conn.autocommit
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                for statement in deferred:
+                    yield _execute(cursor, statement, next(counter), monitor)
+        finally:
+            conn.autocommit = autocommit
+    finally:
+        if monitor is not None:
+            monitor.stop()
+
+
+def _execute(
+    cursor,
+    statement: str,
+    index: int,
+    monitor: t.Optional[LockMonitor],
+) -> Timing:
+    if monitor is not None:
+        monitor.begin(index)
+    start = time.perf_counter()
+    cursor.execute(statement)
+    duration = time.perf_counter() - start
+    lock_wait = monitor.end(index) if monitor is not None else 0.0
+    return Timing(statement, duration, lock_wait)
+
+
+def _run_task(pool, task: "Task", timings: t.List[Timing]) -> None:
+    # Appends to `timings` as statements complete, so that on an error
+    # it tells how much of a deferred task was committed.
+    conn = pool.getconn()
+    try:
+        if task.deferred:
+            conn.autocommit = True
+            try:
+                with conn.cursor() as cursor:
+                    for statement in task.statements:
+                        timings.append(_execute(cursor, statement, 0, None))
+            finally:
+                conn.autocommit = False
+            return
+        done = []
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SET LOCAL check_function_bodies = false")
+                for statement in task.statements:
+                    done.append(_execute(cursor, statement, 0, None))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        timings.extend(done)
+    finally:
+        pool.putconn(conn)
+
+
+def _describe(task: "Task", count: int) -> str:
+    rv = task.identity or task.statements[0].strip().splitlines()[0]
+    if task.deferred and count < len(task.statements):
+        rv += " (%d of %d statements)" % (count, len(task.statements))
+    return rv
+
+
+def apply_parallel(
+    pool,
+    tasks: t.Sequence["Task"],
+    jobs: int = 1,
+) -> t.Iterator[Timing]:
+    # Runs `tasks`, as planned by plan.tasks(), on connections from a
+    # psycopg2 connection pool, at most `jobs` at a time, each as soon
+    # as the tasks it comes after have completed. Every task commits on
+    # its own, and deferred tasks statement by statement; after an
+    # error no more tasks are started, those running are waited for,
+    # and an ApplyError naming what was committed is raised from it.
+    # Timings are yielded per task as it completes, without lock
+    # waits.
+    waiting = [len(task.after) for task in tasks]
+    dependents: t.List[t.List[int]] = [[] for _ in tasks]
+    for i, task in enumerate(tasks):
+        for j in task.after:
+            dependents[j].append(i)
+    timings: t.List[t.List[Timing]] = [[] for _ in tasks]
+    error: t.Optional[BaseException] = None
+
+    def submit(i: int) -> t.Any:
+        return executor.submit(_run_task, pool, tasks[i], timings[i])
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = {
+            submit(i): i for i, task in enumerate(tasks) if not task.after}
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                try:
+                    future.result()
+                except BaseException as e:
+                    if error is None:
+                        error = e
+                    continue
+                yield from timings[i]
+                if error is not None:
+                    continue
+                for j in dependents[i]:
+                    waiting[j] -= 1
+                    if not waiting[j]:
+                        running[submit(j)] = j
+    if error is not None:
+        committed = [
+            _describe(task, len(timings[i]))
+            for i, task in enumerate(tasks) if timings[i]
+        ]
+        raise ApplyError(
+            "apply failed, %s: %s" % (
+                "already committed " + ", ".join(committed) if committed
+                else "nothing was committed",
+                error,
+            ),
+            committed,
+        ) from error
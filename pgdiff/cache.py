@@ -0,0 +1,136 @@
+import functools
+import hashlib
+import json
+import os
+import typing as t
+
+from . import helpers, snapshot
+from .inspect import Inspection
+
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+def default_cache_dir() -> str:
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache")
+    return os.path.join(root, "pgdiff")
+
+
+@functools.lru_cache(maxsize=None)
+def _queries_digest() -> str:
+    # Snapshots taken with different queries are not interchangeable.
+    digest = hashlib.sha256()
+    for q in [*helpers.queries.values(), helpers.DEPENDENCY_OIDS_QUERY]:
+        digest.update(helpers.load_query(q).encode())
+    return digest.hexdigest()
+
+
+def _make_key(*parts: t.Any) -> str:
+    payload = json.dumps(
+        [snapshot.FORMAT_VERSION, _queries_digest(), *parts])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def catalog_key(
+    cursor,
+    include: t.Optional[t.Iterable[str]] = None,
+) -> str:
+    # Only the schemas matching `include` are fingerprinted, or all of
+    # them when the patterns can not be matched server-side.
+    schemas = helpers.like_patterns(include) if include is not None else None
+    cur = cursor.connection.cursor()
+    try:
+        cur.execute(
+            helpers.rendered_query(
+                helpers.FINGERPRINT_QUERY,
+                schemas is not None,
+                version=helpers.server_major(cursor.connection),
+            ),
+            helpers.query_params(schemas),
+        )
+        fingerprint, = cur.fetchone()
+    finally:
+        cur.close()
+    return _make_key(
+        "catalog",
+        cursor.connection.dsn,
+        cursor.connection.server_version,
+        fingerprint,
+        sorted(include) if include is not None else None,
+    )
+
+
+def schema_key(
+    schema: str,
+    pg_version: int,
+    include: t.Optional[t.Iterable[str]] = None,
+) -> str:
+    return _make_key(
+        "schema",
+        hashlib.sha256(schema.encode()).hexdigest(),
+        pg_version,
+        sorted(include) if include is not None else None,
+    )
+
+
+class SnapshotCache:
+
+    def __init__(
+        self,
+        path: t.Optional[str] = None,
+        max_size: int = DEFAULT_MAX_SIZE,
+    ) -> None:
+        self.path = path or default_cache_dir()
+        self.max_size = max_size
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key + ".json")
+
+    def get(self, key: str) -> t.Optional[Inspection]:
+        path = self._file(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                text = file.read()
+        except FileNotFoundError:
+            return None
+        try:
+            inspection = snapshot.loads(text)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            # Unreadable or malformed, e.g. from an older version.
+            os.remove(path)
+            return None
+        # The modification time doubles as the last access time
+        # for eviction.
+        os.utime(path)
+        return inspection
+
+    def put(self, key: str, inspection: Inspection) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        path = self._file(key)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(snapshot.dumps(inspection))
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -1,4 +1,6 @@
 import sys
+import typing as t
+
 import click
 
 
@@ -6,22 +8,222 @@ import click
 def cli() -> None:
     pass
 
+
+def _explain_format(explain_plan: bool, plan_json: bool) -> t.Optional[str]:
+    if plan_json:
+        return "json"
+    if explain_plan:
+        return "text"
+    return None
+
+
 @cli.command()
 @click.argument("dsn", type=str)
 @click.option("--schemas", "-s", type=str, default="")
 @click.option("--dry", "-d", is_flag=True)
+@click.option("--batch", is_flag=True,
+              help="Inspect each database in a single round trip.")
+@click.option("--jobs", "-j", type=click.IntRange(min=1), default=1,
+              help="Inspect both databases concurrently, using at most "
+                   "this many connections per database.")
+@click.option("--no-cache", is_flag=True,
+              help="Always inspect, bypassing the snapshot cache.")
+@click.option("--cache-dir", type=click.Path(file_okay=False), default=None)
+@click.option("--cache-size", type=click.IntRange(min=0), default=256,
+              help="Maximum size of the snapshot cache in megabytes.")
+@click.option("--target-mode",
+              type=click.Choice(["temp", "template", "transaction"]),
+              default="temp",
+              help="Load the schema into a temporary database, into a "
+                   "template database that is kept and reused for as long "
+                   "as the schema does not change, or into a transaction "
+                   "on a shared scratch database that is rolled back. "
+                   "Concurrent runs in transaction mode wait for each "
+                   "other on catalog locks, and schemas with their own "
+                   "BEGIN or COMMIT fall back to a temporary database.")
+@click.option("--stats", is_flag=True,
+              help="Report how many objects were skipped by content hash "
+                   "on stderr.")
+@click.option("--itersize", type=click.IntRange(min=1), default=None,
+              help="Read catalog query results through server-side "
+                   "cursors, this many rows at a time.")
+@click.option("--apply", is_flag=True,
+              help="Execute the statements on the database instead of "
+                   "printing them, and report how long each one took and "
+                   "waited on locks. Statements are sent one round trip "
+                   "at a time. With --dry, the changes are rolled back.")
+@click.option("--apply-jobs", type=click.IntRange(min=1), default=1,
+              help="With --apply, run the steps for unrelated objects "
+                   "on up to this many connections at once. Steps for "
+                   "objects that depend on one another share a "
+                   "transaction, but unrelated ones commit on their own, "
+                   "so a failure leaves other steps applied.")
+@click.option("--online", is_flag=True,
+              help="Build and drop indexes concurrently, and validate "
+                   "new foreign keys, checks and NOT NULL columns, after "
+                   "the transaction commits.")
+@click.option("--explain-plan", is_flag=True,
+              help="Instead of the script, report the lock each "
+                   "statement takes, whether it scans or rewrites its "
+                   "table, and how large the table is.")
+@click.option("--plan-json", is_flag=True,
+              help="Like --explain-plan, as JSON.")
 def sync(
     dsn: str,
     schemas: str,
     dry: bool,
+    batch: bool,
+    jobs: int,
+    no_cache: bool,
+    cache_dir: t.Optional[str],
+    cache_size: int,
+    target_mode: str,
+    stats: bool,
+    itersize: t.Optional[int],
+    apply: bool,
+    apply_jobs: int,
+    online: bool,
+    explain_plan: bool,
+    plan_json: bool,
 ) -> None:
     """Sync database @ [dsn] with schema."""
     from .sync import sync as do_sync
+    from .cache import SnapshotCache
     schema = sys.stdin.read()
     include = schemas.split(" ") if schemas else None
+    cache = None
+    if not no_cache:
+        cache = SnapshotCache(cache_dir, max_size=cache_size * 1024 * 1024)
     do_sync(
         schema,
         dsn,
         schemas=include,
         dry_run=dry,
+        batch=batch,
+        jobs=jobs,
+        cache=cache,
+        target_mode=target_mode,
+        stats=stats,
+        itersize=itersize,
+        apply=apply,
+        online=online,
+        explain=_explain_format(explain_plan, plan_json),
+        apply_jobs=apply_jobs,
+    )
+
+
+@cli.command()
+@click.argument("dsn", type=str)
+@click.argument("schema", type=click.Path(exists=True, dir_okay=False))
+@click.option("--schemas", "-s", type=str, default="")
+@click.option("--interval", "-n", type=click.FloatRange(min=0), default=2.0,
+              help="Seconds to wait between checks for changes.")
+@click.option("--no-cache", is_flag=True,
+              help="Always inspect, bypassing the snapshot cache.")
+@click.option("--cache-dir", type=click.Path(file_okay=False), default=None)
+@click.option("--cache-size", type=click.IntRange(min=0), default=256,
+              help="Maximum size of the snapshot cache in megabytes.")
+@click.option("--target-mode",
+              type=click.Choice(["temp", "template", "transaction"]),
+              default="transaction",
+              help="How to load the schema, see sync.")
+def watch(
+    dsn: str,
+    schema: str,
+    schemas: str,
+    interval: float,
+    no_cache: bool,
+    cache_dir: t.Optional[str],
+    cache_size: int,
+    target_mode: str,
+) -> None:
+    """Diff database @ [dsn] with [schema] whenever either changes."""
+    from .sync import watch as do_watch
+    from .cache import SnapshotCache
+    include = schemas.split(" ") if schemas else None
+    cache = None
+    if not no_cache:
+        cache = SnapshotCache(cache_dir, max_size=cache_size * 1024 * 1024)
+    do_watch(
+        schema,
+        dsn,
+        schemas=include,
+        interval=interval,
+        cache=cache,
+        target_mode=target_mode,
     )
+
+
+@cli.command("gc-templates")
+@click.argument("dsn", type=str)
+@click.option("--keep", "-k", type=click.IntRange(min=0), default=5,
+              help="Number of most recently used templates to keep.")
+@click.option("--max-age", type=click.FloatRange(min=0), default=None,
+              help="Also drop templates unused for this many hours. "
+                   "Use is recorded at most every ten minutes.")
+def gc_templates(
+    dsn: str,
+    keep: int,
+    max_age: t.Optional[float],
+) -> None:
+    """Drop stale template databases @ [dsn]."""
+    from .utils import gc_templates as do_gc_templates
+    do_gc_templates(
+        dsn,
+        keep=keep,
+        max_age=max_age * 3600 if max_age is not None else None,
+        quiet=False,
+    )
+
+
+@cli.command()
+@click.argument("dsn", type=str)
+@click.option("--schemas", "-s", type=str, default="")
+@click.option("--batch", is_flag=True,
+              help="Inspect the database in a single round trip.")
+@click.option("--itersize", type=click.IntRange(min=1), default=None,
+              help="Read catalog query results through server-side "
+                   "cursors, this many rows at a time.")
+def dump(
+    dsn: str,
+    schemas: str,
+    batch: bool,
+    itersize: t.Optional[int],
+) -> None:
+    """Write a snapshot of database @ [dsn] to stdout."""
+    from .sync import dump as do_dump
+    include = schemas.split(" ") if schemas else None
+    do_dump(dsn, schemas=include, batch=batch, itersize=itersize)
+
+
+@cli.command()
+@click.argument("source", type=click.File("r"))
+@click.argument("target", type=click.File("r"))
+@click.option("--dry", "-d", is_flag=True)
+@click.option("--stats", is_flag=True,
+              help="Report how many objects were skipped by content hash "
+                   "on stderr.")
+@click.option("--online", is_flag=True,
+              help="Build and drop indexes concurrently, and validate "
+                   "new foreign keys, checks and NOT NULL columns, after "
+                   "the transaction commits.")
+@click.option("--explain-plan", is_flag=True,
+              help="Instead of the script, report the lock each "
+                   "statement takes, whether it scans or rewrites its "
+                   "table, and how large the table is.")
+@click.option("--plan-json", is_flag=True,
+              help="Like --explain-plan, as JSON.")
+def diff(
+    source: t.TextIO,
+    target: t.TextIO,
+    dry: bool,
+    stats: bool,
+    online: bool,
+    explain_plan: bool,
+    plan_json: bool,
+) -> None:
+    """Diff snapshot [source] against snapshot [target]."""
+    from .sync import diff_snapshots
+    diff_snapshots(
+        source, target, dry_run=dry, stats=stats, online=online,
+        explain=_explain_format(explain_plan, plan_json))
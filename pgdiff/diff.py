@@ -1,4 +1,5 @@
 from itertools import chain
+import re
 import typing as t
 from . import objects, helpers
 
@@ -56,33 +57,75 @@ def diff_identifiers(
     return common, unique_to_source, unique_to_target
 
 
-def diff_column(source: objects.Column, target: objects.Column) -> t.Iterator[str]:
-    if source["type"] != target["type"]:
-        yield "ALTER COLUMN %s TYPE %s" % (target["name"], target["type"])
+def _add_constraint(ctx: dict, name: str, definition: str) -> t.Iterator[str]:
+    # Online, foreign keys and checks are added without checking the
+    # existing rows, which are validated after the transaction commits
+    # under a SHARE UPDATE EXCLUSIVE lock that does not block writes.
+    if (
+        ctx.get("online")
+        and definition.startswith(("CHECK ", "FOREIGN KEY "))
+        and not definition.endswith(" NOT VALID")
+    ):
+        yield "ADD CONSTRAINT %s %s NOT VALID" % (name, definition)
+        yield helpers.Statement(
+            "VALIDATE CONSTRAINT %s" % name, deferred=True)
+    else:
+        yield "ADD CONSTRAINT %s %s" % (name, definition)
+
+
+def _set_not_null(ctx: dict, name: str) -> t.Iterator[str]:
+    # From PostgreSQL 12, SET NOT NULL skips the table scan when a valid
+    # check constraint already proves it, so online it goes through a
+    # temporary one, added and validated like any other.
+    source = ctx.get("source")
+    pg_version = source.ctx.get("pg_version") if source is not None else None
+    if not ctx.get("online") or (
+        pg_version is not None and pg_version < 120000
+    ):
+        yield "ALTER COLUMN %s SET NOT NULL" % name
+        return
+    check = "%s_pgdiff_not_null" % name[:46]
+    yield from _add_constraint(ctx, check, "CHECK (%s IS NOT NULL)" % name)
+    yield helpers.Statement(
+        "ALTER COLUMN %s SET NOT NULL" % name, deferred=True)
+    yield helpers.Statement("DROP CONSTRAINT %s" % check, deferred=True)
+
+
+def diff_column(
+    ctx: dict,
+    source: objects.Column,
+    target: objects.Column,
+) -> t.Iterator[str]:
+    if source.type != target.type:
+        yield "ALTER COLUMN %s TYPE %s" % (target.name, target.type)
 
-    if source["default"] != target["default"]:
-        if target["default"] is None:
-            yield "ALTER COLUMN %s DROP DEFAULT" % target["name"]
+    if source.default != target.default:
+        if target.default is None:
+            yield "ALTER COLUMN %s DROP DEFAULT" % target.name
         else:
             yield "ALTER COLUMN %s SET DEFAULT %s" % (
-                target["name"], target["default"])
+                target.name, target.default)
 
-    if source["not_null"] != target["not_null"]:
-        if target["not_null"] is True:
-            yield "ALTER COLUMN %s SET NOT NULL" % target["name"]
+    if source.not_null != target.not_null:
+        if target.not_null is True:
+            yield from _set_not_null(ctx, target.name)
         else:
-            yield "ALTER COLUMN %s DROP NOT NULL" % target["name"]
+            yield "ALTER COLUMN %s DROP NOT NULL" % target.name
 
 
-def diff_columns(source: objects.Table, target: objects.Table) -> t.Iterator[str]:
-    source_columns = {c["name"]: c for c in source["columns"]}
-    target_columns = {c["name"]: c for c in target["columns"]}
+def diff_columns(
+    ctx: dict,
+    source: objects.Table,
+    target: objects.Table,
+) -> t.Iterator[str]:
+    source_columns = {c.name: c for c in source.columns}
+    target_columns = {c.name: c for c in target.columns}
     common, source_unique, target_unique = diff_identifiers(
         set(source_columns.keys()), set(target_columns))
     for name in common:
         source_col = source_columns[name]
         target_col = target_columns[name]
-        yield from diff_column(source_col, target_col)
+        yield from diff_column(ctx, source_col, target_col)
     for name in source_unique:
         yield "DROP COLUMN %s" % name
     for name in target_unique:
@@ -91,12 +134,13 @@ def diff_columns(source: objects.Table, target: objects.Table) -> t.Iterator[str
 
 
 def diff_constraint(
+    ctx: dict,
     source: objects.Constraint,
     target: objects.Constraint
 ) -> t.Iterator[str]:
-    if source["definition"] != target["definition"]:
-        yield "DROP CONSTRAINT %s" % source["name"]
-        yield "ADD CONSTRAINT %s %s" % (source["name"], target["definition"])
+    if source.definition != target.definition:
+        yield "DROP CONSTRAINT %s" % source.name
+        yield from _add_constraint(ctx, source.name, target.definition)
 
 
 @register_diff("constraint")
@@ -105,19 +149,19 @@ def diff_constraints(
     source: objects.Table,
     target: objects.Table
 ) -> t.Iterator[str]:
-    source_constraints = {c["name"]: c for c in source["constraints"]}
-    target_constraints = {c["name"]: c for c in target["constraints"]}
+    source_constraints = {c.name: c for c in source.constraints}
+    target_constraints = {c.name: c for c in target.constraints}
     common, source_unique, target_unique = diff_identifiers(
         set(source_constraints.keys()), set(target_constraints))
     for name in source_unique:
         yield "DROP CONSTRAINT %s" % name
     for name in target_unique:
         constraint = target_constraints[name]
-        yield "ADD CONSTRAINT %s %s" % (name, constraint["definition"])
+        yield from _add_constraint(ctx, name, constraint.definition)
     for name in common:
         source_constraint = source_constraints[name]
         target_constraint = target_constraints[name]
-        yield from diff_constraint(source_constraint, target_constraint)
+        yield from diff_constraint(ctx, source_constraint, target_constraint)
 
 
 @register_diff("table")
@@ -128,13 +172,20 @@ def diff_table(
 ) -> t.Iterator[str]:
     alterations = list(chain(
         diff_constraints(ctx, source, target),
-        diff_columns(source, target),
+        diff_columns(ctx, source, target),
     ))
-    if alterations:
+    immediate = [
+        a for a in alterations if not getattr(a, "deferred", False)]
+    if immediate:
         yield "ALTER TABLE {name} {alterations}".format(
-            name=target["identity"],
-            alterations=", ".join(alterations),
+            name=target.identity,
+            alterations=", ".join(immediate),
         )
+    # Deferred alterations each take a statement of their own, in order.
+    for a in alterations:
+        if getattr(a, "deferred", False):
+            yield helpers.Statement(
+                "ALTER TABLE %s %s" % (target.identity, a), deferred=True)
 
 
 @register_diff("view")
@@ -143,19 +194,83 @@ def diff_view(
     source: objects.View,
     target: objects.View
 ) -> t.Iterator[str]:
-    if source["definition"] != target["definition"]:
-        if source["identity"] not in ctx["dropped"]:
+    if source.definition != target.definition:
+        if source.identity not in ctx["dropped"]:
             yield from drop_view(ctx, target)
         yield from create_view(ctx, target)
 
 
+INDEX_NAME = re.compile(
+    r'^(CREATE (?:UNIQUE )?INDEX )("(?:[^"]|"")+"|\S+)( ON )')
+
+
+def _index_online(
+    ctx: dict,
+    index: objects.Index,
+    inspection_key: str,
+) -> bool:
+    # Indexes on partitioned tables can not be built or dropped
+    # concurrently, and there is no point for a table that is being
+    # created or dropped in the same migration.
+    if not ctx.get("online") or " ON ONLY " in index.definition:
+        return False
+    inspection = ctx[inspection_key]
+    other = ctx["target" if inspection_key == "source" else "source"]
+    for parent in inspection.parents(index.identity):
+        if parent.obj_type == "table" and parent.identity not in other:
+            return False
+    return True
+
+
+def _concurrently(definition: str) -> str:
+    return re.sub(
+        r"^CREATE (UNIQUE )?INDEX ",
+        lambda m: "CREATE %sINDEX CONCURRENTLY " % (m.group(1) or ""),
+        definition,
+    )
+
+
 @register_diff("index")
 def diff_index(
     ctx: dict,
     source: objects.Index,
     target: objects.Index
-) -> t.List[str]:
-    return []
+) -> t.Iterator[str]:
+    if source.definition == target.definition or target.from_constraint:
+        return
+    if not _index_online(ctx, target, "target"):
+        return
+    # The new definition is built under a temporary name next to the
+    # old index, which keeps serving queries until it is dropped. A
+    # failed concurrent build leaves an invalid index behind, which is
+    # dropped first, so the whole swap can be run again.
+    temp_name = "%s_pgdiff_new" % target.name[:51]
+    schema = helpers.quote_ident(target.schema)
+    definition = INDEX_NAME.sub(
+        lambda m: m.group(1) + helpers.quote_ident(temp_name) + m.group(3),
+        target.definition,
+        count=1,
+    )
+    yield helpers.Statement(
+        "DROP INDEX CONCURRENTLY IF EXISTS %s.%s" % (
+            schema, helpers.quote_ident(temp_name)),
+        deferred=True,
+        note="swaps in index %s, can be retried from here" % (
+            target.identity),
+    )
+    yield helpers.Statement(_concurrently(definition), deferred=True)
+    yield helpers.Statement(
+        "DROP INDEX CONCURRENTLY IF EXISTS %s" % source.identity,
+        deferred=True,
+    )
+    yield helpers.Statement(
+        "ALTER INDEX %s.%s RENAME TO %s" % (
+            schema,
+            helpers.quote_ident(temp_name),
+            helpers.quote_ident(target.name),
+        ),
+        deferred=True,
+    )
 
 
 @register_diff("sequence")
@@ -173,9 +288,9 @@ def diff_function(
     source: objects.Function,
     target: objects.Function
 ) -> t.Iterator[str]:
-    if source["definition"] != target["definition"]:
+    if source.definition != target.definition:
         # TODO definition needs to be CREATE OR REPLACE
-        yield target["definition"]
+        yield target.definition
 
 
 @register_diff("trigger")
@@ -184,7 +299,7 @@ def diff_trigger(
     source: objects.Trigger,
     target: objects.Trigger
 ) -> t.Iterator[str]:
-    if source["definition"] != target["definition"]:
+    if source.definition != target.definition:
         yield from drop(ctx, source)
         yield from create(ctx, target)
 
@@ -192,37 +307,37 @@ def diff_trigger(
 @register_diff("enum")
 def diff_enum(ctx: dict, source: objects.Enum, target: objects.Enum) -> t.Iterator[str]:
     _, source_unique, target_unique = diff_identifiers(
-        set(source["elements"]), set(target["elements"]))
+        set(source.elements), set(target.elements))
     if source_unique:
         yield from drop(ctx, source)
         yield from create(ctx, target)
     for ele in target_unique:
-        yield "ALTER TYPE %s ADD VALUE '%s'" % (target["identity"], ele)
+        yield "ALTER TYPE %s ADD VALUE '%s'" % (target.identity, ele)
 
 
 @register_drop("trigger")
 def drop_trigger(ctx: dict, trigger: objects.Trigger) -> t.Iterator[str]:
-    yield "DROP TRIGGER %s ON %s" % (trigger["name"], trigger["table_name"])
+    yield "DROP TRIGGER %s ON %s" % (trigger.name, trigger.table_name)
 
 
 @register_create("trigger")
 def create_trigger(ctx: dict, trigger: objects.Trigger) -> t.Iterator[str]:
-    yield trigger["definition"]
+    yield trigger.definition
 
 
 @register_drop("function")
 def drop_function(ctx: dict, function: objects.Function) -> t.Iterator[str]:
-    yield "DROP FUNCTION %s" % function["identity"]
+    yield "DROP FUNCTION %s" % function.identity
 
 
 @register_create("function")
 def create_function(ctx: dict, function: objects.Trigger) -> t.Iterator[str]:
-    yield function["definition"]
+    yield function.definition
 
 
 @register_drop("enum")
 def drop_enum(ctx: dict, enum: objects.Enum) -> t.Iterator[str]:
-    yield "DROP TYPE %s" % enum["identity"]
+    yield "DROP TYPE %s" % enum.identity
 
 
 @register_create("enum")
@@ -232,7 +347,7 @@ def create_enum(ctx: dict, enum: objects.Enum) -> t.Iterator[str]:
 
 @register_drop("sequence")
 def drop_sequence(ctx: dict, sequence: objects.Sequence) -> t.Iterator[str]:
-    yield "DROP SEQUENCE %s" % sequence["identity"]
+    yield "DROP SEQUENCE %s" % sequence.identity
 
 
 @register_create("sequence")
@@ -242,31 +357,44 @@ def create_sequence(ctx: dict, sequence: objects.Sequence) -> t.Iterator[str]:
 
 @register_drop("index")
 def drop_index(ctx: dict, index: objects.Index) -> t.Iterator[str]:
-    if not index["from_constraint"]:
-        yield "DROP INDEX %s" % index["identity"]
+    if index.from_constraint:
+        return
+    if _index_online(ctx, index, "source"):
+        # The transaction may already have dropped it along with a
+        # column or table.
+        yield helpers.Statement(
+            "DROP INDEX CONCURRENTLY IF EXISTS %s" % index.identity,
+            deferred=True,
+        )
+    else:
+        yield "DROP INDEX %s" % index.identity
 
 
 @register_create("index")
 def create_index(ctx: dict, index: objects.Index) -> t.Iterator[str]:
-    if not index["from_constraint"]:
-        yield index["definition"]
+    if index.from_constraint:
+        return
+    if _index_online(ctx, index, "target"):
+        yield helpers.Statement(_concurrently(index.definition), deferred=True)
+    else:
+        yield index.definition
 
 
 @register_drop("view")
 def drop_view(ctx: dict, view: objects.View) -> t.Iterator[str]:
-    yield "DROP VIEW %s" % view["identity"]
+    yield "DROP VIEW %s" % view.identity
 
 
 @register_create("view")
 def create_view(ctx: dict, view: objects.View) -> t.Iterator[str]:
     yield (
-        "CREATE VIEW %s AS\n" % view["identity"]
-    ) + view["definition"]
+        "CREATE VIEW %s AS\n" % view.identity
+    ) + view.definition
 
 
 @register_drop("table")
 def drop_table(ctx: dict, table: objects.Table) -> t.Iterator[str]:
-    yield "DROP TABLE %s" % table["identity"]
+    yield "DROP TABLE %s" % table.identity
 
 
 @register_create("table")
@@ -279,7 +407,7 @@ def diff(
     source: objects.DBObject,
     target: objects.DBObject
 ) -> t.Iterable[str]:
-    handler = diff_handlers[source["obj_type"]]
+    handler = diff_handlers[source.obj_type]
     return handler(ctx, source, target)
 
 
@@ -287,7 +415,7 @@ def create(
     ctx: dict,
     obj: objects.DBObject
 ) -> t.Iterable[str]:
-    handler = create_handlers[obj["obj_type"]]
+    handler = create_handlers[obj.obj_type]
     return handler(ctx, obj)
 
 
@@ -295,5 +423,5 @@ def drop(
     ctx: dict,
     obj: objects.DBObject
 ) -> t.Iterable[str]:
-    handler = drop_handlers[obj["obj_type"]]
+    handler = drop_handlers[obj.obj_type]
     return handler(ctx, obj)
@@ -0,0 +1,145 @@
+import typing as t
+
+
+class CycleError(ValueError):
+    pass
+
+
+class DependencyGraph:
+
+    # Nodes are interned to integer ids; edges point from a dependency
+    # to its dependent. The topological order, each node's rank in it
+    # and the reachability index are computed once and cached until
+    # the graph changes.
+
+    def __init__(self) -> None:
+        self.ids: t.Dict[str, int] = {}
+        self.keys: t.List[str] = []
+        self.successors: t.List[t.List[int]] = []
+        self.predecessors: t.List[t.List[int]] = []
+        self._edges: t.Set[t.Tuple[int, int]] = set()
+        self._order: t.Optional[t.List[int]] = None
+        self._rank: t.Optional[t.List[int]] = None
+        self._closure: t.Optional[t.List[int]] = None
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.ids
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add_node(self, key: str) -> int:
+        try:
+            return self.ids[key]
+        except KeyError:
+            pass
+        node = len(self.keys)
+        self.ids[key] = node
+        self.keys.append(key)
+        self.successors.append([])
+        self.predecessors.append([])
+        self._order = self._rank = self._closure = None
+        return node
+
+    def add_edge(self, source: str, target: str) -> None:
+        u, v = self.add_node(source), self.add_node(target)
+        if (u, v) in self._edges:
+            return
+        self._edges.add((u, v))
+        self.successors[u].append(v)
+        self.predecessors[v].append(u)
+        self._order = self._rank = self._closure = None
+
+    def edges(self) -> t.Iterator[t.Tuple[str, str]]:
+        for u, successors in enumerate(self.successors):
+            for v in successors:
+                yield self.keys[u], self.keys[v]
+
+    def _sort(self) -> None:
+        # Kahn's algorithm taking ready nodes last-in first-out, the
+        # order networkx produced, which keeps the statement order of
+        # existing diffs unchanged.
+        indegree = [len(p) for p in self.predecessors]
+        ready = [n for n, d in enumerate(indegree) if d == 0]
+        order = []
+        while ready:
+            node = ready.pop()
+            order.append(node)
+            for child in self.successors[node]:
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    ready.append(child)
+        if len(order) != len(self.keys):
+            raise CycleError("dependency graph contains a cycle")
+        rank = [0] * len(order)
+        for i, node in enumerate(order):
+            rank[node] = i
+        self._order, self._rank = order, rank
+
+    @property
+    def order(self) -> t.List[int]:
+        if self._order is None:
+            self._sort()
+        return self._order  # type: ignore
+
+    @property
+    def rank(self) -> t.List[int]:
+        if self._rank is None:
+            self._sort()
+        return self._rank  # type: ignore
+
+    def topological_order(self) -> t.List[str]:
+        keys = self.keys
+        return [keys[n] for n in self.order]
+
+    def _reachable(
+        self,
+        node: int,
+        adjacency: t.List[t.List[int]],
+    ) -> t.Set[int]:
+        seen: t.Set[int] = set()
+        stack = list(adjacency[node])
+        while stack:
+            n = stack.pop()
+            if n not in seen:
+                seen.add(n)
+                stack.extend(adjacency[n])
+        return seen
+
+    def _build_closure(self) -> t.List[int]:
+        # For every node, a bitset of its descendants: bit i is set
+        # when the node ranked i places after it in the topological
+        # order depends on it. Shifting by the node's own rank keeps
+        # the integers as short as the span of the descendants.
+        order, rank = self.order, self.rank
+        closure = [0] * len(order)
+        for node in reversed(order):
+            bits = 0
+            base = rank[node]
+            for child in self.successors[node]:
+                bits |= (closure[child] << 1 | 1) << (rank[child] - base - 1)
+            closure[node] = bits
+        return closure
+
+    def descendants(self, key: str, reverse: bool = False) -> t.List[str]:
+        if self._closure is None:
+            self._closure = self._build_closure()
+        node = self.ids[key]
+        digits = bin(self._closure[node])[:1:-1]
+        base = self.rank[node] + 1
+        order, keys = self.order, self.keys
+        rv = []
+        i = digits.find("1")
+        while i != -1:
+            rv.append(keys[order[base + i]])
+            i = digits.find("1", i + 1)
+        if reverse:
+            rv.reverse()
+        return rv
+
+    def parents(self, key: str) -> t.List[str]:
+        return [self.keys[u] for u in self.predecessors[self.ids[key]]]
+
+    def ancestors(self, key: str) -> t.List[str]:
+        nodes = self._reachable(self.ids[key], self.predecessors)
+        return [self.keys[n] for n in sorted(nodes, key=self.rank.__getitem__)]
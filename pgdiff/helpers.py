@@ -1,5 +1,13 @@
+import contextlib
+import functools
+import hashlib
+import itertools
 import os
+import re
+import threading
 import typing as t
+import weakref
+
 import typing_extensions as te
 
 from . import objects as obj
@@ -18,6 +26,13 @@ if t.TYPE_CHECKING:
 
     ValidQueryType = t.Union[DBObjectType, te.Literal["dependency"]]
 
+    SchemaPatterns = t.Optional[t.List[str]]
+
+    Oids = t.Optional[t.List[int]]
+
+    # (catalog, oid, dependency catalog, dependency oid)
+    OidPair = t.Tuple[str, int, str, int]
+
     DBObjectList = t.Union[
         t.List[obj.Table],
         t.List[obj.View],
@@ -46,6 +61,11 @@ ENUM_QUERY = os.path.join(SQL_DIR, "enums.sql")
 FUNCTION_QUERY = os.path.join(SQL_DIR, "functions.sql")
 TRIGGER_QUERY = os.path.join(SQL_DIR, "triggers.sql")
 DEPENDENCY_QUERY = os.path.join(SQL_DIR, "dependencies.sql")
+DEPENDENCY_OIDS_QUERY = os.path.join(SQL_DIR, "dependency_oids.sql")
+FINGERPRINT_QUERY = os.path.join(SQL_DIR, "fingerprint.sql")
+CHANGES_QUERY = os.path.join(SQL_DIR, "changes.sql")
+RESOLVE_QUERY = os.path.join(SQL_DIR, "resolve.sql")
+RELATION_SIZES_QUERY = os.path.join(SQL_DIR, "relation_sizes.sql")
 
 queries: "t.Dict[DBObjectType, str]" = {
     "table": TABLE_QUERY,
@@ -57,64 +77,484 @@ queries: "t.Dict[DBObjectType, str]" = {
     "trigger": TRIGGER_QUERY,
 }
 
+# The catalog each object type lives in, as named by the dependency
+# oid pairs query.
+catalogs: "t.Dict[DBObjectType, str]" = {
+    "table": "c",
+    "view": "c",
+    "index": "c",
+    "sequence": "c",
+    "enum": "t",
+    "function": "p",
+    "trigger": "g",
+}
+
+SCHEMA_FILTER_MARKER = "-- SCHEMA_FILTER"
+OIDS_MARKER = "-- OIDS"
+VERSION_MARKER = re.compile(r"^-- (?:(\d+)_AND_LATER|BEFORE_(\d+))$")
+
+
+def like_patterns(patterns: t.Iterable[str]) -> "SchemaPatterns":
+    rv = []
+    for pattern in patterns:
+        # LIKE has no character classes, these have to be
+        # matched client-side.
+        if "[" in pattern:
+            return None
+        like = ""
+        for char in pattern:
+            if char in "\\%_":
+                like += "\\" + char
+            elif char == "*":
+                like += "%"
+            elif char == "?":
+                like += "_"
+            else:
+                like += char
+        rv.append(like)
+    return rv
+
+
+def server_major(conn) -> int:
+    # 90605 -> 9, 110005 -> 11
+    return conn.server_version // 10000
+
+
+def _version_matches(marker: t.Match, version: t.Optional[int]) -> bool:
+    later, before = marker.groups()
+    if later is not None:
+        return version is None or version >= int(later)
+    return version is not None and version < int(before)
+
+
+def render_query(
+    sql: str,
+    schemas: "SchemaPatterns" = None,
+    oids: "Oids" = None,
+    version: t.Optional[int] = None,
+) -> str:
+    # The line following a SCHEMA_FILTER marker is only kept when
+    # filtering by schema, the one following an OIDS marker only
+    # when filtering by oid. Filtered queries are executed with
+    # parameters, so all other percent signs need escaping.
+    #
+    # The line following an N_AND_LATER or BEFORE_N marker is only
+    # kept for servers of major version `version` N or later, or
+    # before N. Without a version, the query is rendered for the
+    # latest server.
+    keep = {
+        SCHEMA_FILTER_MARKER: schemas is not None,
+        OIDS_MARKER: oids is not None,
+    }
+    filtered = any(keep.values())
+    lines = []
+    marker: t.Optional[str] = None
+    for line in sql.splitlines():
+        stripped = line.strip()
+        if stripped in keep or VERSION_MARKER.match(stripped):
+            marker = stripped
+            continue
+        if marker is not None:
+            current, marker = marker, None
+            if current in keep:
+                if keep[current]:
+                    lines.append(line)
+                continue
+            match = VERSION_MARKER.match(current)
+            assert match is not None
+            if not _version_matches(match, version):
+                continue
+        lines.append(line.replace("%", "%%") if filtered else line)
+    return "\n".join(lines)
+
+
+def query_params(
+    schemas: "SchemaPatterns" = None,
+    oids: "Oids" = None,
+) -> t.Optional[t.Dict[str, t.Any]]:
+    params: t.Dict[str, t.Any] = {}
+    if schemas is not None:
+        params["schemas"] = schemas
+    if oids is not None:
+        params["oids"] = oids
+    return params or None
+
+
+@functools.lru_cache(maxsize=None)
+def load_query(path: str) -> str:
+    with open(path, "r") as file:
+        return file.read()
+
+
+@functools.lru_cache(maxsize=None)
+def rendered_query(
+    path: str,
+    schemas: bool = False,
+    oids: bool = False,
+    version: t.Optional[int] = None,
+) -> str:
+    # Rendering only depends on which filters are in use and on the
+    # server's major version.
+    return render_query(
+        load_query(path),
+        [] if schemas else None,
+        [] if oids else None,
+        version,
+    )
+
+
+PARAM_TYPES = {
+    "schemas": "text[]",
+    "oids": "oid[]",
+}
+
+# Names of the statements prepared on each connection. Prepared
+# statements live as long as the session, ROLLBACK does not
+# deallocate them.
+_prepared: "weakref.WeakKeyDictionary[t.Any, t.Set[str]]" = (
+    weakref.WeakKeyDictionary()
+)
+_prepared_lock = threading.Lock()
+
+
+def _prepare(cursor, sql: str, keys: t.Sequence[str]) -> str:
+    name = "pgdiff_%s" % hashlib.md5(sql.encode()).hexdigest()[:16]
+    conn = cursor.connection
+    with _prepared_lock:
+        prepared = _prepared.setdefault(conn, set())
+        if name in prepared:
+            return name
+    text = sql
+    if keys:
+        for i, key in enumerate(keys, 1):
+            text = text.replace("%%(%s)s" % key, "$%d" % i)
+        text = text.replace("%%", "%")
+    cursor.execute("PREPARE %s AS\n%s" % (name, text))
+    with _prepared_lock:
+        prepared.add(name)
+    return name
+
+
+def execute_query(
+    cursor,
+    sql: str,
+    params: t.Optional[t.Dict[str, t.Any]] = None,
+    prepare: bool = False,
+) -> None:
+    # With `prepare`, `sql` is prepared once per connection and
+    # executed by name from then on, so the server plans it once.
+    if not prepare:
+        cursor.execute(sql, params)
+        return
+    keys = sorted(params) if params else []
+    name = _prepare(cursor, sql, keys)
+    if keys:
+        cursor.execute(
+            "EXECUTE %s(%s)" % (name, ", ".join(
+                "%%(%s)s::%s" % (key, PARAM_TYPES[key]) for key in keys)),
+            params,
+        )
+    else:
+        cursor.execute("EXECUTE %s" % name)
+
+
+_cursor_names = itertools.count()
+
+
+@contextlib.contextmanager
+def open_query(
+    cursor,
+    sql: str,
+    params: t.Optional[t.Dict[str, t.Any]] = None,
+    prepare: bool = False,
+    itersize: t.Optional[int] = None,
+) -> t.Iterator[t.Any]:
+    # Yields a cursor over the results of `sql`. With `itersize`, the
+    # results are read from a server-side cursor `itersize` rows at a
+    # time rather than buffered whole on the client.
+    if itersize is None:
+        execute_query(cursor, sql, params, prepare)
+        yield cursor
+        return
+    if prepare:
+        raise ValueError(
+            "invalid query options: prepared queries can not be read "
+            "from a server-side cursor")
+    named = cursor.connection.cursor(
+        name="pgdiff_%d" % next(_cursor_names))
+    named.itersize = itersize
+    try:
+        named.execute(sql, params)
+        yield named
+    finally:
+        named.close()
+
+
+def row_positions(
+    cursor,
+    cls: t.Type[obj.Record],
+) -> t.List[t.Optional[int]]:
+    # Maps each slot of `cls` to its column in the cursor's result.
+    columns = {d[0]: i for i, d in enumerate(cursor.description)}
+    return [columns.get(name) for name in cls.__slots__]
+
 
 @te.overload
-def query(cursor, obj_type: te.Literal["table"]) -> t.Iterator[obj.Table]: ...
+def query(cursor, obj_type: te.Literal["table"],
+          schemas: "SchemaPatterns" = None,
+          oids: "Oids" = None,
+          prepare: bool = False,
+          itersize: t.Optional[int] = None) -> t.Iterator[obj.Table]: ...
 @te.overload
-def query(cursor, obj_type: te.Literal["view"]) -> t.Iterator[obj.View]: ...
+def query(cursor, obj_type: te.Literal["view"],
+          schemas: "SchemaPatterns" = None,
+          oids: "Oids" = None,
+          prepare: bool = False,
+          itersize: t.Optional[int] = None) -> t.Iterator[obj.View]: ...
 @te.overload
-def query(cursor, obj_type: te.Literal["index"]) -> t.Iterator[obj.Index]: ...
+def query(cursor, obj_type: te.Literal["index"],
+          schemas: "SchemaPatterns" = None,
+          oids: "Oids" = None,
+          prepare: bool = False,
+          itersize: t.Optional[int] = None) -> t.Iterator[obj.Index]: ...
 @te.overload
-def query(cursor, obj_type: te.Literal["sequence"]) -> t.Iterator[obj.Sequence]: ...
+def query(cursor, obj_type: te.Literal["sequence"],
+          schemas: "SchemaPatterns" = None,
+          oids: "Oids" = None,
+          prepare: bool = False,
+          itersize: t.Optional[int] = None) -> t.Iterator[obj.Sequence]: ...
 @te.overload
-def query(cursor, obj_type: te.Literal["enum"]) -> t.Iterator[obj.Enum]: ...
+def query(cursor, obj_type: te.Literal["enum"],
+          schemas: "SchemaPatterns" = None,
+          oids: "Oids" = None,
+          prepare: bool = False,
+          itersize: t.Optional[int] = None) -> t.Iterator[obj.Enum]: ...
 @te.overload
-def query(cursor, obj_type: te.Literal["function"]) -> t.Iterator[obj.Function]: ...
+def query(cursor, obj_type: te.Literal["function"],
+          schemas: "SchemaPatterns" = None,
+          oids: "Oids" = None,
+          prepare: bool = False,
+          itersize: t.Optional[int] = None) -> t.Iterator[obj.Function]: ...
 @te.overload
-def query(cursor, obj_type: te.Literal["trigger"]) -> t.Iterator[obj.Trigger]: ...
+def query(cursor, obj_type: te.Literal["trigger"],
+          schemas: "SchemaPatterns" = None,
+          oids: "Oids" = None,
+          prepare: bool = False,
+          itersize: t.Optional[int] = None) -> t.Iterator[obj.Trigger]: ...
 @te.overload
-def query(cursor, obj_type: te.Literal["dependency"]) -> t.Iterator[obj.Dependency]: ...
+def query(cursor, obj_type: te.Literal["dependency"],
+          schemas: "SchemaPatterns" = None,
+          oids: "Oids" = None,
+          prepare: bool = False,
+          itersize: t.Optional[int] = None) -> t.Iterator[obj.Dependency]: ...
 def query(
     cursor,
     obj_type: "ValidQueryType",
+    schemas: "SchemaPatterns" = None,
+    oids: "Oids" = None,
+    prepare: bool = False,
+    itersize: t.Optional[int] = None,
 ) -> t.Iterator[t.Union[obj.DBObject, obj.Dependency]]:
     q = DEPENDENCY_QUERY if obj_type == "dependency" else queries[obj_type]
-    with open(q, "r") as file:
-        sql = file.read()
-    cursor.execute(sql)
-    for record in cursor:
-        yield dict(**{"obj_type": obj_type, **record})  # type: ignore
-
-
-def query_objects(cursor) -> t.Iterator[obj.DBObject]:
+    sql = rendered_query(
+        q, schemas is not None, oids is not None,
+        server_major(cursor.connection))
+    cls = obj.record_types[obj_type]
+    params = query_params(schemas, oids)
+    with open_query(cursor, sql, params, prepare, itersize) as cur:
+        positions = None
+        for row in cur:
+            # Server-side cursors only describe their results once
+            # the first rows are fetched.
+            if positions is None:
+                positions = row_positions(cur, cls)
+            yield cls.from_row(row, positions)  # type: ignore
+
+
+def query_objects(
+    cursor,
+    schemas: "SchemaPatterns" = None,
+    prepare: bool = False,
+    itersize: t.Optional[int] = None,
+) -> t.Iterator[obj.DBObject]:
     for k in queries:
-        for o in query(cursor, k):
+        for o in query(cursor, k, schemas, prepare=prepare, itersize=itersize):
             yield o
 
 
-def query_dependencies(cursor) -> t.Iterator[obj.Dependency]:
-    return query(cursor, "dependency")
+def query_dependencies(
+    cursor,
+    schemas: "SchemaPatterns" = None,
+    oids: "Oids" = None,
+    prepare: bool = False,
+    itersize: t.Optional[int] = None,
+) -> t.Iterator[obj.Dependency]:
+    # With `oids`, only the dependencies of those objects are read,
+    # like query_dependency_oids. Each part of the query is filtered
+    # before it is combined with the others.
+    return query(cursor, "dependency", schemas, oids, prepare, itersize)
+
+
+def query_dependency_oids(
+    cursor,
+    schemas: "SchemaPatterns" = None,
+    oids: "Oids" = None,
+    prepare: bool = False,
+    itersize: t.Optional[int] = None,
+) -> t.List["OidPair"]:
+    sql = rendered_query(
+        DEPENDENCY_OIDS_QUERY, schemas is not None, oids is not None,
+        server_major(cursor.connection))
+    params = query_params(schemas, oids)
+    with open_query(cursor, sql, params, prepare, itersize) as cur:
+        return [tuple(row) for row in cur]  # type: ignore
+
+
+def resolve_dependencies(
+    objects: t.Iterable[obj.DBObject],
+    pairs: t.Iterable["OidPair"],
+) -> t.List[obj.Dependency]:
+    # Identities are looked up in the objects that were already
+    # fetched, instead of being formatted by the server for every
+    # pair. Pairs with either end outside `objects`, such as
+    # extension members or built-in types, are dropped.
+    identities = {
+        (catalogs[o.obj_type], o.oid): o.identity  # type: ignore
+        for o in objects
+    }
+    rv = []
+    seen = set()
+    for catalog, oid, dependency_catalog, dependency_oid in pairs:
+        i = identities.get((catalog, oid))
+        di = identities.get((dependency_catalog, dependency_oid))
+        if i is None or di is None or i == di or (i, di) in seen:
+            continue
+        seen.add((i, di))
+        rv.append(obj.Dependency(oid, i, dependency_oid, di))
+    return rv
+
+
+def query_changes(
+    cursor,
+    schemas: "SchemaPatterns" = None,
+    prepare: bool = False,
+) -> t.Dict[str, t.Dict[int, str]]:
+    # A version per object, derived from the xmin of every catalog
+    # row that defines it, keyed by object type and oid.
+    sql = rendered_query(
+        CHANGES_QUERY, schemas is not None,
+        version=server_major(cursor.connection))
+    execute_query(cursor, sql, query_params(schemas), prepare)
+    rv: t.Dict[str, t.Dict[int, str]] = {k: {} for k in queries}
+    for obj_type, oid, version in cursor:
+        rv[obj_type][oid] = version
+    return rv
+
+
+def resolve_identities(
+    cursor,
+    identities: t.Iterable[str],
+) -> t.Dict[str, t.Dict[str, int]]:
+    # Finds the type and oid of objects by identity. Only function
+    # identities end with a parenthesis, and the others can not be
+    # passed to to_regprocedure() without an error, or vice versa.
+    functions: t.List[str] = []
+    others: t.List[str] = []
+    for identity in identities:
+        (functions if identity.endswith(")") else others).append(identity)
+    cursor.execute(
+        load_query(RESOLVE_QUERY),
+        {"functions": functions, "others": others},
+    )
+    rv: t.Dict[str, t.Dict[str, int]] = {}
+    for identity, obj_type, oid in cursor:
+        rv.setdefault(obj_type, {})[identity] = oid
+    return rv
+
+
+def query_relation_sizes(
+    cursor,
+    identities: t.Iterable[str],
+) -> t.Dict[str, t.Tuple[int, float]]:
+    # (pages, tuples) by relation identity.
+    cursor.execute(
+        load_query(RELATION_SIZES_QUERY),
+        {"identities": list(identities)},
+    )
+    return {identity: (pages, tuples) for identity, pages, tuples in cursor}
+
+
+@functools.lru_cache(maxsize=None)
+def _batch_query(schemas: bool, version: int) -> str:
+    selects = []
+    batch: t.List[t.Tuple["ValidQueryType", str]] = [
+        *queries.items(), ("dependency", DEPENDENCY_OIDS_QUERY)]
+    for obj_type, q in batch:
+        sql = rendered_query(q, schemas, version=version).strip().rstrip(";")
+        selects.append(
+            "(SELECT COALESCE(json_agg(q), '[]') FROM (\n%s\n) q) AS \"%s\"" % (
+                sql, obj_type)
+        )
+    return "SELECT\n%s" % ",\n".join(selects)
+
+
+def query_batch(
+    cursor,
+    schemas: "SchemaPatterns" = None,
+    prepare: bool = False,
+) -> t.Tuple[t.List[obj.DBObject], t.List[obj.Dependency]]:
+    # Every query is aggregated into a JSON column of a single
+    # statement: one round trip, one snapshot.
+    types: t.List["ValidQueryType"] = [*queries, "dependency"]
+    cur = cursor.connection.cursor()
+    try:
+        execute_query(
+            cur,
+            _batch_query(schemas is not None, server_major(cursor.connection)),
+            query_params(schemas),
+            prepare,
+        )
+        row = cur.fetchone()
+    finally:
+        cur.close()
+
+    results = dict(zip(types, row))
+    objects: t.List[obj.DBObject] = []
+    for obj_type in queries:
+        cls = obj.record_types[obj_type]
+        for record in results[obj_type]:
+            objects.append(cls.from_dict(record))  # type: ignore
+    dependencies = resolve_dependencies(objects, (
+        (
+            record["catalog"],
+            record["oid"],
+            record["dependency_catalog"],
+            record["dependency_oid"],
+        )
+        for record in results["dependency"]
+    ))
+    return objects, dependencies
 
 
 def make_sequence_create(sequence: obj.Sequence) -> str:
-    rv = "CREATE SEQUENCE %s" % sequence["name"]
-    rv += " AS %s" % sequence["data_type"]
-    rv += " INCREMENT BY %s" % sequence["increment"]
+    rv = "CREATE SEQUENCE %s" % sequence.name
+    rv += " AS %s" % sequence.data_type
+    rv += " INCREMENT BY %s" % sequence.increment
 
-    if sequence["minimum_value"]:
-        rv += " MINVALUE %s" % sequence["minimum_value"]
+    if sequence.minimum_value:
+        rv += " MINVALUE %s" % sequence.minimum_value
     else:
         rv += " NO MINVALUE"
 
-    if sequence["minimum_value"]:
-        rv += " MAXVALUE %s" % sequence["maximum_value"]
+    if sequence.minimum_value:
+        rv += " MAXVALUE %s" % sequence.maximum_value
     else:
         rv += " NO MAXVALUE"
 
-    if sequence["start_value"]:
-        rv += " START WITH %s" % sequence["start_value"]
+    if sequence.start_value:
+        rv += " START WITH %s" % sequence.start_value
 
-    if sequence["cycle_option"]:
+    if sequence.cycle_option:
         rv += " CYCLE"
     else:
         rv += " NO CYCLE"
@@ -124,28 +564,28 @@ def make_sequence_create(sequence: obj.Sequence) -> str:
 
 def make_enum_create(enum: obj.Enum) -> str:
     return "CREATE TYPE %s AS ENUM (%s)" % (
-        enum["identity"],
-        ", ".join("'%s'" % e for e in enum["elements"])
+        enum.identity,
+        ", ".join("'%s'" % e for e in enum.elements)
     )
 
 
 def make_constraint(constraint: obj.Constraint) -> str:
     return "CONSTRAINT %s %s" % (
-        constraint["name"], constraint["definition"])
+        constraint.name, constraint.definition)
 
 
 def make_table_create(table: obj.Table) -> str:
     column_statements = []
-    for col in table["columns"]:
+    for col in table.columns:
         column_statements.append(make_column(col))
     rv = "CREATE {}TABLE {} ({}".format(
-        "UNLOGGED" if table["persistence"] == "u" else "",
-        table["name"],
+        "UNLOGGED" if table.persistence == "u" else "",
+        table.name,
         ", ".join(column_statements)
     )
     constraints = [
         make_constraint(c)
-        for c in table["constraints"]
+        for c in table.constraints
     ]
     if constraints:
         rv = "{}, {})".format(rv, ", ".join(constraints))
@@ -155,21 +595,58 @@ def make_table_create(table: obj.Table) -> str:
 
 
 def make_column(column: obj.Column) -> str:
-    default = column["default"]
-    notnull = " NOT NULL" if column["not_null"] else ""
+    default = column.default
+    notnull = " NOT NULL" if column.not_null else ""
     default_key = " DEFAULT" if default != "NULL" else ""
     default_val = " %s" % default if default != "NULL" else ""
     return "{name} {type}{notnull}{default_key}{default_val}".format(
-        name=column["name"],
-        type=column["type"],
+        name=column.name,
+        type=column.type,
         notnull=notnull,
         default_key=default_key,
         default_val=default_val,
     )
 
 
+class Statement(str):
+
+    # A statement with planning flags. `deferred` statements, such as
+    # CREATE INDEX CONCURRENTLY, can not run inside the migration's
+    # transaction and are run after it commits, each on its own.
+    # `obj_type` and `identity` name the object it was planned for,
+    # `note` is shown next to it in scripts and plans.
+
+    deferred = False
+    obj_type: t.Optional[str] = None
+    identity: t.Optional[str] = None
+    note: t.Optional[str] = None
+
+    def __new__(
+        cls,
+        value: str,
+        deferred: bool = False,
+        note: t.Optional[str] = None,
+    ) -> "Statement":
+        rv = super().__new__(cls, value)
+        rv.deferred = deferred
+        rv.note = note
+        return rv
+
+    def with_text(self, value: str) -> "Statement":
+        rv = Statement(value)
+        rv.__dict__.update(self.__dict__)
+        return rv
+
+
+def quote_ident(name: str) -> str:
+    # Always quotes, which is valid for any name.
+    return '"%s"' % name.replace('"', '""')
+
+
 def format_statement(statement: str) -> str:
-    statement = statement.strip()
-    if not statement.endswith(";"):
-        statement = statement + ";"
-    return statement
+    rv = statement.strip()
+    if not rv.endswith(";"):
+        rv = rv + ";"
+    if isinstance(statement, Statement):
+        return statement.with_text(rv)
+    return rv
@@ -1,11 +1,12 @@
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from fnmatch import fnmatch
+import itertools
 import typing as t
 
-import networkx as nx  # type: ignore
-
 from . import objects as obj, helpers
 from .diff import diff, create, drop
+from .graph import DependencyGraph
 
 
 class Inspection:
@@ -16,8 +17,10 @@ class Inspection:
         dependencies: t.Iterable[obj.Dependency],
         ctx: dict,
     ) -> None:
-        self.graph = nx.DiGraph()
+        self.graph = DependencyGraph()
         self.objects: t.Dict[str, obj.DBObject] = {}
+        self.hashes: t.Dict[str, bytes] = {}
+        self.diff_stats: t.Dict[str, int] = {}
         self.ctx = ctx
 
         self._populate_graph(objects, dependencies)
@@ -28,18 +31,52 @@ class Inspection:
         dependencies: t.Iterable[obj.Dependency],
     ):
         for o in objects:
-            i = o["identity"]
+            i = o.identity
             self.graph.add_node(i)
             self.objects[i] = o
+            self.hashes[i] = o.content_hash()
 
         for dep in dependencies:
-            i, di = dep["identity"], dep["dependency_identity"]
+            i, di = dep.identity, dep.dependency_identity
 
             # TODO should there every be a situation where
             # we have a dependency but not the object?
             if i in self.graph and di in self.graph:
                 self.graph.add_edge(di, i)
 
+    def patch(
+        self,
+        removed: t.Collection[str],
+        objects: t.Iterable[obj.DBObject],
+        dependencies: t.Iterable[obj.Dependency],
+    ) -> None:
+        # Removes the `removed` objects and adds or replaces `objects`,
+        # whose dependencies are given; those of all other objects are
+        # kept. The graph has no removal, so it is rebuilt, which is
+        # cheap next to querying again. Kept objects keep their hashes.
+        objects = list(objects)
+        replaced = {o.identity for o in objects}
+        edges = [
+            (di, i) for di, i in self.graph.edges()
+            if i not in removed and i not in replaced
+        ]
+        self.objects = {
+            i: o for i, o in self.objects.items()
+            if i not in removed and i not in replaced
+        }
+        self.hashes = {i: self.hashes[i] for i in self.objects}
+        self.graph = DependencyGraph()
+        for i in self.objects:
+            self.graph.add_node(i)
+        self._populate_graph(objects, dependencies)
+        for di, i in edges:
+            if di in self.graph:
+                self.graph.add_edge(di, i)
+
+    def dependency_pairs(self) -> t.Iterator[t.Tuple[str, str]]:
+        for di, i in self.graph.edges():
+            yield i, di
+
     def __getitem__(self, obj_id: str) -> obj.DBObject:
         return self.objects[obj_id]
 
@@ -47,42 +84,65 @@ class Inspection:
         return obj_id in self.objects
 
     def __iter__(self) -> t.Iterator[obj.DBObject]:
-        for obj_id in nx.topological_sort(self.graph):
+        for obj_id in self.graph.topological_order():
             yield self[obj_id]
 
     def __reversed__(self) -> t.Iterator[obj.DBObject]:
-        return reversed(list(self))
+        for obj_id in reversed(self.graph.topological_order()):
+            yield self[obj_id]
+
+    def parents(self, obj_id: str) -> t.Iterator[obj.DBObject]:
+        for pid in self.graph.parents(obj_id):
+            yield self[pid]
 
     def ancestors(self, obj_id: str) -> t.Iterator[obj.DBObject]:
-        sg = self.graph.subgraph(nx.ancestors(self.graph, obj_id))
-        for aid in reversed(list(nx.topological_sort(sg))):
+        for aid in reversed(self.graph.ancestors(obj_id)):
             yield self[aid]
 
-    def descendants(self, obj_id: str) -> t.Iterator[obj.DBObject]:
-        sg = self.graph.subgraph(nx.descendants(self.graph, obj_id))
-        for doi in nx.topological_sort(sg):
+    def descendants(
+        self,
+        obj_id: str,
+        reverse: bool = False,
+    ) -> t.Iterator[obj.DBObject]:
+        for doi in self.graph.descendants(obj_id, reverse=reverse):
             yield self[doi]
 
-    def _diff(self, other: "Inspection") -> t.Iterator[str]:
+    def _diff(
+        self,
+        other: "Inspection",
+        online: bool = False,
+    ) -> t.Iterator[str]:
         dropped: "OrderedDict[str, None]" = OrderedDict()
-        ctx: dict = {"dropped": dropped}
+        ctx: dict = {
+            "dropped": dropped,
+            "source": other,
+            "target": self,
+            "online": online,
+        }
+        stats = self.diff_stats = {"compared": 0, "hash_hits": 0}
 
         for target in self:
-            oid = target["identity"]
+            oid = target.identity
             try:
                 source = other[oid]
             except KeyError:
-                yield from create(ctx, target)
+                yield from _tag(create(ctx, target), target)
             else:
+                stats["compared"] += 1
+                # Objects with the same content hash can not differ, so
+                # the handlers are skipped for them altogether.
+                if self.hashes[oid] == other.hashes[oid]:
+                    stats["hash_hits"] += 1
+                    continue
 
-                diffs = list(diff(ctx, source, target))
+                diffs = list(_tag(diff(ctx, source, target), target))
                 if not diffs:
                     continue
 
-                for d in reversed(list(other.descendants(oid))):
-                    doid = d["identity"]
-                    if d["obj_type"] in {"view", "function"} and doid not in dropped:
-                        yield from drop(ctx, d)
+                for d in other.descendants(oid, reverse=True):
+                    doid = d.identity
+                    if d.obj_type in {"view", "function"} and doid not in dropped:
+                        yield from _tag(drop(ctx, d), d)
                         dropped[doid] = None
 
                 yield from diffs
@@ -90,18 +150,41 @@ class Inspection:
 
         for doid in reversed(dropped):
             if doid in self:
-                yield from create(ctx, self[doid])
+                yield from _tag(create(ctx, self[doid]), self[doid])
 
         for source in reversed(other):
-            soid = source["identity"]
+            soid = source.identity
             if soid not in self and soid not in dropped:
-                yield from drop(ctx, source)
+                yield from _tag(drop(ctx, source), source)
 
-    def diff(self, other: "Inspection") -> t.List[str]:
-        rv = []
-        for s in self._diff(other):
-            rv.append(helpers.format_statement(s))
-        return rv
+    def iter_diff(
+        self,
+        other: "Inspection",
+        online: bool = False,
+    ) -> t.Iterator[str]:
+        # With `online`, changes that would block writes for long are
+        # planned as deferred statements where possible.
+        for s in self._diff(other, online):
+            yield helpers.format_statement(s)
+
+    def diff(
+        self,
+        other: "Inspection",
+        online: bool = False,
+    ) -> t.List[str]:
+        return list(self.iter_diff(other, online))
+
+
+def _tag(
+    statements: t.Iterable[str],
+    o: obj.DBObject,
+) -> t.Iterator[helpers.Statement]:
+    for s in statements:
+        if not isinstance(s, helpers.Statement):
+            s = helpers.Statement(s)
+        s.obj_type = o.obj_type
+        s.identity = o.identity
+        yield s
 
 
 def _filter_objects(
@@ -110,19 +193,230 @@ def _filter_objects(
 ) -> t.Iterator[obj.DBObject]:
     for o in objects:
         for pattern in patterns:
-            if fnmatch(o["schema"], pattern):
+            if fnmatch(o.schema, pattern):
                 yield o
                 break
 
 
-def inspect(cursor, include: t.Optional[t.Iterable[str]] = None) -> Inspection:
-    pg_version = cursor.connection.server_version
-    objects = helpers.query_objects(cursor)
-    if include is not None:
+def _make_inspection(
+    objects: t.Iterable[obj.DBObject],
+    dependencies: t.Iterable[obj.Dependency],
+    include: t.Optional[t.List[str]],
+    schemas: t.Optional[t.List[str]],
+    pg_version: int,
+) -> Inspection:
+    if include is not None and schemas is None:
         objects = _filter_objects(objects, include)
-    dependencies = list(helpers.query_dependencies(cursor))
     return Inspection(
         objects=objects,
         dependencies=dependencies,
         ctx={"pg_version": pg_version},
     )
+
+
+def inspect(
+    cursor,
+    include: t.Optional[t.Iterable[str]] = None,
+    batch: bool = False,
+    prepare: bool = False,
+    itersize: t.Optional[int] = None,
+) -> Inspection:
+    if batch and itersize is not None:
+        raise ValueError(
+            "invalid inspection options: batch inspection returns a "
+            "single row and can not use a server-side cursor")
+    pg_version = cursor.connection.server_version
+    include = list(include) if include is not None else None
+    schemas = helpers.like_patterns(include) if include is not None else None
+
+    objects: t.Iterable[obj.DBObject]
+    if batch:
+        objects, dependencies = helpers.query_batch(cursor, schemas, prepare)
+    else:
+        objects = list(
+            helpers.query_objects(cursor, schemas, prepare, itersize))
+        dependencies = helpers.resolve_dependencies(
+            objects,
+            helpers.query_dependency_oids(
+                cursor, schemas, prepare=prepare, itersize=itersize),
+        )
+    return _make_inspection(objects, dependencies, include, schemas, pg_version)
+
+
+class IncrementalInspector:
+
+    # Keeps the last inspection of a database. Each refresh asks the
+    # server for a version of every object, and only re-runs the
+    # queries for object types where any of those changed.
+
+    def __init__(
+        self,
+        cursor,
+        include: t.Optional[t.Iterable[str]] = None,
+        prepare: bool = False,
+    ) -> None:
+        self.cursor = cursor
+        self.prepare = prepare
+        self.include = list(include) if include is not None else None
+        self.schemas = (
+            helpers.like_patterns(self.include)
+            if self.include is not None else None
+        )
+        self.inspection: t.Optional[Inspection] = None
+        self.versions: t.Dict[str, t.Dict[int, str]] = {}
+
+    def refresh(self) -> t.Set[str]:
+        # Returns the identities of the objects that were removed or
+        # queried again. Versions are read before the objects, so a
+        # change committed in between is picked up by the next refresh.
+        cursor = self.cursor
+        try:
+            versions = helpers.query_changes(
+                cursor, self.schemas, self.prepare)
+            if self.inspection is None:
+                self.inspection = inspect(
+                    cursor, include=self.include, prepare=self.prepare)
+                rv = set(self.inspection.objects)
+            else:
+                rv = self._patch(versions)
+        finally:
+            cursor.connection.rollback()
+        self.versions = versions
+        return rv
+
+    def _patch(self, versions: t.Dict[str, t.Dict[int, str]]) -> t.Set[str]:
+        inspection = self.inspection
+        assert inspection is not None
+        changed: "t.Dict[helpers.DBObjectType, t.Set[int]]" = {
+            k: set() for k in helpers.queries}
+        gone: t.Set[t.Tuple[str, int]] = set()
+        for k in helpers.queries:
+            old, new = self.versions.get(k, {}), versions[k]
+            changed[k].update(
+                oid for oid, version in new.items()
+                if old.get(oid) != version
+            )
+            gone.update((k, oid) for oid in old if oid not in new)
+        if not gone and not any(changed.values()):
+            return set()
+
+        identities = {
+            (o.obj_type, o.oid): i
+            for i, o in inspection.objects.items()
+        }
+        stale = {
+            identities[key]
+            for key in itertools.chain(
+                ((k, oid) for k, oids in changed.items() for oid in oids),
+                gone,
+            )
+            if key in identities
+        }
+        # Dependents can change without any of their own catalog rows
+        # changing, e.g. a view definition names the tables it reads
+        # from, so they are queried again as well.
+        for i in list(stale):
+            for d in inspection.descendants(i):
+                stale.add(d.identity)
+                if (d.obj_type, d.oid) not in gone:
+                    changed[
+                        t.cast("helpers.DBObjectType", d.obj_type)
+                    ].add(d.oid)
+
+        objects: t.Iterable[obj.DBObject] = [
+            o
+            for k, oids in changed.items() if oids
+            for o in helpers.query(
+                self.cursor, k, self.schemas, sorted(oids), self.prepare)
+        ]
+        if self.include is not None and self.schemas is None:
+            objects = list(_filter_objects(objects, self.include))
+        # Only the dependencies of the objects queried again can have
+        # changed; every object that depends on them is among those.
+        oids = sorted({oid for oids in changed.values() for oid in oids})
+        pairs: t.List["helpers.OidPair"] = []
+        if oids:
+            pairs = helpers.query_dependency_oids(
+                self.cursor, self.schemas, oids, prepare=self.prepare)
+        dependencies = helpers.resolve_dependencies(
+            itertools.chain(
+                (o for i, o in inspection.objects.items() if i not in stale),
+                objects,
+            ),
+            pairs,
+        )
+        inspection.patch(stale, objects, dependencies)
+        return stale | {o.identity for o in objects}
+
+
+def inspect_objects(
+    cursor,
+    identities: t.Iterable[str],
+    prepare: bool = False,
+    itersize: t.Optional[int] = None,
+) -> Inspection:
+    # A partial inspection of just the objects with the given
+    # identities, and of the dependencies among them. Identities
+    # that do not exist are left out.
+    resolved = helpers.resolve_identities(cursor, identities)
+    objects = [
+        o
+        for k in helpers.queries if k in resolved
+        for o in helpers.query(
+            cursor, k, oids=list(resolved[k].values()),
+            prepare=prepare, itersize=itersize)
+    ]
+    oids = [oid for found in resolved.values() for oid in found.values()]
+    dependencies = helpers.resolve_dependencies(
+        objects,
+        helpers.query_dependency_oids(
+            cursor, oids=oids, prepare=prepare, itersize=itersize),
+    )
+    return Inspection(
+        objects=objects,
+        dependencies=dependencies,
+        ctx={"pg_version": cursor.connection.server_version},
+    )
+
+
+def inspect_parallel(
+    pool,
+    include: t.Optional[t.Iterable[str]] = None,
+    jobs: int = 1,
+    prepare: bool = False,
+    itersize: t.Optional[int] = None,
+) -> Inspection:
+    # Runs every query type on its own connection from a psycopg2
+    # connection pool, at most `jobs` at a time. The queries do not
+    # share a snapshot.
+    include = list(include) if include is not None else None
+    schemas = helpers.like_patterns(include) if include is not None else None
+
+    def run(obj_type):
+        conn = pool.getconn()
+        try:
+            cursor = conn.cursor()
+            try:
+                if obj_type == "dependency":
+                    return helpers.query_dependency_oids(
+                        cursor, schemas, prepare=prepare, itersize=itersize)
+                return list(helpers.query(
+                    cursor, obj_type, schemas,
+                    prepare=prepare, itersize=itersize))
+            finally:
+                cursor.close()
+                conn.rollback()
+        finally:
+            pool.putconn(conn)
+
+    conn = pool.getconn()
+    pg_version = conn.server_version
+    pool.putconn(conn)
+
+    types: t.List["helpers.ValidQueryType"] = [*helpers.queries, "dependency"]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = dict(zip(types, executor.map(run, types)))
+    pairs = results.pop("dependency")
+    objects = [o for rows in results.values() for o in rows]
+    dependencies = helpers.resolve_dependencies(objects, pairs)
+    return _make_inspection(objects, dependencies, include, schemas, pg_version)
@@ -1,64 +1,212 @@
+import hashlib
 import typing as t
-import typing_extensions as te
 
 
 DatabaseIdDiff = t.Tuple[t.Set[str], t.Set[str], t.Set[str]]
 
+R = t.TypeVar("R", bound="Record")
 
-class Constraint(te.TypedDict):
-    obj_type: te.Literal["constraint"]
-    identity: str
-    oid: str
+
+class Record:
+
+    # Catalog rows are kept as slotted records rather than dicts; the
+    # slots are listed in the column order of the matching query.
+
+    __slots__: t.Tuple[str, ...] = ()
+    obj_type = ""
+
+    def __init__(self, *values: t.Any, **fields: t.Any) -> None:
+        # Slots given neither a value nor a field are None.
+        missing = len(self.__slots__) - len(values)
+        if missing > 0:
+            values += (None,) * missing
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def from_row(
+        cls: t.Type[R],
+        row: t.Sequence[t.Any],
+        positions: t.Sequence[t.Optional[int]],
+    ) -> R:
+        return cls(*[
+            row[i] if i is not None else None
+            for i in positions
+        ])
+
+    @classmethod
+    def from_dict(cls: t.Type[R], data: t.Mapping[str, t.Any]) -> R:
+        return cls(*[data.get(name) for name in cls.__slots__])
+
+    def to_dict(self) -> t.Dict[str, t.Any]:
+        return {
+            "obj_type": self.obj_type,
+            **{name: getattr(self, name) for name in self.__slots__},
+        }
+
+    def content(self) -> t.Tuple[t.Any, ...]:
+        # Everything that defines the object, leaving out oids, which
+        # differ between databases.
+        return tuple(
+            getattr(self, name)
+            for name in self.__slots__
+            if name != "oid"
+        )
+
+    def content_hash(self) -> bytes:
+        return hashlib.md5(repr(self.content()).encode()).digest()
+
+    def __repr__(self) -> str:
+        return "%s(%s)" % (
+            type(self).__name__,
+            ", ".join(
+                "%s=%r" % (name, getattr(self, name, None))
+                for name in self.__slots__
+            ),
+        )
+
+
+class Constraint(Record):
+    __slots__ = (
+        "oid",
+        "schema",
+        "name",
+        "identity",
+        "definition",
+        "index",
+    )
+    obj_type = "constraint"
+
+    oid: int
     schema: str
     name: str
+    identity: str
     definition: str
     index: t.Optional[str]
 
 
-class Column(te.TypedDict):
-    obj_type: te.Literal["column"]
+class Column(Record):
+    __slots__ = (
+        "name",
+        "type",
+        "default",
+        "not_null",
+    )
+    obj_type = "column"
+
     name: str
     type: str
     default: t.Any
     not_null: bool
 
 
-class Table(te.TypedDict):
-    obj_type: te.Literal["table"]
-    identity: str
-    oid: str
-    schema: str
+class Table(Record):
+    __slots__ = (
+        "oid",
+        "name",
+        "schema",
+        "identity",
+        "type",
+        "parent_table",
+        "partition_def",
+        "row_security",
+        "force_row_security",
+        "persistence",
+        "columns",
+        "constraints",
+    )
+    obj_type = "table"
+
+    oid: int
     name: str
+    schema: str
+    identity: str
     type: str
     parent_table: str
     partition_def: str
-    row_security: str
-    force_row_security: str
+    row_security: bool
+    force_row_security: bool
     persistence: str
     columns: t.List[Column]
     constraints: t.List[Constraint]
 
+    def __init__(self, *values: t.Any, **fields: t.Any) -> None:
+        super().__init__(*values, **fields)
+        # Columns and constraints arrive as JSON objects.
+        self.columns = [
+            c if isinstance(c, Column) else Column.from_dict(c)
+            for c in self.columns or ()
+        ]
+        self.constraints = [
+            c if isinstance(c, Constraint) else Constraint.from_dict(c)
+            for c in self.constraints or ()
+        ]
 
-class View(te.TypedDict):
-    obj_type: te.Literal["view"]
-    identity: str
-    oid: str
+    def content(self) -> t.Tuple[t.Any, ...]:
+        constraints = sorted(self.constraints, key=lambda c: c.name)
+        return super().content()[:-2] + (
+            tuple(c.content() for c in self.columns),
+            tuple(c.content() for c in constraints),
+        )
+
+    def to_dict(self) -> t.Dict[str, t.Any]:
+        rv = super().to_dict()
+        rv["columns"] = [c.to_dict() for c in self.columns]
+        rv["constraints"] = [c.to_dict() for c in self.constraints]
+        return rv
+
+
+class View(Record):
+    __slots__ = (
+        "oid",
+        "schema",
+        "name",
+        "identity",
+        "type",
+        "definition",
+    )
+    obj_type = "view"
+
+    oid: int
     schema: str
     name: str
+    identity: str
     type: str
     definition: str
 
 
-class Index(te.TypedDict):
-    obj_type: te.Literal["index"]
-    identity: str
-    oid: str
+class Index(Record):
+    __slots__ = (
+        "oid",
+        "schema",
+        "table_name",
+        "name",
+        "identity",
+        "definition",
+        "key_columns",
+        "key_options",
+        "num_columns",
+        "is_unique",
+        "is_pk",
+        "is_exclusion",
+        "is_immediate",
+        "is_clustered",
+        "key_expressions",
+        "partial_predicate",
+        "from_constraint",
+    )
+    obj_type = "index"
+
+    oid: int
     schema: str
     table_name: str
     name: str
+    identity: str
     definition: str
     key_columns: str
-    key_options: t.List[int]
+    key_options: str
     num_columns: int
     is_unique: bool
     is_pk: bool
@@ -70,11 +218,28 @@ class Index(te.TypedDict):
     from_constraint: bool
 
 
-class Sequence(te.TypedDict):
-    obj_type: te.Literal["sequence"]
-    identity: str
+class Sequence(Record):
+    __slots__ = (
+        "oid",
+        "schema",
+        "name",
+        "identity",
+        "data_type",
+        "precision",
+        "precision_radix",
+        "scale",
+        "start_value",
+        "minimum_value",
+        "maximum_value",
+        "increment",
+        "cycle_option",
+    )
+    obj_type = "sequence"
+
+    oid: int
     schema: str
     name: str
+    identity: str
     data_type: str
     precision: int
     precision_radix: int
@@ -86,22 +251,47 @@ class Sequence(te.TypedDict):
     cycle_option: bool
 
 
-class Enum(te.TypedDict):
-    obj_type: te.Literal["enum"]
-    identity: str
-    oid: str
+class Enum(Record):
+    __slots__ = (
+        "oid",
+        "schema",
+        "name",
+        "elements",
+        "identity",
+    )
+    obj_type = "enum"
+
+    oid: int
     schema: str
     name: str
     elements: t.List[str]
+    identity: str
 
 
-class Function(te.TypedDict):
-    obj_type: te.Literal["function"]
-    identity: str
-    oid: str
+class Function(Record):
+    __slots__ = (
+        "oid",
+        "schema",
+        "name",
+        "signature",
+        "identity",
+        "language",
+        "is_strict",
+        "is_security_definer",
+        "volatility",
+        "kind",
+        "argnames",
+        "argtypes",
+        "return_type",
+        "definition",
+    )
+    obj_type = "function"
+
+    oid: int
     schema: str
     name: str
     signature: str
+    identity: str
     language: str
     is_strict: bool
     is_security_definer: bool
@@ -113,24 +303,43 @@ class Function(te.TypedDict):
     definition: str
 
 
-class Trigger(te.TypedDict):
-    obj_type: te.Literal["trigger"]
-    identity: str
-    oid: str
+class Trigger(Record):
+    __slots__ = (
+        "oid",
+        "schema",
+        "name",
+        "identity",
+        "table_name",
+        "definition",
+        "proc_name",
+        "proc_schema",
+        "enabled",
+    )
+    obj_type = "trigger"
+
+    oid: int
     schema: str
     name: str
+    identity: str
     table_name: str
     definition: str
     proc_name: str
     proc_schema: str
-    enabled: bool
+    enabled: str
+
 
+class Dependency(Record):
+    __slots__ = (
+        "oid",
+        "identity",
+        "dependency_oid",
+        "dependency_identity",
+    )
+    obj_type = "dependency"
 
-class Dependency(te.TypedDict):
-    obj_type: te.Literal["dependency"]
     oid: int
     identity: str
-    dependency_oid: str
+    dependency_oid: int
     dependency_identity: str
 
 
@@ -143,3 +352,21 @@ DBObject = t.Union[
     Function,
     Trigger,
 ]
+
+record_types: t.Dict[str, t.Type[Record]] = {
+    cls.obj_type: cls
+    for cls in (
+        Table,
+        View,
+        Index,
+        Sequence,
+        Enum,
+        Function,
+        Trigger,
+        Dependency,
+    )
+}
+
+
+def from_dict(data: t.Mapping[str, t.Any]) -> t.Any:
+    return record_types[data["obj_type"]].from_dict(data)
@@ -0,0 +1,378 @@
+import re
+import typing as t
+
+from . import helpers
+from .inspect import Inspection
+
+
+# Table lock modes, weakest first.
+LOCK_MODES = (
+    "ACCESS SHARE",
+    "ROW SHARE",
+    "ROW EXCLUSIVE",
+    "SHARE UPDATE EXCLUSIVE",
+    "SHARE",
+    "SHARE ROW EXCLUSIVE",
+    "EXCLUSIVE",
+    "ACCESS EXCLUSIVE",
+)
+
+# What a statement does to the existing rows of its relation, cheapest
+# first: a full scan, e.g. to validate a constraint or build an index,
+# or a rewrite of the whole table and its indexes.
+SCAN = "scan"
+REWRITE = "rewrite"
+EFFECTS = (None, SCAN, REWRITE)
+
+# Statements that take no lock on an existing relation, since they
+# create a new object or only touch functions and types.
+UNLOCKED = re.compile(
+    r"^(?:CREATE (?:OR REPLACE )?(?:TABLE|VIEW|SEQUENCE|TYPE|FUNCTION)"
+    r"|DROP (?:FUNCTION|TYPE)|ALTER TYPE) ")
+CREATE_INDEX = re.compile(r"^CREATE (?:UNIQUE )?INDEX (CONCURRENTLY )?")
+ALTER_SUBCOMMAND = re.compile(
+    r",\s*(?=(?:ADD|ALTER|DROP|VALIDATE|RENAME|SET|RESET) )")
+ADD_CONSTRAINT = re.compile(
+    r"^ADD CONSTRAINT \S+ (CHECK|FOREIGN KEY|UNIQUE|PRIMARY KEY|EXCLUDE)\b")
+ALTER_TYPE = re.compile(r"^ALTER COLUMN (\S+) (?:SET DATA )?TYPE (.+)$", re.S)
+ADD_COLUMN_DEFAULT = re.compile(r"^ADD COLUMN .* DEFAULT (.+)$", re.S)
+VOLATILE_DEFAULT = re.compile(
+    r"\b(?:nextval|random|clock_timestamp|timeofday|gen_random_uuid"
+    r"|uuid_generate_v[14])\(")
+VARCHAR = re.compile(r"^character varying(?:\((\d+)\))?$")
+NUMERIC = re.compile(r"^numeric(?:\((\d+),(\d+)\))?$")
+NAME = r'(?:"(?:[^"]|"")+"|[^\s(."]+)'
+REFERENCES = re.compile(r"\bREFERENCES (%s)(?:\.(%s))?" % (NAME, NAME))
+
+
+class Step(t.NamedTuple):
+    statement: str
+    deferred: bool
+    # The existing relation the statement locks, if any.
+    relation: t.Optional[str]
+    lock: t.Optional[str]
+    effect: t.Optional[str]
+    # Planner estimates, when the relation exists in the database.
+    pages: t.Optional[int]
+    tuples: t.Optional[float]
+    note: t.Optional[str] = None
+    # Relations referenced by an added foreign key, which are locked
+    # SHARE ROW EXCLUSIVE as well.
+    referenced: t.Tuple[str, ...] = ()
+
+
+def _strongest(
+    a: t.Tuple[t.Optional[str], t.Optional[str]],
+    b: t.Tuple[t.Optional[str], t.Optional[str]],
+) -> t.Tuple[t.Optional[str], t.Optional[str]]:
+    lock = max(
+        a[0], b[0], key=lambda m: -1 if m is None else LOCK_MODES.index(m))
+    return lock, max(a[1], b[1], key=EFFECTS.index)
+
+
+def _type_widens(old: str, new: str) -> bool:
+    # Type changes that PostgreSQL does without rewriting the table,
+    # a few common cases of binary coercible types.
+    if old == new:
+        return True
+    old_varchar, new_varchar = VARCHAR.match(old), VARCHAR.match(new)
+    if old_varchar and (new == "text" or new_varchar):
+        if new_varchar is None or new_varchar.group(1) is None:
+            return True
+        return (
+            old_varchar.group(1) is not None
+            and int(new_varchar.group(1)) >= int(old_varchar.group(1))
+        )
+    if old == "text":
+        return new_varchar is not None and new_varchar.group(1) is None
+    old_numeric, new_numeric = NUMERIC.match(old), NUMERIC.match(new)
+    if old_numeric and new_numeric:
+        if new_numeric.group(1) is None:
+            return True
+        return (
+            old_numeric.group(1) is not None
+            and old_numeric.group(2) == new_numeric.group(2)
+            and int(new_numeric.group(1)) >= int(old_numeric.group(1))
+        )
+    return False
+
+
+def _alter_table(
+    subcommand: str,
+    table: t.Any,
+    pg_version: t.Optional[int],
+) -> t.Tuple[t.Optional[str], t.Optional[str]]:
+    if subcommand.startswith("VALIDATE CONSTRAINT "):
+        return "SHARE UPDATE EXCLUSIVE", SCAN
+    not_valid = subcommand.endswith(" NOT VALID")
+    m = ADD_CONSTRAINT.match(subcommand)
+    if m is not None:
+        kind = m.group(1)
+        lock = (
+            "SHARE ROW EXCLUSIVE" if kind == "FOREIGN KEY"
+            else "ACCESS EXCLUSIVE")
+        if not_valid or " USING INDEX " in subcommand:
+            return lock, None
+        return lock, SCAN
+    m = ALTER_TYPE.match(subcommand)
+    if m is not None:
+        name, new_type = m.group(1), m.group(2).split(" USING ")[0].strip()
+        columns = {c.name: c for c in getattr(table, "columns", ())}
+        column = columns.get(name)
+        if column is not None and _type_widens(column.type, new_type):
+            return "ACCESS EXCLUSIVE", None
+        return "ACCESS EXCLUSIVE", REWRITE
+    if subcommand.endswith(" SET NOT NULL"):
+        return "ACCESS EXCLUSIVE", SCAN
+    m = ADD_COLUMN_DEFAULT.match(subcommand)
+    if m is not None:
+        default = m.group(1).replace(" NOT NULL", "").strip()
+        if default not in ("NULL", "None") and (
+            pg_version is not None and pg_version < 110000
+            or VOLATILE_DEFAULT.search(default)
+        ):
+            return "ACCESS EXCLUSIVE", REWRITE
+    return "ACCESS EXCLUSIVE", None
+
+
+def classify(
+    statement: str,
+    table: t.Any = None,
+    pg_version: t.Optional[int] = None,
+) -> t.Tuple[t.Optional[str], t.Optional[str]]:
+    # The lock a statement takes on its relation and its effect on the
+    # existing rows. `table` is the table as it is before the statement
+    # runs, used to tell which column type changes rewrite it.
+    text = statement.strip().rstrip(";")
+    if UNLOCKED.match(text):
+        return None, None
+    m = CREATE_INDEX.match(text)
+    if m is not None:
+        if m.group(1):
+            return "SHARE UPDATE EXCLUSIVE", SCAN
+        # Only the definition is created on a partitioned table.
+        return "SHARE", None if " ON ONLY " in text else SCAN
+    if text.startswith("DROP INDEX CONCURRENTLY "):
+        return "SHARE UPDATE EXCLUSIVE", None
+    if text.startswith("ALTER INDEX ") and " RENAME TO " in text:
+        if pg_version is not None and pg_version < 120000:
+            return "ACCESS EXCLUSIVE", None
+        return "SHARE UPDATE EXCLUSIVE", None
+    if re.match(r"^CREATE (?:CONSTRAINT )?TRIGGER ", text):
+        return "SHARE ROW EXCLUSIVE", None
+    if text.startswith("ALTER TABLE "):
+        prefix = "ALTER TABLE %s " % getattr(table, "identity", "")
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+        else:
+            text = text.split(" ", 3)[-1]
+        rv: t.Tuple[t.Optional[str], t.Optional[str]] = (None, None)
+        for subcommand in ALTER_SUBCOMMAND.split(text):
+            rv = _strongest(
+                rv, _alter_table(subcommand.strip(), table, pg_version))
+        return rv
+    # DROP TABLE, DROP VIEW, DROP TRIGGER and whatever else is left.
+    return "ACCESS EXCLUSIVE", None
+
+
+def _relation(
+    statement: str,
+    source: Inspection,
+    target: Inspection,
+) -> t.Optional[str]:
+    obj_type = getattr(statement, "obj_type", None)
+    identity = getattr(statement, "identity", None)
+    if identity is None:
+        return None
+    if obj_type in ("table", "view", "sequence"):
+        return identity
+    if obj_type in ("index", "trigger"):
+        for inspection in (source, target):
+            if identity not in inspection:
+                continue
+            for parent in inspection.parents(identity):
+                if parent.obj_type in ("table", "view"):
+                    return parent.identity
+    return None
+
+
+def _referenced(
+    statement: str,
+    relation: t.Optional[str],
+    source: Inspection,
+) -> t.Tuple[str, ...]:
+    # Unqualified names are visible in the search path, most likely
+    # in the schema of the altered table or in public.
+    if not statement.startswith(("ALTER TABLE ", "CREATE TABLE ")):
+        return ()
+    rv = []
+    for m in REFERENCES.finditer(statement):
+        if m.group(2) is not None:
+            rv.append("%s.%s" % (m.group(1), m.group(2)))
+            continue
+        name = m.group(1)
+        candidates = ["public.%s" % name]
+        if relation is not None:
+            candidates.insert(0, "%s.%s" % (relation.split(".")[0], name))
+        rv.append(next((c for c in candidates if c in source), name))
+    return tuple(rv)
+
+
+def explain(
+    statements: t.Iterable[str],
+    source: Inspection,
+    target: Inspection,
+    cursor=None,
+) -> t.List[Step]:
+    # Annotates statements planned by `target.iter_diff(source)`. Sizes
+    # are read through `cursor`, connected to the source database,
+    # when given.
+    pg_version = source.ctx.get("pg_version")
+    steps = []
+    for statement in statements:
+        relation = _relation(statement, source, target)
+        table = None
+        if relation is not None and relation in source:
+            table = source[relation]
+        lock, effect = classify(statement, table, pg_version)
+        deferred = getattr(statement, "deferred", False)
+        if deferred and statement.rstrip(";").endswith(" SET NOT NULL"):
+            # Planned online, after validating a check that proves it.
+            effect = None
+        referenced = _referenced(statement, relation, source)
+        if lock is None:
+            relation = None
+        steps.append(Step(
+            statement=str(statement),
+            deferred=deferred,
+            relation=relation,
+            lock=lock,
+            effect=effect,
+            pages=None,
+            tuples=None,
+            note=getattr(statement, "note", None),
+            referenced=referenced,
+        ))
+    if cursor is None:
+        return steps
+    sizes = helpers.query_relation_sizes(
+        cursor, {s.relation for s in steps if s.relation is not None})
+    return [
+        s._replace(pages=sizes[s.relation][0], tuples=sizes[s.relation][1])
+        if s.relation in sizes else s
+        for s in steps
+    ]
+
+
+# Object types whose dependents are not all in the dependency graph:
+# columns of an enum type, or defaults and checks calling a function.
+# Their tasks wait for everything planned before them, and everything
+# planned after waits for them.
+BARRIER_TYPES = frozenset(["enum", "function", None])
+
+
+class Task(t.NamedTuple):
+    # Named after the first object planned in it.
+    obj_type: t.Optional[str]
+    identity: t.Optional[str]
+    # Run in one transaction or, when deferred, each on its own.
+    statements: t.List[str]
+    deferred: bool
+    # Indexes of the tasks that must complete first.
+    after: t.FrozenSet[int]
+
+
+def tasks(
+    statements: t.Iterable[str],
+    source: Inspection,
+    target: Inspection,
+) -> t.List[Task]:
+    # Splits statements planned by `target.iter_diff(source)` into
+    # tasks that can run at the same time on separate connections.
+    #
+    # Statements that are not deferred are grouped by object, and the
+    # groups of objects that depend on one another, in either
+    # database, share a task: a view dropped and created again around
+    # a change to its table is one transaction with that change. Only
+    # unrelated objects are committed apart, which is where applying
+    # in parallel gives up the atomicity of the serial plan. Barrier
+    # objects get a task of their own, between everything planned
+    # before and after them.
+    #
+    # As in the serial plan, deferred statements come last, as one
+    # task per run of statements planned for the same object, after
+    # the tasks of any object they are related to.
+    groups: t.List[t.List[t.Any]] = []
+    for statement in statements:
+        key = (
+            getattr(statement, "obj_type", None),
+            getattr(statement, "identity", None),
+            getattr(statement, "deferred", False),
+        )
+        if groups and groups[-1][0] == key and key[1] is not None:
+            groups[-1][1].append(str(statement))
+        else:
+            groups.append([key, [str(statement)]])
+    groups.sort(key=lambda g: g[0][2])
+
+    def related(identity: str) -> t.Set[str]:
+        rv = {identity}
+        for inspection in (source, target):
+            if identity in inspection:
+                rv.update(inspection.graph.ancestors(identity))
+                rv.update(inspection.graph.descendants(identity))
+        return rv
+
+    def is_barrier(
+        obj_type: t.Optional[str],
+        identity: t.Optional[str],
+    ) -> bool:
+        return obj_type in BARRIER_TYPES or identity is None
+
+    # Groups planned for related objects are joined, but never across
+    # a barrier.
+    joined = list(range(len(groups)))
+
+    def find(i: int) -> int:
+        while joined[i] != i:
+            joined[i] = joined[joined[i]]
+            i = joined[i]
+        return i
+
+    seen: t.Dict[str, int] = {}
+    for i, ((obj_type, identity, deferred), _) in enumerate(groups):
+        if deferred:
+            break
+        if is_barrier(obj_type, identity):
+            seen = {}
+            continue
+        for r in related(identity):
+            if r in seen:
+                joined[find(seen[r])] = find(i)
+        seen[identity] = i
+
+    rv: t.List[Task] = []
+    task_of: t.Dict[int, int] = {}
+    last: t.Dict[str, int] = {}
+    barrier: t.Optional[int] = None
+    since_barrier: t.List[int] = []
+    for i, ((obj_type, identity, deferred), group) in enumerate(groups):
+        root = find(i)
+        if root in task_of:
+            rv[task_of[root]].statements.extend(group)
+            last[identity] = task_of[root]
+            continue
+        task_of[root] = n = len(rv)
+        after = set() if barrier is None else {barrier}
+        if is_barrier(obj_type, identity):
+            after.update(since_barrier)
+            barrier, since_barrier = n, []
+        else:
+            if deferred:
+                after.update(last[r] for r in related(identity) if r in last)
+            since_barrier.append(n)
+        if identity is not None:
+            last[identity] = n
+        rv.append(Task(
+            obj_type, identity, list(group), deferred, frozenset(after)))
+    return rv
@@ -0,0 +1,152 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+from copy import copy
+import queue
+import threading
+from time import monotonic
+import typing as t
+
+from .utils import (
+    _temporary_name,
+    create_database,
+    drop_database,
+    parse_db_dsn,
+)
+
+
+class ScratchPool:
+
+    # Keeps `size` empty databases ready. A database handed out by
+    # `acquire` is dropped and re-created (from `template`, if given)
+    # in the background once it is released, unless the borrower
+    # committed nothing to it. Databases that fail to reset are
+    # retired; once all are, `acquire` raises. The pool can only be
+    # closed once every database is back.
+
+    def __init__(
+        self,
+        dsn: str,
+        size: int = 4,
+        template: str = "",
+        prefix: str = "pgdiff_pool_",
+    ) -> None:
+        self.dsn = dsn
+        self.size = size
+        self.template = template
+        self.prefix = prefix
+        # None wakes up waiters once every database is retired.
+        self._available: "queue.Queue[t.Optional[str]]" = queue.Queue()
+        self._databases: t.List[str] = []
+        self._executor = ThreadPoolExecutor(max_workers=size)
+        self._lock = threading.Lock()
+        self._acquired = 0
+        self._in_use = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._resets = 0
+        self._reset_failures = 0
+
+    def _dsn(self, name: str) -> str:
+        params = copy(parse_db_dsn(self.dsn))
+        params.database = name
+        return params.to_dsn()
+
+    def _create(self, name: str) -> None:
+        create_database(self._dsn(name), template=self.template)
+        self._available.put(name)
+
+    def _reset(self, name: str) -> None:
+        try:
+            drop_database(self._dsn(name))
+            create_database(self._dsn(name), template=self.template)
+        except Exception:  # pylint: disable=broad-except
+            # The database is retired, the pool shrinks by one.
+            with self._lock:
+                self._reset_failures += 1
+                self._databases.remove(name)
+                exhausted = not self._databases
+            if exhausted:
+                self._available.put(None)
+            return
+        with self._lock:
+            self._resets += 1
+        self._available.put(name)
+
+    def start(self) -> "ScratchPool":
+        names = [_temporary_name(self.prefix) for _ in range(self.size)]
+        self._databases.extend(names)
+        for future in [self._executor.submit(self._create, n) for n in names]:
+            future.result()
+        return self
+
+    @contextlib.contextmanager
+    def acquire(
+        self,
+        timeout: t.Optional[float] = None,
+        committed: bool = True,
+    ) -> t.Iterator[str]:
+        # Without `committed`, the borrower promises to leave nothing
+        # behind, e.g. by only loading the schema in a transaction that
+        # is rolled back, and the database is handed back as it is.
+        started = monotonic()
+        try:
+            name = self._available.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(
+                "scratch pool timed out: no database available after "
+                "{}s, {} in use".format(timeout, self._in_use)) from None
+        if name is None:
+            self._available.put(None)
+            raise RuntimeError(
+                "scratch pool exhausted: all {} databases were retired "
+                "after failing to reset".format(self.size))
+        wait = monotonic() - started
+        with self._lock:
+            self._acquired += 1
+            self._in_use += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+        try:
+            yield self._dsn(name)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            if committed:
+                self._executor.submit(self._reset, name)
+            else:
+                self._available.put(name)
+
+    def stats(self) -> t.Dict[str, t.Any]:
+        with self._lock:
+            return {
+                "size": len(self._databases),
+                "available": (
+                    self._available.qsize() if self._databases else 0),
+                "in_use": self._in_use,
+                "acquired": self._acquired,
+                "total_wait": self._total_wait,
+                "max_wait": self._max_wait,
+                "mean_wait": (
+                    self._total_wait / self._acquired if self._acquired else 0.0
+                ),
+                "resets": self._resets,
+                "reset_failures": self._reset_failures,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            in_use = self._in_use
+        if in_use:
+            raise RuntimeError(
+                "scratch pool in use: {} databases are still acquired"
+                .format(in_use))
+        self._executor.shutdown(wait=True)
+        for name in self._databases:
+            drop_database(self._dsn(name))
+        self._databases = []
+
+    def __enter__(self) -> "ScratchPool":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
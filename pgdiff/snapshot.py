@@ -0,0 +1,52 @@
+import json
+import typing as t
+
+from . import objects as obj
+from .inspect import Inspection
+
+
+FORMAT_VERSION = 1
+
+
+def to_dict(inspection: Inspection) -> dict:
+    return {
+        "version": FORMAT_VERSION,
+        "pg_version": inspection.ctx.get("pg_version"),
+        "objects": [o.to_dict() for o in inspection.objects.values()],
+        "dependencies": list(inspection.dependency_pairs()),
+    }
+
+
+def from_dict(data: dict) -> Inspection:
+    version = data.get("version")
+    if version != FORMAT_VERSION:
+        raise ValueError(
+            "unsupported snapshot version: expected {}, got {!r}".format(
+                FORMAT_VERSION, version))
+    dependencies = [
+        obj.Dependency(identity=i, dependency_identity=di)
+        for i, di in data["dependencies"]
+    ]
+    return Inspection(
+        objects=[obj.from_dict(o) for o in data["objects"]],
+        dependencies=dependencies,
+        ctx={"pg_version": data["pg_version"]},
+    )
+
+
+def dumps(inspection: Inspection) -> str:
+    return json.dumps(
+        to_dict(inspection), separators=(",", ":"), default=str)
+
+
+def loads(text: str) -> Inspection:
+    return from_dict(json.loads(text))
+
+
+def dump(inspection: Inspection, file: t.TextIO) -> None:
+    file.write(dumps(inspection))
+    file.write("\n")
+
+
+def load(file: t.TextIO) -> Inspection:
+    return loads(file.read())
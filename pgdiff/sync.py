@@ -1,34 +1,555 @@
+from concurrent.futures import ThreadPoolExecutor
 import contextlib
+import functools
+import json
 import sys
+import time
 import typing as t
 
-from psycopg2.extras import RealDictCursor  # type: ignore
+import psycopg2  # type: ignore
 
-from .inspect import inspect
-from .utils import temp_db, quick_cursor
+from . import cache as snapshot_cache, snapshot
+from .apply import Timing, apply as apply_statements, apply_parallel
+from .inspect import (
+    IncrementalInspector,
+    Inspection,
+    inspect,
+    inspect_parallel,
+)
+from .plan import Step, explain as explain_plan, tasks as plan_tasks
+from .pool import ScratchPool
+from .utils import (
+    apply_schema,
+    connection_pool,
+    ensure_scratch_db,
+    ensure_template_db,
+    has_transaction_control,
+    quick_cursor,
+    temp_db,
+)
 
 
-def _wrap(statements: t.Iterable[str], rollback: bool = False) -> str:
-    end = "ROLLBACK" if rollback else "COMMIT"
-    script = "SET check_function_bodies = false;\n\n"
-    script += "BEGIN;\n\n%s\n\n%s;" % ("\n\n".join(statements), end)
-    return script
+TARGET_MODES = ("temp", "template", "transaction")
+EXPLAIN_FORMATS = ("text", "json")
+
+
+def _write_note(statement: str, file: t.TextIO) -> None:
+    note = getattr(statement, "note", None)
+    if note is not None:
+        file.write("-- %s\n" % note)
+
+
+def _write_script(
+    statements: t.Iterable[str],
+    file: t.TextIO,
+    rollback: bool = False,
+) -> bool:
+    # Statements are written out as they are generated. Deferred
+    # statements can not run inside the transaction and follow it,
+    # each on its own; a dry run only lists them, commented out.
+    # Nothing is written when there are no statements.
+    started = False
+    deferred = []
+    for statement in statements:
+        if getattr(statement, "deferred", False):
+            deferred.append(statement)
+            continue
+        if started:
+            file.write("\n\n")
+        else:
+            file.write("SET check_function_bodies = false;\n\n")
+            file.write("BEGIN;\n\n")
+            started = True
+        _write_note(statement, file)
+        file.write(statement)
+    if started:
+        file.write("\n\n%s;" % ("ROLLBACK" if rollback else "COMMIT"))
+    for i, statement in enumerate(deferred):
+        if started or i:
+            file.write("\n\n")
+        _write_note(statement, file)
+        if rollback:
+            file.write("\n".join(
+                "-- " + line for line in statement.splitlines()))
+        else:
+            file.write(statement)
+    return started or bool(deferred)
+
+
+def _write_stats(inspection: Inspection, file: t.TextIO) -> None:
+    stats = inspection.diff_stats
+    file.write(
+        "Compared %d objects, %d unchanged by content hash, %d diffed.\n"
+        % (
+            stats["compared"],
+            stats["hash_hits"],
+            stats["compared"] - stats["hash_hits"],
+        )
+    )
+
+
+def _write_timings(timings: t.Iterable[Timing], file: t.TextIO) -> None:
+    # One line per statement as it completes, then the totals.
+    count = 0
+    total = 0.0
+    total_wait = 0.0
+    file.write("%10s %10s  %s\n" % ("ms", "lock ms", "statement"))
+    for timing in timings:
+        count += 1
+        total += timing.duration
+        total_wait += timing.lock_wait
+        first_line = timing.statement.strip().splitlines()[0]
+        if len(first_line) > 60:
+            first_line = first_line[:57] + "..."
+        file.write("%10.1f %10.1f  %s\n" % (
+            timing.duration * 1000, timing.lock_wait * 1000, first_line))
+        file.flush()
+    file.write("%10.1f %10.1f  total for %d statements\n" % (
+        total * 1000, total_wait * 1000, count))
+
+
+def _write_plan(steps: t.Iterable[Step], file: t.TextIO) -> None:
+    # The script, with what each statement locks and does to the
+    # existing rows in a comment above it.
+    # Deferred steps run after the others have committed.
+    count = 0
+    effects: t.Dict[str, int] = {}
+    for step in sorted(steps, key=lambda s: s.deferred):
+        notes = []
+        if step.lock is None and not step.referenced:
+            notes.append("no lock on existing relations")
+        elif step.lock is not None:
+            notes.append("%s on %s" % (step.lock, step.relation))
+        for relation in step.referenced:
+            notes.append("SHARE ROW EXCLUSIVE on %s" % relation)
+        if step.effect is not None:
+            effects[step.effect] = effects.get(step.effect, 0) + 1
+            notes.append(step.effect)
+        if step.pages is not None and step.tuples is not None:
+            notes.append("~%d pages, ~%d rows" % (step.pages, step.tuples))
+        if step.deferred:
+            notes.append("after commit")
+        if step.note is not None:
+            notes.append(step.note)
+        if count:
+            file.write("\n\n")
+        file.write("-- %s\n%s" % (", ".join(notes), step.statement))
+        count += 1
+    if count:
+        file.write("\n\n")
+    file.write("-- %d statements%s\n" % (count, "".join(
+        ", %d %s" % (n, effect) for effect, n in sorted(effects.items()))))
+
+
+def _write_explained(
+    steps: t.List[Step],
+    output_format: str,
+    file: t.TextIO,
+) -> None:
+    if output_format == "json":
+        json.dump(
+            [s._asdict() for s in sorted(steps, key=lambda s: s.deferred)],
+            file,
+            indent=2,
+        )
+        file.write("\n")
+    else:
+        _write_plan(steps, file)
+
+
+def _inspect_dsn(
+    dsn: str,
+    schemas: t.Optional[t.List[str]] = None,
+    batch: bool = False,
+    jobs: int = 1,
+    itersize: t.Optional[int] = None,
+) -> Inspection:
+    if jobs > 1 and not batch:
+        with connection_pool(dsn, jobs) as pool:
+            return inspect_parallel(
+                pool, include=schemas, jobs=jobs, itersize=itersize)
+    with quick_cursor(dsn) as cursor:
+        return inspect(
+            cursor, include=schemas, batch=batch, itersize=itersize)
+
+
+def _inspect_loaded(
+    cursor,
+    schema: str,
+    schemas: t.Optional[t.List[str]] = None,
+    batch: bool = False,
+    prepare: bool = False,
+    itersize: t.Optional[int] = None,
+) -> Inspection:
+    # The schema is never committed, so it can only be inspected
+    # on the connection that loaded it.
+    try:
+        cursor.execute(schema)
+        return inspect(
+            cursor, include=schemas, batch=batch,
+            prepare=prepare, itersize=itersize)
+    finally:
+        cursor.connection.rollback()
+
+
+def _inspect_current(
+    cursor,
+    dsn: t.Optional[str],
+    schemas: t.Optional[t.List[str]] = None,
+    batch: bool = False,
+    jobs: int = 1,
+    cache: t.Optional[snapshot_cache.SnapshotCache] = None,
+    prepare: bool = False,
+    itersize: t.Optional[int] = None,
+) -> Inspection:
+    key = None
+    if cache is not None:
+        key = snapshot_cache.catalog_key(cursor, schemas)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    if dsn is not None and jobs > 1 and not batch:
+        rv = _inspect_dsn(dsn, schemas, batch, jobs, itersize)
+    else:
+        rv = inspect(
+            cursor, include=schemas, batch=batch,
+            prepare=prepare, itersize=itersize)
+
+    if cache is not None and key is not None:
+        cache.put(key, rv)
+    return rv
+
+
+def _inspect_target(
+    schema: str,
+    dsn: str,
+    pg_version: int,
+    schemas: t.Optional[t.List[str]] = None,
+    batch: bool = False,
+    jobs: int = 1,
+    cache: t.Optional[snapshot_cache.SnapshotCache] = None,
+    target_mode: str = "temp",
+    scratch_pool: t.Optional[ScratchPool] = None,
+    itersize: t.Optional[int] = None,
+) -> Inspection:
+    key = None
+    if cache is not None:
+        key = snapshot_cache.schema_key(schema, pg_version, schemas)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    if target_mode == "transaction" and has_transaction_control(schema):
+        # The schema would commit itself into the shared scratch
+        # database, so it gets a database of its own.
+        target_mode = "temp"
+
+    if target_mode == "template":
+        template_dsn = ensure_template_db(dsn, schema)
+        rv = _inspect_dsn(template_dsn, schemas, batch, jobs, itersize)
+    elif target_mode == "transaction":
+        with quick_cursor(ensure_scratch_db(dsn)) as target:
+            rv = _inspect_loaded(
+                target, schema, schemas, batch, itersize=itersize)
+    else:
+        # A pooled scratch database stands in for a freshly
+        # created temporary one.
+        parallel = jobs > 1 and not batch
+        if scratch_pool is not None:
+            # The schema is only committed for a parallel inspection,
+            # otherwise the pooled database needs no reset.
+            scratch = scratch_pool.acquire(
+                committed=parallel or has_transaction_control(schema))
+        else:
+            scratch = temp_db(dsn)
+        with scratch as temp_db_dsn:
+            if parallel:
+                apply_schema(temp_db_dsn, schema)
+                rv = _inspect_dsn(
+                    temp_db_dsn, schemas, batch, jobs, itersize)
+            else:
+                with quick_cursor(temp_db_dsn) as target:
+                    rv = _inspect_loaded(
+                        target, schema, schemas, batch, itersize=itersize)
+
+    if cache is not None and key is not None:
+        cache.put(key, rv)
+    return rv
+
+
+def _check_explain(explain: t.Optional[str]) -> None:
+    if explain is not None and explain not in EXPLAIN_FORMATS:
+        raise ValueError(
+            "invalid plan format: expected one of {}, got {!r}".format(
+                ", ".join(EXPLAIN_FORMATS), explain))
 
 
 def sync(
     schema: str,
     dsn: str,
     schemas: t.Optional[t.List[str]] = None,
-    dry_run: bool = True
+    dry_run: bool = True,
+    batch: bool = False,
+    jobs: int = 1,
+    cache: t.Optional[snapshot_cache.SnapshotCache] = None,
+    target_mode: str = "temp",
+    scratch_pool: t.Optional[ScratchPool] = None,
+    stats: bool = False,
+    itersize: t.Optional[int] = None,
+    apply: bool = False,
+    online: bool = False,
+    explain: t.Optional[str] = None,
+    apply_jobs: int = 1,
+) -> None:
+    # With `explain`, one of EXPLAIN_FORMATS, the planned statements
+    # are annotated with their locks and costs instead of written out
+    # as a script. With `apply_jobs`, the steps for unrelated objects
+    # are applied on up to that many connections at once, each group
+    # in a transaction of its own; see plan.tasks().
+    if target_mode not in TARGET_MODES:
+        raise ValueError(
+            "invalid target mode: expected one of {}, got {!r}".format(
+                ", ".join(TARGET_MODES), target_mode))
+    if scratch_pool is not None and target_mode != "temp":
+        raise ValueError(
+            "invalid sync options: a scratch pool only stands in for "
+            "temporary databases, got target mode {!r}".format(target_mode))
+    _check_explain(explain)
+    if explain is not None and apply:
+        raise ValueError(
+            "invalid sync options: a plan is either explained or applied")
+    if apply_jobs > 1 and (not apply or dry_run):
+        raise ValueError(
+            "invalid sync options: parallel steps commit on their own, "
+            "and only run when applying for real")
+    with quick_cursor(dsn) as current:
+        inspect_target = functools.partial(
+            _inspect_target, schema, dsn, current.connection.server_version,
+            schemas, batch, jobs, cache, target_mode, scratch_pool,
+            itersize=itersize)
+        inspect_current = functools.partial(
+            _inspect_current, current, dsn, schemas, batch, jobs, cache,
+            itersize=itersize)
+        if jobs > 1:
+            # Both databases are inspected at once, each with up
+            # to `jobs` connections.
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                target_future = executor.submit(inspect_target)
+                current_future = executor.submit(inspect_current)
+                target_schema = target_future.result()
+                current_schema = current_future.result()
+        else:
+            target_schema = inspect_target()
+            current_schema = inspect_current()
+
+        if apply and apply_jobs > 1:
+            current.connection.rollback()
+            with connection_pool(dsn, apply_jobs) as pool:
+                _write_timings(
+                    apply_parallel(
+                        pool,
+                        plan_tasks(
+                            target_schema.iter_diff(
+                                current_schema, online=online),
+                            current_schema,
+                            target_schema,
+                        ),
+                        apply_jobs,
+                    ),
+                    sys.stdout,
+                )
+        elif apply:
+            # The statements run on the inspected connection itself,
+            # in a fresh transaction; a dry run is rolled back.
+            current.connection.rollback()
+            _write_timings(
+                apply_statements(
+                    current.connection,
+                    target_schema.iter_diff(current_schema, online=online),
+                    dsn=dsn,
+                    rollback=dry_run,
+                ),
+                sys.stdout,
+            )
+        elif explain is not None:
+            steps = explain_plan(
+                target_schema.iter_diff(current_schema, online=online),
+                current_schema,
+                target_schema,
+                current,
+            )
+            _write_explained(steps, explain, sys.stdout)
+        else:
+            _write_script(
+                target_schema.iter_diff(current_schema, online=online),
+                sys.stdout,
+                rollback=dry_run,
+            )
+    if stats:
+        _write_stats(target_schema, sys.stderr)
+
+
+@contextlib.contextmanager
+def _borrow(source) -> t.Iterator[t.Any]:
+    if hasattr(source, "getconn"):
+        conn = source.getconn()
+        try:
+            yield conn
+        finally:
+            source.putconn(conn)
+    else:
+        yield source
+
+
+def diff_databases(
+    schema: str,
+    current,
+    scratch,
+    schemas: t.Optional[t.List[str]] = None,
+    batch: bool = False,
+    cache: t.Optional[snapshot_cache.SnapshotCache] = None,
+    prepare: bool = False,
+    itersize: t.Optional[int] = None,
+    online: bool = False,
+) -> t.List[str]:
+    # `current` and `scratch` are psycopg2 connections or connection
+    # pools, to the database to diff and to an empty database. The
+    # schema is loaded into a transaction on `scratch` and rolled
+    # back, so both can be reused for any number of calls; `scratch`
+    # must not be in autocommit mode. With
+    # `prepare`, the catalog queries are prepared once per connection,
+    # with `itersize` they are read through server-side cursors. With
+    # `online`, index and constraint changes come back partly as
+    # deferred statements.
+    if has_transaction_control(schema):
+        raise ValueError(
+            "invalid schema: transaction control statements would "
+            "commit it into the scratch database")
+    with _borrow(scratch) as conn:
+        if conn.autocommit:
+            raise ValueError(
+                "invalid scratch connection: in autocommit mode, the "
+                "schema would be committed into the scratch database")
+        key = None
+        target_schema: t.Optional[Inspection] = None
+        if cache is not None:
+            key = snapshot_cache.schema_key(
+                schema, conn.server_version, schemas)
+            target_schema = cache.get(key)
+        if target_schema is None:
+            cursor = conn.cursor()
+            try:
+                target_schema = _inspect_loaded(
+                    cursor, schema, schemas, batch, prepare, itersize)
+            finally:
+                cursor.close()
+            if cache is not None and key is not None:
+                cache.put(key, target_schema)
+
+    with _borrow(current) as conn:
+        cursor = conn.cursor()
+        try:
+            current_schema = _inspect_current(
+                cursor, None, schemas, batch, cache=cache,
+                prepare=prepare, itersize=itersize)
+        finally:
+            cursor.close()
+            conn.rollback()
+
+    return target_schema.diff(current_schema, online=online)
+
+
+def watch(
+    schema_path: str,
+    dsn: str,
+    schemas: t.Optional[t.List[str]] = None,
+    interval: float = 2.0,
+    cache: t.Optional[snapshot_cache.SnapshotCache] = None,
+    target_mode: str = "transaction",
+) -> None:
+    # Prints the diff again whenever the schema file or the database
+    # changes. Only the changed object types of the database are
+    # inspected again.
+    if target_mode not in TARGET_MODES:
+        raise ValueError(
+            "invalid target mode: expected one of {}, got {!r}".format(
+                ", ".join(TARGET_MODES), target_mode))
+    with quick_cursor(dsn) as current:
+        inspector = IncrementalInspector(
+            current, include=schemas, prepare=True)
+        pg_version = current.connection.server_version
+        schema = None
+        target_schema = None
+        try:
+            while True:
+                with open(schema_path, "r", encoding="utf-8") as file:
+                    text = file.read()
+                target_changed = text != schema
+                if target_changed:
+                    schema = text
+                    try:
+                        target_schema = _inspect_target(
+                            schema, dsn, pg_version, schemas,
+                            cache=cache, target_mode=target_mode)
+                    except psycopg2.Error as e:
+                        # Most likely the file is halfway through an
+                        # edit; wait for the next one.
+                        sys.stderr.write("Could not load schema: %s\n" % e)
+                        target_schema = None
+                current_changed = bool(inspector.refresh())
+                if target_schema is not None and (
+                    target_changed or current_changed
+                ):
+                    assert inspector.inspection is not None
+                    sys.stdout.write(
+                        "-- %s\n\n" % time.strftime("%Y-%m-%d %H:%M:%S"))
+                    written = _write_script(
+                        target_schema.iter_diff(inspector.inspection),
+                        sys.stdout,
+                        rollback=True,
+                    )
+                    if not written:
+                        sys.stdout.write("-- In sync.")
+                    sys.stdout.write("\n\n")
+                    sys.stdout.flush()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+
+def dump(
+    dsn: str,
+    schemas: t.Optional[t.List[str]] = None,
+    batch: bool = False,
+    itersize: t.Optional[int] = None,
+) -> None:
+    with quick_cursor(dsn) as cursor:
+        inspection = inspect(
+            cursor, include=schemas, batch=batch, itersize=itersize)
+    snapshot.dump(inspection, sys.stdout)
+
+
+def diff_snapshots(
+    source: t.TextIO,
+    target: t.TextIO,
+    dry_run: bool = True,
+    stats: bool = False,
+    online: bool = False,
+    explain: t.Optional[str] = None,
 ) -> None:
-    with contextlib.ExitStack() as stack:
-        temp_db_dsn = stack.enter_context(temp_db(dsn))
-        target = stack.enter_context(quick_cursor(temp_db_dsn, RealDictCursor))
-        current = stack.enter_context(quick_cursor(dsn, RealDictCursor))
-        target.execute(schema)
-        target_schema = inspect(target, include=schemas)
-        current_schema = inspect(current, include=schemas)
-
-    statements = target_schema.diff(current_schema)
-    if statements:
-        sys.stdout.write(_wrap(statements, rollback=dry_run))
+    _check_explain(explain)
+    source_schema = snapshot.load(source)
+    target_schema = snapshot.load(target)
+    statements = target_schema.iter_diff(source_schema, online=online)
+    if explain is not None:
+        # Without a database, there are no relation sizes.
+        _write_explained(
+            explain_plan(statements, source_schema, target_schema),
+            explain,
+            sys.stdout,
+        )
+    else:
+        _write_script(statements, sys.stdout, rollback=dry_run)
+    if stats:
+        _write_stats(target_schema, sys.stderr)
@@ -1,14 +1,21 @@
 import random
+import re
 import string
 import contextlib
 from copy import copy
+import hashlib
 import os
+import typing as t
 import urllib.parse
-from time import sleep
+from time import sleep, time
 
 from psycopg2 import connect as db_connect, sql  # type: ignore
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT  # type: ignore
-from psycopg2.errors import InsufficientPrivilege  # type: ignore
+from psycopg2.errors import (  # type: ignore
+    DuplicateDatabase,
+    InsufficientPrivilege,
+)
+from psycopg2.pool import ThreadedConnectionPool  # type: ignore
 
 
 KILL_CONN = """
@@ -17,6 +24,39 @@ KILL_CONN = """
         AND pid != pg_backend_pid();
 """
 
+LIST_TEMPLATES = """
+    SELECT datname, shobj_description(oid, 'pg_database')
+    FROM pg_catalog.pg_database
+    WHERE datname LIKE %s
+"""
+
+TEMPLATE_PREFIX = "pgdiff_tpl_"
+
+TEMPLATE_DESCRIPTION = """
+    SELECT shobj_description(oid, 'pg_database')
+    FROM pg_catalog.pg_database
+    WHERE datname = %s
+"""
+
+# Statements that end or start a transaction. A bare BEGIN or END is
+# also how PL/pgSQL blocks start and end, so only the forms that can
+# not be one count.
+TRANSACTION_CONTROL = re.compile(
+    r"(?:^|;)\s*(?:"
+    r"BEGIN\s*(?:;|TRANSACTION\b|WORK\b|ISOLATION\b|READ\b)"
+    r"|START\s+TRANSACTION\b"
+    r"|(?:COMMIT|ROLLBACK|ABORT)\b"
+    r"|END\s+(?:TRANSACTION|WORK)\b"
+    r"|PREPARE\s+TRANSACTION\b"
+    r")",
+    re.IGNORECASE | re.MULTILINE,
+)
+SCRATCH_DATABASE = "pgdiff_scratch"
+TEMPLATE_COMMENT = "pgdiff template, last used at "
+# Seconds before a template's last use is recorded again. Recording it
+# is a catalog write, which every run would otherwise make.
+TEMPLATE_TOUCH_INTERVAL = 600
+
 
 class DBConnParams:
 
@@ -187,16 +227,16 @@ def parse_db_dsn(dsn: str) -> DBConnParams:
 
 
 def database_exists(conn, name):
-    cur = conn.execute()
-    result = cur.execute(
+    cur = conn.cursor()
+    cur.execute(
         """
         SELECT 1
         FROM pg_catalog.pg_database
         WHERE datname = %s
         """,
-        name
+        (name, )
     )
-    return bool(result)
+    return cur.fetchone() is not None
 
 
 def _temporary_name(prefix="tmp_"):
@@ -289,6 +329,132 @@ def temp_db(dsn: str, template: str = "", quiet: bool = True):
         drop_database(temp_db_dsn)
 
 
+def apply_schema(dsn: str, schema: str):
+    conn = db_connect(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute(schema)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def template_name(schema: str) -> str:
+    digest = hashlib.sha256(schema.encode()).hexdigest()
+    return TEMPLATE_PREFIX + digest[:32]
+
+
+def _last_used(comment: t.Optional[str]) -> float:
+    if comment and comment.startswith(TEMPLATE_COMMENT):
+        return float(comment[len(TEMPLATE_COMMENT):])
+    return 0.0
+
+
+def _touch_template(conn, name: str):
+    cur = conn.cursor()
+    cur.execute(TEMPLATE_DESCRIPTION, (name, ))
+    row = cur.fetchone()
+    last_used = _last_used(row[0]) if row is not None else 0.0
+    if time() - last_used < TEMPLATE_TOUCH_INTERVAL:
+        return
+    cur.execute(
+        sql.SQL("COMMENT ON DATABASE {} IS {}").format(
+            sql.Identifier(name),
+            sql.Literal(TEMPLATE_COMMENT + str(int(time()))),
+        )
+    )
+
+
+def ensure_template_db(dsn: str, schema: str, quiet: bool = True) -> str:
+    params = copy(parse_db_dsn(dsn))
+    params.database = template_name(schema)
+    conn = admin_connect(dsn)
+    try:
+        if not database_exists(conn, params.database):
+            if not quiet:
+                print(f"Creating template database {params.database}.")
+            # The schema is loaded under a temporary name, so that
+            # concurrent runs never see a half-built template.
+            build_params = copy(params)
+            build_params.database = _temporary_name()
+            build_dsn = build_params.to_dsn()
+            create_database(build_dsn)
+            try:
+                apply_schema(build_dsn, schema)
+                cur = conn.cursor()
+                cur.execute(
+                    sql.SQL("ALTER DATABASE {} RENAME TO {}").format(
+                        sql.Identifier(build_params.database),
+                        sql.Identifier(params.database),
+                    )
+                )
+            except DuplicateDatabase:
+                drop_database(build_dsn)
+            except BaseException:
+                drop_database(build_dsn)
+                raise
+        _touch_template(conn, params.database)
+    finally:
+        conn.close()
+    return params.to_dsn()
+
+
+def has_transaction_control(schema: str) -> bool:
+    # May also match inside function bodies, which only errs on the
+    # safe side.
+    return TRANSACTION_CONTROL.search(schema) is not None
+
+
+def ensure_scratch_db(dsn: str, name: str = SCRATCH_DATABASE) -> str:
+    # The scratch database is shared by every run against the server.
+    # Schemas loaded into it must never be committed; concurrent runs
+    # take conflicting catalog locks on the objects they create, such as
+    # names in the same schema, and so wait for one another.
+    params = copy(parse_db_dsn(dsn))
+    params.database = name
+    conn = admin_connect(dsn)
+    try:
+        if not database_exists(conn, name):
+            try:
+                create_database(params.to_dsn())
+            except DuplicateDatabase:
+                pass
+    finally:
+        conn.close()
+    return params.to_dsn()
+
+
+def gc_templates(
+    dsn: str,
+    keep: int = 0,
+    max_age: t.Optional[float] = None,
+    quiet: bool = True,
+) -> t.List[str]:
+    conn = admin_connect(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute(LIST_TEMPLATES, (TEMPLATE_PREFIX.replace("_", "\\_") + "%", ))
+        templates = []
+        for name, comment in cur.fetchall():
+            templates.append((_last_used(comment), name))
+    finally:
+        conn.close()
+
+    templates.sort(reverse=True)
+    now = time()
+    params = copy(parse_db_dsn(dsn))
+    dropped = []
+    for i, (last_used, name) in enumerate(templates):
+        stale = max_age is not None and now - last_used > max_age
+        if i >= keep or stale:
+            if not quiet:
+                print(f"Dropping template database {name}.")
+            params.database = name
+            drop_database(params.to_dsn())
+            dropped.append(name)
+    return dropped
+
+
 @contextlib.contextmanager
 def quick_cursor(dsn, cursor_factory=None):
     conn = db_connect(dsn)
@@ -300,3 +466,12 @@ def quick_cursor(dsn, cursor_factory=None):
         yield cur
     finally:
         conn.close()
+
+
+@contextlib.contextmanager
+def connection_pool(dsn, size: int):
+    pool = ThreadedConnectionPool(1, size, dsn)
+    try:
+        yield pool
+    finally:
+        pool.closeall()
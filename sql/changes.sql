@@ -0,0 +1,153 @@
+WITH versions AS (
+
+    SELECT
+        'table' AS obj_type,
+        c.oid AS oid,
+        concat_ws(
+            ',',
+            n.xmin,
+            c.xmin,
+            (
+                SELECT string_agg(a.xmin::text, ',' ORDER BY a.attnum)
+                FROM pg_catalog.pg_attribute a
+                WHERE a.attrelid = c.oid AND a.attnum > 0
+            ),
+            (
+                SELECT string_agg(ad.xmin::text, ',' ORDER BY ad.adnum)
+                FROM pg_catalog.pg_attrdef ad
+                WHERE ad.adrelid = c.oid
+            ),
+            (
+                SELECT string_agg(ct.xmin::text, ',' ORDER BY ct.oid)
+                FROM pg_catalog.pg_constraint ct
+                WHERE ct.conrelid = c.oid
+            ),
+            (
+                SELECT string_agg(i.xmin::text, ',' ORDER BY i.inhparent)
+                FROM pg_catalog.pg_inherits i
+                WHERE i.inhrelid = c.oid
+            )
+        ) AS version
+    FROM pg_catalog.pg_class c
+    INNER JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind IN ('r', 'p')
+    -- INTERNAL
+    AND n.nspname NOT LIKE 'pg_%' AND n.nspname <> 'information_schema'
+    -- SCHEMA_FILTER
+    AND n.nspname LIKE ANY(%(schemas)s::text[])
+
+    UNION ALL
+
+    SELECT
+        'view',
+        c.oid,
+        concat_ws(
+            ',',
+            n.xmin,
+            c.xmin,
+            (
+                SELECT string_agg(rw.xmin::text, ',' ORDER BY rw.oid)
+                FROM pg_catalog.pg_rewrite rw
+                WHERE rw.ev_class = c.oid
+            )
+        )
+    FROM pg_catalog.pg_class c
+    INNER JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind IN ('v', 'm')
+    -- INTERNAL
+    AND n.nspname NOT LIKE 'pg_%' AND n.nspname <> 'information_schema'
+    -- SCHEMA_FILTER
+    AND n.nspname LIKE ANY(%(schemas)s::text[])
+
+    UNION ALL
+
+    SELECT
+        'index',
+        c.oid,
+        concat_ws(',', n.xmin, c.xmin, x.xmin, tc.xmin)
+    FROM pg_catalog.pg_index x
+    INNER JOIN pg_catalog.pg_class c ON c.oid = x.indexrelid
+    INNER JOIN pg_catalog.pg_class tc ON tc.oid = x.indrelid
+    INNER JOIN pg_catalog.pg_namespace n ON n.oid = tc.relnamespace
+    -- INTERNAL
+    WHERE n.nspname NOT LIKE 'pg_%' AND n.nspname <> 'information_schema'
+    -- SCHEMA_FILTER
+    AND n.nspname LIKE ANY(%(schemas)s::text[])
+
+    UNION ALL
+
+    SELECT
+        'sequence',
+        c.oid,
+        concat_ws(
+            ',',
+            n.xmin,
+            c.xmin
+            -- 10_AND_LATER
+            , (SELECT s.xmin FROM pg_catalog.pg_sequence s WHERE s.seqrelid = c.oid)
+        )
+    FROM pg_catalog.pg_class c
+    INNER JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind = 'S'
+    -- INTERNAL
+    AND n.nspname NOT LIKE 'pg_%' AND n.nspname <> 'information_schema'
+    -- SCHEMA_FILTER
+    AND n.nspname LIKE ANY(%(schemas)s::text[])
+
+    UNION ALL
+
+    SELECT
+        'enum',
+        t.oid,
+        concat_ws(
+            ',',
+            n.xmin,
+            t.xmin,
+            (
+                SELECT string_agg(e.xmin::text, ',' ORDER BY e.oid)
+                FROM pg_catalog.pg_enum e
+                WHERE e.enumtypid = t.oid
+            )
+        )
+    FROM pg_catalog.pg_type t
+    INNER JOIN pg_catalog.pg_namespace n ON n.oid = t.typnamespace
+    WHERE t.typcategory = 'E'
+    -- INTERNAL
+    AND n.nspname NOT LIKE 'pg_%' AND n.nspname <> 'information_schema'
+    -- SCHEMA_FILTER
+    AND n.nspname LIKE ANY(%(schemas)s::text[])
+
+    UNION ALL
+
+    SELECT
+        'function',
+        p.oid,
+        concat_ws(',', n.xmin, p.xmin)
+    FROM pg_catalog.pg_proc p
+    INNER JOIN pg_catalog.pg_namespace n ON n.oid = p.pronamespace
+    -- INTERNAL
+    WHERE n.nspname NOT LIKE 'pg_%' AND n.nspname <> 'information_schema'
+    -- SCHEMA_FILTER
+    AND n.nspname LIKE ANY(%(schemas)s::text[])
+
+    UNION ALL
+
+    SELECT
+        'trigger',
+        tg.oid,
+        concat_ws(',', n.xmin, tg.xmin, c.xmin)
+    FROM pg_catalog.pg_trigger tg
+    INNER JOIN pg_catalog.pg_class c ON c.oid = tg.tgrelid
+    INNER JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    WHERE NOT tg.tgisinternal
+    -- INTERNAL
+    AND n.nspname NOT LIKE 'pg_%' AND n.nspname <> 'information_schema'
+    -- SCHEMA_FILTER
+    AND n.nspname LIKE ANY(%(schemas)s::text[])
+
+)
+SELECT
+    v.obj_type,
+    v.oid,
+    md5(v.version) AS version
+FROM versions v;
@@ -17,6 +17,8 @@ WITH extensions AS (
 	AND c.relkind in ('r', 'v', 'm', 'c', 'p')
 	AND e.oid IS null
 	AND n.nspname NOT LIKE 'pg_%' AND n.nspname <> 'information_schema'
+	-- SCHEMA_FILTER
+	AND n.nspname LIKE ANY(%(schemas)s::text[])
 
 ), enum_types AS (
 
@@ -29,6 +31,8 @@ WITH extensions AS (
 	WHERE t.typcategory = 'E'
 	AND e.oid IS null
 	AND n.nspname NOT LIKE 'pg_%' AND n.nspname <> 'information_schema'
+	-- SCHEMA_FILTER
+	AND n.nspname LIKE ANY(%(schemas)s::text[])
 
 ), combined_types AS (
 
@@ -63,9 +67,13 @@ WITH extensions AS (
     LEFT OUTER JOIN extensions e ON e.oid = p.oid
 	-- 11_AND_LATER
 	WHERE p.prokind <> 'a'
+	-- BEFORE_11
+	WHERE NOT p.proisagg
     AND e.oid IS null
 	-- INTERNAL
     AND n.nspname NOT LIKE 'pg_%' AND n.nspname <> 'information_schema'
+	-- SCHEMA_FILTER
+    AND n.nspname LIKE ANY(%(schemas)s::text[])
 
 ), function_return_types AS (
 
@@ -76,6 +84,8 @@ WITH extensions AS (
         ct.identity as rtype
     FROM functions f
     INNER JOIN combined_types ct ON ct.oid = f.rtype
+    -- OIDS
+    WHERE f.oid = ANY(%(oids)s::oid[])
 
 ), _function_arg_types_raw AS (
 
@@ -83,6 +93,8 @@ WITH extensions AS (
         f.oid,
         UNNEST(f.argtypes) as argtype
     FROM functions f
+    -- OIDS
+    WHERE f.oid = ANY(%(oids)s::oid[])
 
 ), _function_arg_types AS (
 
@@ -140,6 +152,8 @@ WITH extensions AS (
 	WHERE c.oid NOT IN (SELECT ftrelid FROM pg_foreign_table)
 	-- INTERNAL
     AND n.nspname NOT LIKE 'pg_%' AND n.nspname <> 'information_schema'
+	-- SCHEMA_FILTER
+    AND n.nspname LIKE ANY(%(schemas)s::text[])
 
 ), things1 AS (
 
@@ -172,6 +186,12 @@ WITH extensions AS (
     AND n.nspname NOT LIKE 'pg_%' AND n.nspname <> 'information_schema'
 	-- INTERNAL
     AND dn.nspname NOT LIKE 'pg_%' AND dn.nspname <> 'information_schema'
+	-- SCHEMA_FILTER
+    AND n.nspname LIKE ANY(%(schemas)s::text[])
+	-- SCHEMA_FILTER
+    AND dn.nspname LIKE ANY(%(schemas)s::text[])
+	-- OIDS
+	AND c.oid = ANY(%(oids)s::oid[])
 	AND ce.oid IS NULL
 	AND de.oid IS NULL
 
@@ -191,6 +211,10 @@ WITH extensions AS (
     AND e.oid is null
 	-- INTERNAL
 	AND n.nspname NOT like 'pg_%' AND n.nspname <> 'information_schema'
+	-- SCHEMA_FILTER
+	AND n.nspname LIKE ANY(%(schemas)s::text[])
+	-- OIDS
+	AND t.oid = ANY(%(oids)s::oid[])
 
 ), trigger_function_deps AS (
 
@@ -214,6 +238,10 @@ WITH extensions AS (
     AND e.oid is null
 	-- INTERNAL
 	AND n.nspname NOT like 'pg_%' AND n.nspname <> 'information_schema'
+	-- SCHEMA_FILTER
+	AND n.nspname LIKE ANY(%(schemas)s::text[])
+	-- OIDS
+	AND t.oid = ANY(%(oids)s::oid[])
 
 ), trigger_deps AS (
 
@@ -241,6 +269,12 @@ WITH extensions AS (
 	-- INTERNAL
 	AND n.nspname NOT like 'pg_%' AND n.nspname <> 'information_schema'
 	AND dn.nspname NOT like 'pg_%' AND dn.nspname <> 'information_schema'
+	-- SCHEMA_FILTER
+	AND n.nspname LIKE ANY(%(schemas)s::text[])
+	-- SCHEMA_FILTER
+	AND dn.nspname LIKE ANY(%(schemas)s::text[])
+	-- OIDS
+	AND i.indexrelid = ANY(%(oids)s::oid[])
 
 ), column_defined_seq_deps AS (
 
@@ -266,6 +300,12 @@ WITH extensions AS (
 		-- INTERNAL
 		AND dc.nspname NOT like 'pg_%' AND dc.nspname <> 'information_schema'
 		AND dcl.nspname NOT like 'pg_%' AND dcl.nspname <> 'information_schema'
+		-- SCHEMA_FILTER
+		AND dc.nspname LIKE ANY(%(schemas)s::text[])
+		-- SCHEMA_FILTER
+		AND dcl.nspname LIKE ANY(%(schemas)s::text[])
+		-- OIDS
+		AND cl.oid = ANY(%(oids)s::oid[])
 
 ), things AS (
 
@@ -296,6 +336,8 @@ WITH extensions AS (
 		INNER JOIN things t ON t.oid = rw.ev_class
 	WHERE d.deptype in ('n', 'a')
 	AND rw.rulename = '_RETURN'
+	-- OIDS
+	AND rw.ev_class = ANY(%(oids)s::oid[])
 
 	UNION
 
@@ -0,0 +1,103 @@
+-- Dependencies as pairs of (catalog, oid), where catalog is one of
+-- 'c' (pg_class), 'p' (pg_proc), 't' (pg_type) or 'g' (pg_trigger).
+-- Pairs are only filtered on the dependent side; extension objects and
+-- anything outside the inspected objects are dropped client-side when
+-- resolving identities.
+WITH namespaces AS (
+
+    SELECT n.oid
+    FROM pg_catalog.pg_namespace n
+    -- INTERNAL
+    WHERE n.nspname NOT LIKE 'pg_%' AND n.nspname <> 'information_schema'
+    -- SCHEMA_FILTER
+    AND n.nspname LIKE ANY(%(schemas)s::text[])
+
+)
+SELECT
+    'c' AS catalog,
+    rw.ev_class AS oid,
+    (
+        CASE WHEN d.refclassid = 'pg_catalog.pg_proc'::regclass
+        THEN 'p' ELSE 'c' END
+    ) AS dependency_catalog,
+    d.refobjid AS dependency_oid
+FROM pg_catalog.pg_depend d
+INNER JOIN pg_catalog.pg_rewrite rw ON rw.oid = d.objid
+INNER JOIN pg_catalog.pg_class c ON c.oid = rw.ev_class
+WHERE d.classid = 'pg_catalog.pg_rewrite'::regclass
+AND d.refclassid IN ('pg_catalog.pg_class'::regclass, 'pg_catalog.pg_proc'::regclass)
+AND d.deptype IN ('n', 'a')
+AND d.refobjid <> rw.ev_class
+AND rw.rulename = '_RETURN'
+AND c.relnamespace IN (SELECT oid FROM namespaces)
+-- OIDS
+AND rw.ev_class = ANY(%(oids)s::oid[])
+
+UNION ALL
+
+SELECT 'c', ct.conrelid, 'c', ct.confrelid
+FROM pg_catalog.pg_constraint ct
+WHERE ct.contype = 'f'
+AND ct.connamespace IN (SELECT oid FROM namespaces)
+-- OIDS
+AND ct.conrelid = ANY(%(oids)s::oid[])
+
+UNION ALL
+
+SELECT
+    'p',
+    p.oid,
+    CASE WHEN et.typrelid <> 0 THEN 'c' ELSE 't' END,
+    CASE WHEN et.typrelid <> 0 THEN et.typrelid ELSE et.oid END
+FROM pg_catalog.pg_proc p
+CROSS JOIN LATERAL unnest(p.proargtypes::oid[] || p.prorettype) AS a(type_oid)
+INNER JOIN pg_catalog.pg_type pt ON pt.oid = a.type_oid
+INNER JOIN pg_catalog.pg_type et ON et.oid = (
+    CASE WHEN pt.typrelid = 0 AND pt.typelem <> 0
+    THEN pt.typelem ELSE pt.oid END
+)
+WHERE p.pronamespace IN (SELECT oid FROM namespaces)
+-- OIDS
+AND p.oid = ANY(%(oids)s::oid[])
+
+UNION ALL
+
+SELECT 'g', tg.oid, 'c', tg.tgrelid
+FROM pg_catalog.pg_trigger tg
+INNER JOIN pg_catalog.pg_class c ON c.oid = tg.tgrelid
+WHERE NOT tg.tgisinternal
+AND c.relnamespace IN (SELECT oid FROM namespaces)
+-- OIDS
+AND tg.oid = ANY(%(oids)s::oid[])
+
+UNION ALL
+
+SELECT 'g', tg.oid, 'p', tg.tgfoid
+FROM pg_catalog.pg_trigger tg
+INNER JOIN pg_catalog.pg_class c ON c.oid = tg.tgrelid
+WHERE NOT tg.tgisinternal
+AND c.relnamespace IN (SELECT oid FROM namespaces)
+-- OIDS
+AND tg.oid = ANY(%(oids)s::oid[])
+
+UNION ALL
+
+SELECT 'c', x.indexrelid, 'c', x.indrelid
+FROM pg_catalog.pg_index x
+INNER JOIN pg_catalog.pg_class c ON c.oid = x.indexrelid
+WHERE c.relnamespace IN (SELECT oid FROM namespaces)
+-- OIDS
+AND x.indexrelid = ANY(%(oids)s::oid[])
+
+UNION ALL
+
+SELECT 'c', ad.adrelid, 'c', d.refobjid
+FROM pg_catalog.pg_depend d
+INNER JOIN pg_catalog.pg_attrdef ad ON ad.oid = d.objid
+INNER JOIN pg_catalog.pg_class c ON c.oid = ad.adrelid
+WHERE d.classid = 'pg_catalog.pg_attrdef'::regclass
+AND d.refclassid = 'pg_catalog.pg_class'::regclass
+AND d.deptype IN ('n', 'a')
+AND c.relnamespace IN (SELECT oid FROM namespaces)
+-- OIDS
+AND ad.adrelid = ANY(%(oids)s::oid[]);
@@ -28,6 +28,10 @@ WITH extension_oids AS (
     AND n.nspname NOT IN ('pg_internal', 'pg_catalog', 'information_schema', 'pg_toast')
     -- INTERNAL 
     AND n.nspname NOT LIKE 'pg_temp_%' AND n.nspname NOT LIKE 'pg_toast_temp_%'
+    -- SCHEMA_FILTER
+    AND n.nspname LIKE ANY(%(schemas)s::text[])
+    -- OIDS
+    AND t.oid = ANY(%(oids)s::oid[])
     ORDER BY 1, 2
 
 )
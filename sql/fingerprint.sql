@@ -0,0 +1,86 @@
+-- A cheap check for changes to the inspected catalogs: the row count,
+-- highest and summed xmin of each. Any insert, update or delete moves
+-- at least one of them.
+WITH namespaces AS (
+
+    SELECT n.oid, n.xmin
+    FROM pg_catalog.pg_namespace n
+    -- INTERNAL
+    WHERE n.nspname NOT LIKE 'pg_%' AND n.nspname <> 'information_schema'
+    -- SCHEMA_FILTER
+    AND n.nspname LIKE ANY(%(schemas)s::text[])
+
+), classes AS (
+
+    SELECT c.oid, c.xmin
+    FROM pg_catalog.pg_class c
+    WHERE c.relnamespace IN (SELECT oid FROM namespaces)
+
+), types AS (
+
+    SELECT ty.oid, ty.xmin
+    FROM pg_catalog.pg_type ty
+    WHERE ty.typnamespace IN (SELECT oid FROM namespaces)
+
+), catalog_rows AS (
+
+    SELECT 'namespace' AS catalog, xmin FROM namespaces
+    UNION ALL
+    SELECT 'class', xmin FROM classes
+    UNION ALL
+    SELECT 'attribute', a.xmin FROM pg_catalog.pg_attribute a
+    WHERE a.attrelid IN (SELECT oid FROM classes)
+    UNION ALL
+    SELECT 'attrdef', ad.xmin FROM pg_catalog.pg_attrdef ad
+    WHERE ad.adrelid IN (SELECT oid FROM classes)
+    UNION ALL
+    SELECT 'constraint', ct.xmin FROM pg_catalog.pg_constraint ct
+    WHERE ct.connamespace IN (SELECT oid FROM namespaces)
+    UNION ALL
+    SELECT 'index', x.xmin FROM pg_catalog.pg_index x
+    WHERE x.indexrelid IN (SELECT oid FROM classes)
+    -- 10_AND_LATER
+    UNION ALL SELECT 'sequence', s.xmin FROM pg_catalog.pg_sequence s WHERE s.seqrelid IN (SELECT oid FROM classes)
+    UNION ALL
+    SELECT 'proc', p.xmin FROM pg_catalog.pg_proc p
+    WHERE p.pronamespace IN (SELECT oid FROM namespaces)
+    UNION ALL
+    SELECT 'type', xmin FROM types
+    UNION ALL
+    SELECT 'enum', e.xmin FROM pg_catalog.pg_enum e
+    WHERE e.enumtypid IN (SELECT oid FROM types)
+    UNION ALL
+    SELECT 'trigger', tg.xmin FROM pg_catalog.pg_trigger tg
+    WHERE tg.tgrelid IN (SELECT oid FROM classes)
+    UNION ALL
+    SELECT 'rewrite', rw.xmin FROM pg_catalog.pg_rewrite rw
+    WHERE rw.ev_class IN (SELECT oid FROM classes)
+    UNION ALL
+    SELECT 'inherits', i.xmin FROM pg_catalog.pg_inherits i
+    WHERE i.inhrelid IN (SELECT oid FROM classes)
+    UNION ALL
+    -- Extension membership decides which objects are inspected.
+    SELECT 'extension', xmin FROM pg_catalog.pg_extension
+    UNION ALL
+    SELECT 'depend', d.xmin FROM pg_catalog.pg_depend d
+    WHERE d.refclassid = 'pg_catalog.pg_extension'::regclass
+
+), catalogs AS (
+
+    SELECT
+        catalog,
+        count(*) AS row_count,
+        max(xmin::text::bigint) AS max_xmin,
+        sum(xmin::text::bigint) AS sum_xmin
+    FROM catalog_rows
+    GROUP BY catalog
+
+)
+SELECT
+    md5(
+        string_agg(
+            concat_ws(':', catalog, row_count, max_xmin, sum_xmin),
+            ',' ORDER BY catalog
+        )
+    ) AS fingerprint
+FROM catalogs;
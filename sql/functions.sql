@@ -23,7 +23,10 @@ SELECT
     pp.proisstrict AS is_strict,
     pp.prosecdef AS is_security_definer,
     pp.provolatile AS volatility,
+    -- 11_AND_LATER
     pp.prokind AS kind,
+    -- BEFORE_11
+    (CASE WHEN pp.proisagg THEN 'a' WHEN pp.proiswindow THEN 'w' ELSE 'f' END) AS kind,
     pp.proargnames AS argnames,
     COALESCE(
         pp.proallargtypes::regtype[], pp.proargtypes::regtype[]
@@ -35,10 +38,17 @@ INNER JOIN pg_namespace n ON n.oid = pp.pronamespace
 INNER JOIN pg_language pl ON pl.oid = pp.prolang
 LEFT OUTER JOIN extension_oids e ON e.oid = pp.oid
 WHERE e.oid is null
+-- 11_AND_LATER
 AND pp.prokind != 'a'
+-- BEFORE_11
+AND NOT pp.proisagg
 -- INTERNAL 
 AND n.nspname NOT IN ('pg_internal', 'pg_catalog', 'information_schema', 'pg_toast')
 -- INTERNAL 
 AND n.nspname NOT LIKE 'pg_temp_%' 
 -- INTERNAL 
-AND n.nspname NOT LIKE 'pg_toast_temp_%';
+AND n.nspname NOT LIKE 'pg_toast_temp_%'
+-- SCHEMA_FILTER
+AND n.nspname LIKE ANY(%(schemas)s::text[])
+-- OIDS
+AND pp.oid = ANY(%(oids)s::oid[]);
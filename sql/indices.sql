@@ -38,4 +38,8 @@ AND nspname NOT IN ('pg_catalog', 'information_schema', 'pg_toast')
 -- INTERNAL 
 AND nspname NOT LIKE 'pg_temp_%' AND nspname NOT LIKE 'pg_toast_temp_%'
 AND e.oid is null
+-- SCHEMA_FILTER
+AND nspname LIKE ANY(%(schemas)s::text[])
+-- OIDS
+AND i.oid = ANY(%(oids)s::oid[])
 ORDER BY 1, 2, 3;
@@ -0,0 +1,9 @@
+-- Planner estimates of the size of each relation, as of its last
+-- VACUUM or ANALYZE. Identities that do not name a relation are left
+-- out.
+SELECT
+    i.identity,
+    c.relpages AS pages,
+    c.reltuples AS tuples
+FROM unnest(%(identities)s::text[]) AS i(identity)
+INNER JOIN pg_catalog.pg_class c ON c.oid = to_regclass(i.identity);
@@ -0,0 +1,66 @@
+WITH others AS (
+
+    SELECT unnest(%(others)s::text[]) AS identity
+
+), relations AS (
+
+    SELECT
+        o.identity,
+        (
+            CASE
+                WHEN c.relkind IN ('r', 'p') THEN 'table'
+                WHEN c.relkind IN ('v', 'm') THEN 'view'
+                WHEN c.relkind IN ('i', 'I') THEN 'index'
+                WHEN c.relkind = 'S' THEN 'sequence'
+            END
+        ) AS obj_type,
+        c.oid
+    FROM others o
+    INNER JOIN pg_catalog.pg_class c ON c.oid = to_regclass(o.identity)
+
+), enums AS (
+
+    SELECT
+        o.identity,
+        'enum' AS obj_type,
+        ty.oid
+    FROM others o
+    INNER JOIN pg_catalog.pg_type ty ON ty.oid = to_regtype(o.identity)
+    WHERE ty.typtype = 'e'
+
+), triggers AS (
+
+    SELECT
+        o.identity,
+        'trigger' AS obj_type,
+        tg.oid
+    FROM pg_catalog.pg_trigger tg
+    INNER JOIN pg_catalog.pg_class c ON c.oid = tg.tgrelid
+    INNER JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    INNER JOIN others o
+        ON o.identity = quote_ident(n.nspname) || '.' || quote_ident(tg.tgname)
+    WHERE NOT tg.tgisinternal
+
+), functions AS (
+
+    -- Identities carry argument names, which to_regprocedure()
+    -- does not accept.
+    SELECT
+        i.identity,
+        'function' AS obj_type,
+        p.oid
+    FROM pg_catalog.pg_proc p
+    INNER JOIN pg_catalog.pg_namespace n ON n.oid = p.pronamespace
+    INNER JOIN unnest(%(functions)s::text[]) AS i(identity)
+        ON i.identity = quote_ident(n.nspname) || '.' || quote_ident(p.proname)
+            || '(' || pg_get_function_identity_arguments(p.oid) || ')'
+    WHERE n.nspname <> 'pg_catalog' AND n.nspname <> 'information_schema'
+
+)
+SELECT * FROM relations WHERE obj_type IS NOT NULL
+UNION ALL
+SELECT * FROM enums
+UNION ALL
+SELECT * FROM triggers
+UNION ALL
+SELECT * FROM functions;
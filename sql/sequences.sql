@@ -1,4 +1,7 @@
 SELECT
+    (
+        quote_ident(s.sequence_schema) || '.' || quote_ident(s.sequence_name)
+    )::regclass::oid AS oid,
     s.sequence_schema AS schema,
     s.sequence_name AS name,
 	format('%I.%I', s.sequence_schema, s.sequence_name) AS identity,
@@ -18,4 +21,8 @@ WHERE sequence_schema NOT IN ('pg_internal', 'pg_catalog', 'information_schema',
 AND sequence_schema NOT LIKE 'pg_temp_%' 
 -- INTERNAL 
 AND sequence_schema NOT LIKE 'pg_toast_temp_%'
-ORDER BY 1, 2;
+-- SCHEMA_FILTER
+AND sequence_schema LIKE ANY(%(schemas)s::text[])
+-- OIDS
+AND (quote_ident(s.sequence_schema) || '.' || quote_ident(s.sequence_name))::regclass::oid = ANY(%(oids)s::oid[])
+ORDER BY 2, 3;
@@ -40,6 +40,8 @@ WITH extension_oids AS (
     INNER JOIN pg_catalog.pg_namespace n ON n.oid = ct.connamespace
     LEFT JOIN pg_catalog.pg_index idx ON idx.indexrelid = ct.conindid
     LEFT JOIN pg_catalog.pg_class ci ON ci.oid = idx.indexrelid
+    -- SCHEMA_FILTER
+    WHERE n.nspname LIKE ANY(%(schemas)s::text[])
 
 ), table_attrs AS (
 
@@ -59,13 +61,10 @@ WITH extension_oids AS (
               JOIN pg_namespace nmsp_child    ON nmsp_child.oid   = child.relnamespace
           WHERE child.oid = c.oid
         ) AS parent_table,
-        (
-            CASE WHEN c.relpartbound IS NOT null THEN
-              pg_get_expr(c.relpartbound, c.oid, true)
-            WHEN c.relhassubclass IS NOT null THEN
-              pg_catalog.pg_get_partkeydef(c.oid)
-            END
-        ) AS partition_def,
+        -- 10_AND_LATER
+        COALESCE(pg_get_expr(c.relpartbound, c.oid, true), pg_catalog.pg_get_partkeydef(c.oid)) AS partition_def,
+        -- BEFORE_10
+        NULL::text AS partition_def,
         c.relrowsecurity::boolean AS row_security,
         c.relforcerowsecurity::boolean AS force_row_security,
         c.relpersistence AS persistence
@@ -82,6 +81,10 @@ WITH extension_oids AS (
     AND n.nspname NOT LIKE 'pg_temp_%' 
     -- INTERNAL 
     AND n.nspname NOT LIKE 'pg_toast_temp_%'
+    -- SCHEMA_FILTER
+    AND n.nspname LIKE ANY(%(schemas)s::text[])
+    -- OIDS
+    AND c.oid = ANY(%(oids)s::oid[])
 
 ), table_aggs AS (
 
@@ -22,4 +22,8 @@ FROM pg_trigger tg
     LEFT OUTER JOIN extension_oids e ON e.oid = proc.oid
 WHERE NOT tg.tgisinternal
 AND e.oid is null
+-- SCHEMA_FILTER
+AND nsp.nspname LIKE ANY(%(schemas)s::text[])
+-- OIDS
+AND tg.oid = ANY(%(oids)s::oid[])
 ORDER BY schema, table_name, name;
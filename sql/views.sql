@@ -23,3 +23,7 @@ AND n.nspname NOT IN ('pg_catalog', 'information_schema', 'pg_toast')
 AND n.nspname NOT LIKE 'pg_temp_%' 
 -- INTERNAL 
 AND n.nspname NOT LIKE 'pg_toast_temp_%'
+-- SCHEMA_FILTER
+AND n.nspname LIKE ANY(%(schemas)s::text[])
+-- OIDS
+AND c.oid = ANY(%(oids)s::oid[])
@@ -0,0 +1,240 @@
+import threading
+import time
+
+import pytest
+
+from pgdiff import apply, helpers
+from pgdiff.plan import Task
+
+
+class Cursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+    def execute(self, statement):
+        if "fail" in statement:
+            raise RuntimeError("boom")
+        self.conn.pending.append(statement)
+        if self.conn.autocommit:
+            self.conn.commit()
+
+
+class Connection:
+
+    def __init__(self, committed):
+        self.autocommit = False
+        self.pending = []
+        self.committed = committed
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        self.committed.extend(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+
+class Pool:
+
+    def __init__(self):
+        self.committed = []
+
+    def getconn(self):
+        return Connection(self.committed)
+
+    def putconn(self, conn):
+        pass
+
+
+def test_apply_parallel_runs_tasks_in_order():
+    pool = Pool()
+    tasks = [
+        Task(None, None, ["a", "b"], False, frozenset()),
+        Task("index", "public.i", ["c"], True, frozenset([0])),
+        Task("index", "public.j", ["d", "e"], True, frozenset([0])),
+    ]
+    timings = list(apply.apply_parallel(pool, tasks, jobs=2))
+    assert sorted(t.statement for t in timings) == ["a", "b", "c", "d", "e"]
+    assert pool.committed[:3] == [
+        "SET LOCAL check_function_bodies = false", "a", "b"]
+
+
+def test_apply_parallel_names_what_was_committed():
+    pool = Pool()
+    tasks = [
+        Task("table", "public.t", ["a"], False, frozenset()),
+        Task("index", "public.i", ["b", "fail", "c"], True, frozenset([0])),
+        Task("index", "public.j", ["d"], True, frozenset([1])),
+    ]
+    with pytest.raises(apply.ApplyError) as info:
+        list(apply.apply_parallel(pool, tasks, jobs=2))
+    assert info.value.committed == [
+        "public.t", "public.i (1 of 3 statements)"]
+    assert "boom" in str(info.value)
+    assert "d" not in pool.committed
+
+
+def test_apply_parallel_rolls_back_a_failed_transaction():
+    pool = Pool()
+    tasks = [Task(None, None, ["a", "fail"], False, frozenset())]
+    with pytest.raises(apply.ApplyError, match="nothing was committed"):
+        list(apply.apply_parallel(pool, tasks))
+    assert pool.committed == []
+
+
+def test_apply_parallel_runs_independent_tasks_at_once():
+    # Each task waits at the barrier until the other one reaches it,
+    # which only happens when both run at the same time.
+    barrier = threading.Barrier(2, timeout=5)
+
+    class Waiting(Cursor):
+
+        def execute(self, statement):
+            if statement.startswith("wait"):
+                barrier.wait()
+            super().execute(statement)
+
+    class WaitingConnection(Connection):
+
+        def cursor(self):
+            return Waiting(self)
+
+    class WaitingPool(Pool):
+
+        def getconn(self):
+            return WaitingConnection(self.committed)
+
+    pool = WaitingPool()
+    tasks = [
+        Task("table", "public.t", ["wait t"], False, frozenset()),
+        Task("table", "public.u", ["wait u"], False, frozenset()),
+    ]
+    timings = list(apply.apply_parallel(pool, tasks, jobs=2))
+    assert sorted(t.statement for t in timings) == ["wait t", "wait u"]
+    assert not barrier.broken
+
+
+class ApplyConnection(Connection):
+
+    def __init__(self):
+        super().__init__([])
+        self.rolled_back = False
+
+    def get_backend_pid(self):
+        return 42
+
+    def rollback(self):
+        self.rolled_back = True
+        super().rollback()
+
+
+def deferred(statement):
+    return helpers.Statement(statement, deferred=True)
+
+
+def test_apply_commits_then_runs_deferred_statements_in_autocommit():
+    conn = ApplyConnection()
+    timings = list(apply.apply(conn, ["a", deferred("d"), "b"]))
+    assert [t.statement for t in timings] == ["a", "b", "d"]
+    assert conn.committed == [
+        "SET LOCAL check_function_bodies = false", "a", "b", "d"]
+    assert not conn.rolled_back
+    assert conn.autocommit is False
+
+
+def test_apply_rolls_back_and_skips_deferred_statements():
+    conn = ApplyConnection()
+    timings = list(apply.apply(
+        conn, ["a", deferred("d")], rollback=True))
+    assert [t.statement for t in timings] == ["a"]
+    assert conn.committed == []
+    assert conn.rolled_back
+
+
+def test_apply_rolls_back_on_error():
+    conn = ApplyConnection()
+    with pytest.raises(RuntimeError, match="boom"):
+        list(apply.apply(conn, ["a", "fail", deferred("d")]))
+    assert conn.committed == []
+    assert conn.rolled_back
+
+
+def test_apply_restores_autocommit_after_a_failed_deferred_statement():
+    conn = ApplyConnection()
+    with pytest.raises(RuntimeError, match="boom"):
+        list(apply.apply(conn, ["a", deferred("fail")]))
+    assert conn.committed[-1] == "a"
+    assert conn.autocommit is False
+
+
+class MonitorConnection:
+
+    # Answers the lock wait query: waiting until `waiting` is cleared.
+
+    def __init__(self):
+        self.autocommit = False
+        self.waiting = threading.Event()
+        self.waiting.set()
+        self.closed = threading.Event()
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchone(self):
+        return (self.waiting.is_set(),)
+
+    def close(self):
+        self.closed.set()
+
+
+def test_lock_monitor_charges_waits_to_the_running_statement(monkeypatch):
+    conn = MonitorConnection()
+    monkeypatch.setattr(apply, "db_connect", lambda dsn: conn)
+    monitor = apply.LockMonitor("dsn", 42, interval=0.001)
+    monitor.start()
+    try:
+        monitor.begin(0)
+        time.sleep(0.05)
+        assert monitor.end(0) > 0
+        conn.waiting.clear()
+        monitor.begin(1)
+        time.sleep(0.02)
+        assert monitor.end(1) == 0
+    finally:
+        monitor.stop()
+    assert conn.closed.is_set()
+
+
+def test_apply_stops_the_monitor_after_an_error(monkeypatch):
+    monitor_conn = MonitorConnection()
+    monkeypatch.setattr(apply, "db_connect", lambda dsn: monitor_conn)
+    monitors = []
+
+    class Monitor(apply.LockMonitor):
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            monitors.append(self)
+
+    monkeypatch.setattr(apply, "LockMonitor", Monitor)
+    with pytest.raises(RuntimeError, match="boom"):
+        list(apply.apply(ApplyConnection(), ["fail"], dsn="dsn"))
+    monitor, = monitors
+    assert not monitor._thread.is_alive()
+    assert monitor_conn.closed.is_set()
@@ -0,0 +1,40 @@
+from pgdiff import cache, helpers
+from pgdiff.inspect import Inspection
+
+
+def test_get_treats_malformed_snapshots_as_misses(tmp_path):
+    snapshots = cache.SnapshotCache(str(tmp_path))
+    for key, text in [
+        ("json", "{"),
+        ("keys", '{"version": 1}'),
+        ("types", '{"version": 1, "pg_version": 1, "objects": 1, '
+                  '"dependencies": []}'),
+        ("shape", "[]"),
+    ]:
+        path = tmp_path / (key + ".json")
+        path.write_text(text)
+        assert snapshots.get(key) is None
+        assert not path.exists()
+
+
+def test_put_and_get_round_trip(tmp_path):
+    snapshots = cache.SnapshotCache(str(tmp_path))
+    snapshots.put("key", Inspection([], [], {"pg_version": 120000}))
+    inspection = snapshots.get("key")
+    assert inspection is not None
+    assert inspection.ctx == {"pg_version": 120000}
+
+
+def test_fingerprint_filters_by_schema():
+    sql = helpers.rendered_query(helpers.FINGERPRINT_QUERY, True, version=12)
+    assert "LIKE ANY(%(schemas)s::text[])" in sql
+    sql = helpers.rendered_query(helpers.FINGERPRINT_QUERY, version=12)
+    assert "%(schemas)s" not in sql
+
+
+def test_fingerprint_covers_inheritance_and_extension_members():
+    # ALTER TABLE ... INHERIT and ALTER EXTENSION ... ADD only touch
+    # pg_inherits and pg_depend.
+    sql = helpers.rendered_query(helpers.FINGERPRINT_QUERY, version=12)
+    assert "FROM pg_catalog.pg_inherits" in sql
+    assert "FROM pg_catalog.pg_depend" in sql
@@ -0,0 +1,165 @@
+import io
+
+from pgdiff import objects as obj
+from pgdiff import snapshot, sync
+from pgdiff.inspect import Inspection
+
+
+def table(name, oid=1):
+    return obj.Table(
+        oid, name, "public", "public." + name, "r", None, None, False,
+        False, "p", [{"name": "x", "type": "integer", "default": "NULL",
+                      "not_null": False}], [])
+
+
+def index(definition, oid=10):
+    return obj.Index(
+        oid, "public", "t", "i", "public.i", definition, "", "", 1,
+        False, False, False, True, False, "", "", False)
+
+
+def inspection(definition):
+    return Inspection(
+        [table("t"), index(definition)],
+        [obj.Dependency(identity="public.i", dependency_identity="public.t")],
+        {},
+    )
+
+
+SOURCE = inspection("CREATE INDEX i ON public.t USING btree (x)")
+TARGET = inspection("CREATE INDEX i ON public.t USING btree (x DESC)")
+
+
+def test_changed_index_is_left_alone_offline():
+    assert TARGET.diff(SOURCE) == []
+
+
+def test_changed_index_is_swapped_online():
+    statements = TARGET.diff(SOURCE, online=True)
+    assert statements == [
+        'DROP INDEX CONCURRENTLY IF EXISTS "public"."i_pgdiff_new";',
+        'CREATE INDEX CONCURRENTLY "i_pgdiff_new" ON public.t '
+        'USING btree (x DESC);',
+        "DROP INDEX CONCURRENTLY IF EXISTS public.i;",
+        'ALTER INDEX "public"."i_pgdiff_new" RENAME TO "i";',
+    ]
+    assert all(s.deferred for s in statements)
+    assert "retried" in statements[0].note
+
+
+def test_script_lists_deferred_statements_after_commit():
+    file = io.StringIO()
+    statements = [
+        *TARGET.diff(SOURCE, online=True),
+        "ALTER TABLE public.t ADD COLUMN y integer;",
+    ]
+    assert sync._write_script(statements, file)
+    script = file.getvalue()
+    assert script.startswith("SET check_function_bodies = false;\n\nBEGIN;")
+    commit = script.index("COMMIT;")
+    assert script.index("ADD COLUMN y") < commit
+    assert script.index("-- swaps in index public.i") > commit
+    assert script.index("CREATE INDEX CONCURRENTLY") > commit
+
+
+def test_dry_run_script_comments_out_deferred_statements():
+    file = io.StringIO()
+    assert sync._write_script(TARGET.diff(SOURCE, online=True), file, True)
+    lines = file.getvalue().splitlines()
+    assert "BEGIN;" not in lines
+    assert all(line.startswith("-- ") for line in lines if line)
+
+
+def test_empty_script_writes_nothing():
+    file = io.StringIO()
+    assert not sync._write_script([], file)
+    assert file.getvalue() == ""
+
+
+def constrained(not_null=False, constraints=(), pg_version=None):
+    t = obj.Table(
+        1, "t", "public", "public.t", "r", None, None, False, False, "p",
+        [{"name": "x", "type": "integer", "default": None,
+          "not_null": not_null}],
+        [{"oid": 20 + i, "schema": "public", "name": name,
+          "identity": "public.t." + name, "definition": definition}
+         for i, (name, definition) in enumerate(constraints)],
+    )
+    ctx = {} if pg_version is None else {"pg_version": pg_version}
+    return Inspection([t], [], ctx)
+
+
+def planned(source, target, online=True):
+    return [(s, s.deferred) for s in target.diff(source, online=online)]
+
+
+def test_new_check_is_validated_after_commit_online():
+    source = constrained()
+    target = constrained(constraints=[("c", "CHECK (x > 0)")])
+    assert planned(source, target) == [
+        ("ALTER TABLE public.t ADD CONSTRAINT c CHECK (x > 0) NOT VALID;",
+         False),
+        ("ALTER TABLE public.t VALIDATE CONSTRAINT c;", True),
+    ]
+    assert planned(source, target, online=False) == [
+        ("ALTER TABLE public.t ADD CONSTRAINT c CHECK (x > 0);", False),
+    ]
+
+
+def test_new_foreign_key_is_validated_after_commit_online():
+    fk = "FOREIGN KEY (x) REFERENCES public.u(x)"
+    assert planned(constrained(), constrained(constraints=[("f", fk)])) == [
+        ("ALTER TABLE public.t ADD CONSTRAINT f %s NOT VALID;" % fk, False),
+        ("ALTER TABLE public.t VALIDATE CONSTRAINT f;", True),
+    ]
+
+
+def test_unique_constraint_is_added_in_the_transaction_online():
+    target = constrained(constraints=[("k", "UNIQUE (x)")])
+    assert planned(constrained(), target) == [
+        ("ALTER TABLE public.t ADD CONSTRAINT k UNIQUE (x);", False),
+    ]
+
+
+def test_changed_constraint_is_replaced_and_validated_online():
+    source = constrained(constraints=[("c", "CHECK (x > 0)")])
+    target = constrained(constraints=[("c", "CHECK (x > 1)")])
+    assert planned(source, target) == [
+        ("ALTER TABLE public.t DROP CONSTRAINT c, "
+         "ADD CONSTRAINT c CHECK (x > 1) NOT VALID;", False),
+        ("ALTER TABLE public.t VALIDATE CONSTRAINT c;", True),
+    ]
+
+
+def test_set_not_null_goes_through_a_check_online_from_12():
+    source = constrained(pg_version=120000)
+    target = constrained(not_null=True)
+    assert planned(source, target) == [
+        ("ALTER TABLE public.t ADD CONSTRAINT x_pgdiff_not_null "
+         "CHECK (x IS NOT NULL) NOT VALID;", False),
+        ("ALTER TABLE public.t VALIDATE CONSTRAINT x_pgdiff_not_null;",
+         True),
+        ("ALTER TABLE public.t ALTER COLUMN x SET NOT NULL;", True),
+        ("ALTER TABLE public.t DROP CONSTRAINT x_pgdiff_not_null;", True),
+    ]
+
+
+def test_set_not_null_stays_in_the_transaction_before_12():
+    source = constrained(pg_version=110000)
+    target = constrained(not_null=True, pg_version=120000)
+    assert planned(source, target) == [
+        ("ALTER TABLE public.t ALTER COLUMN x SET NOT NULL;", False),
+    ]
+
+
+def test_set_not_null_assumes_a_recent_server_without_a_version():
+    source = snapshot.loads(snapshot.dumps(constrained()))
+    assert source.ctx == {"pg_version": None}
+    target = constrained(not_null=True, pg_version=110000)
+    assert [s for s, _ in planned(source, target)][-2:] == [
+        "ALTER TABLE public.t ALTER COLUMN x SET NOT NULL;",
+        "ALTER TABLE public.t DROP CONSTRAINT x_pgdiff_not_null;",
+    ]
+    assert planned(source, target, online=False) == [
+        ("ALTER TABLE public.t ALTER COLUMN x SET NOT NULL;", False),
+    ]
@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from pgdiff.graph import CycleError, DependencyGraph
+
+
+def make_graph(edges, nodes=()):
+    graph = DependencyGraph()
+    for node in nodes:
+        graph.add_node(node)
+    for source, target in edges:
+        graph.add_edge(source, target)
+    return graph
+
+
+def test_topological_order_respects_edges():
+    edges = [("t", "i"), ("t", "v"), ("v", "w"), ("f", "w")]
+    order = make_graph(edges, ["x"]).topological_order()
+    assert sorted(order) == ["f", "i", "t", "v", "w", "x"]
+    for source, target in edges:
+        assert order.index(source) < order.index(target)
+
+
+def test_duplicate_edges_are_ignored():
+    graph = make_graph([("a", "b"), ("a", "b")])
+    assert list(graph.edges()) == [("a", "b")]
+    assert graph.parents("b") == ["a"]
+
+
+def test_cycles_are_rejected():
+    with pytest.raises(CycleError):
+        make_graph([("a", "b"), ("b", "a")]).topological_order()
+
+
+def test_descendants_and_ancestors():
+    graph = make_graph([("t", "v"), ("v", "w"), ("t", "i"), ("u", "w")])
+    assert set(graph.descendants("t")) == {"v", "w", "i"}
+    assert graph.descendants("w") == []
+    assert set(graph.ancestors("w")) == {"t", "u", "v"}
+    order = graph.topological_order()
+    descendants = graph.descendants("t")
+    assert descendants == sorted(descendants, key=order.index)
+    assert graph.descendants("t", reverse=True) == descendants[::-1]
+
+
+def test_descendants_match_a_plain_traversal():
+    rng = random.Random(0)
+    nodes = ["n%d" % i for i in range(60)]
+    edges = [
+        (nodes[i], nodes[j])
+        for i in range(len(nodes))
+        for j in range(i + 1, len(nodes))
+        if rng.random() < 0.05
+    ]
+    graph = make_graph(edges, nodes)
+    children = {n: [] for n in nodes}
+    for source, target in edges:
+        children[source].append(target)
+    for node in nodes:
+        seen, stack = set(), list(children[node])
+        while stack:
+            n = stack.pop()
+            if n not in seen:
+                seen.add(n)
+                stack.extend(children[n])
+        assert set(graph.descendants(node)) == seen
+
+
+def test_changes_invalidate_the_cached_index():
+    graph = make_graph([("a", "b")])
+    assert graph.descendants("a") == ["b"]
+    graph.add_edge("b", "c")
+    assert graph.descendants("a") == ["b", "c"]
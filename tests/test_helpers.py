@@ -0,0 +1,104 @@
+import gc
+
+import pytest
+
+from pgdiff import helpers
+from pgdiff import objects as obj
+
+
+def test_like_patterns_translates_wildcards():
+    assert helpers.like_patterns(["public", "app_*", "v?"]) == [
+        "public", "app\\_%", "v_"]
+
+
+def test_like_patterns_escapes_like_metacharacters():
+    assert helpers.like_patterns(["50%", "a\\b"]) == ["50\\%", "a\\\\b"]
+
+
+def test_like_patterns_falls_back_on_character_classes():
+    assert helpers.like_patterns(["public", "app[12]"]) is None
+
+
+class Connection:
+    pass
+
+
+class Cursor:
+
+    def __init__(self, connection=None):
+        self.connection = connection or Connection()
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+
+QUERY = (
+    "SELECT 1 WHERE a LIKE 'x%%' AND s = ANY(%(schemas)s)"
+    " AND o = ANY(%(oids)s) AND s2 = ANY(%(schemas)s)"
+)
+
+
+def test_execute_query_prepares_with_parameters_in_key_order():
+    cursor = Cursor()
+    params = {"schemas": ["public"], "oids": [1]}
+    helpers.execute_query(cursor, QUERY, params, prepare=True)
+    (prepare, _), (execute, execute_params) = cursor.executed
+    name = prepare.split()[1]
+    assert prepare == (
+        "PREPARE " + name + " AS\n"
+        "SELECT 1 WHERE a LIKE 'x%' AND s = ANY($2)"
+        " AND o = ANY($1) AND s2 = ANY($2)"
+    )
+    assert execute == (
+        "EXECUTE %s(%%(oids)s::oid[], %%(schemas)s::text[])" % name)
+    assert execute_params is params
+
+
+def test_execute_query_prepares_once_per_connection():
+    connection = Connection()
+    first, second = Cursor(connection), Cursor(connection)
+    helpers.execute_query(first, "SELECT 1", prepare=True)
+    helpers.execute_query(second, "SELECT 1", prepare=True)
+    assert [sql.split()[0] for sql, _ in first.executed] == [
+        "PREPARE", "EXECUTE"]
+    assert [sql.split()[0] for sql, _ in second.executed] == ["EXECUTE"]
+    other = Cursor()
+    helpers.execute_query(other, "SELECT 1", prepare=True)
+    assert other.executed[0][0].startswith("PREPARE ")
+
+
+def test_prepared_statements_are_forgotten_with_their_connection():
+    count = len(helpers._prepared)
+    connection = Connection()
+    helpers.execute_query(Cursor(connection), "SELECT 2", prepare=True)
+    assert len(helpers._prepared) == count + 1
+    del connection
+    gc.collect()
+    assert len(helpers._prepared) == count
+
+
+def test_open_query_rejects_prepare_with_itersize():
+    cursor = Cursor()
+    with pytest.raises(ValueError, match="invalid query options"):
+        with helpers.open_query(cursor, "SELECT 1", prepare=True, itersize=2):
+            pass
+    assert cursor.executed == []
+
+
+def test_resolve_dependencies_drops_unknown_and_repeated_pairs():
+    objects = [
+        obj.View(1, "public", "v", "public.v", "v", "SELECT 1"),
+        obj.Enum(2, "public", "e", ["a"], "public.e"),
+    ]
+    pairs = [
+        ("c", 1, "t", 2),
+        ("c", 1, "t", 2),
+        ("c", 1, "c", 1),
+        ("c", 1, "p", 2),
+        ("c", 3, "t", 2),
+    ]
+    assert [
+        (d.identity, d.dependency_identity)
+        for d in helpers.resolve_dependencies(objects, pairs)
+    ] == [("public.v", "public.e")]
@@ -0,0 +1,309 @@
+import threading
+
+import pytest
+
+from pgdiff import helpers, snapshot
+from pgdiff import objects as obj
+from pgdiff.inspect import Inspection, inspect, inspect_parallel
+
+
+def table(name, oid=1):
+    return obj.Table(
+        oid, name, "public", "public." + name, "r", None, None, False,
+        False, "p", [{"name": "x", "type": "integer", "default": "NULL",
+                      "not_null": False}], [])
+
+
+def view(name, definition="SELECT 1", oid=2):
+    return obj.View(oid, "public", name, "public." + name, "v", definition)
+
+
+def depends(identity, dependency):
+    return obj.Dependency(identity=identity, dependency_identity=dependency)
+
+
+@pytest.fixture
+def inspection():
+    return Inspection(
+        [table("t"), table("u", 3), view("v"), view("w", oid=4)],
+        [
+            depends("public.v", "public.t"),
+            depends("public.w", "public.v"),
+            depends("public.w", "public.u"),
+        ],
+        {},
+    )
+
+
+def test_patch_keeps_edges_and_hashes_of_untouched_objects(
+    inspection, monkeypatch,
+):
+    hashes = dict(inspection.hashes)
+
+    def fail(self):
+        raise AssertionError("kept objects are not hashed again")
+
+    monkeypatch.setattr(obj.Table, "content_hash", fail)
+    new_v = view("v", "SELECT 2")
+    inspection.patch({"public.v"}, [new_v], [depends("public.v", "public.u")])
+
+    assert inspection["public.v"] is new_v
+    assert inspection.hashes["public.t"] == hashes["public.t"]
+    assert inspection.hashes["public.v"] != hashes["public.v"]
+    assert sorted(inspection.dependency_pairs()) == [
+        ("public.v", "public.u"),
+        ("public.w", "public.u"),
+        ("public.w", "public.v"),
+    ]
+
+
+def test_patch_drops_edges_to_removed_objects(inspection):
+    inspection.patch({"public.u"}, [], [])
+    assert "public.u" not in inspection
+    assert "public.u" not in inspection.hashes
+    assert sorted(inspection.dependency_pairs()) == [
+        ("public.v", "public.t"),
+        ("public.w", "public.v"),
+    ]
+
+
+def test_refresh_only_queries_dependencies_of_changed_objects(
+    inspection, monkeypatch,
+):
+    from pgdiff import inspect as inspect_module
+
+    versions = {k: {} for k in inspect_module.helpers.queries}
+    versions["table"] = {1: "a", 3: "a"}
+    versions["view"] = {2: "a", 4: "a"}
+    calls = []
+
+    class Connection:
+        def rollback(self):
+            pass
+
+    class Cursor:
+        connection = Connection()
+
+    def query_changes(cursor, schemas, prepare):
+        return {k: dict(v) for k, v in versions.items()}
+
+    def query(cursor, obj_type, schemas, oids, prepare):
+        calls.append((obj_type, oids))
+        if obj_type != "view":
+            return []
+        return [view("v", "SELECT 3"), view("w", "SELECT 4", oid=4)]
+
+    def query_dependency_oids(cursor, schemas, oids=None, **kwargs):
+        calls.append(("dependency", oids))
+        return [("c", 2, "c", 1), ("c", 4, "c", 2)]
+
+    monkeypatch.setattr(inspect_module.helpers, "query_changes", query_changes)
+    monkeypatch.setattr(inspect_module.helpers, "query", query)
+    monkeypatch.setattr(
+        inspect_module.helpers, "query_dependency_oids", query_dependency_oids)
+    monkeypatch.setattr(
+        inspect_module, "inspect", lambda *args, **kwargs: inspection)
+
+    inspector = inspect_module.IncrementalInspector(Cursor())
+    inspector.refresh()
+    assert inspector.refresh() == set()
+    assert calls == []
+
+    versions["view"][2] = "b"
+    # w depends on v, and is queried again along with it.
+    assert inspector.refresh() == {"public.v", "public.w"}
+    assert calls == [("view", [2, 4]), ("dependency", [2, 4])]
+    assert sorted(inspection.dependency_pairs()) == [
+        ("public.v", "public.t"),
+        ("public.w", "public.v"),
+    ]
+
+
+def test_diff_skips_objects_with_equal_hashes(inspection, monkeypatch):
+    from pgdiff import inspect as inspect_module
+
+    dispatched = []
+
+    def diff(ctx, source, target):
+        dispatched.append(target.identity)
+        return []
+
+    monkeypatch.setattr(inspect_module, "diff", diff)
+    other = Inspection(
+        [table("t", 11), table("u", 13), view("v", oid=12),
+         view("w", "SELECT 2", oid=14)],
+        [depends("public.w", "public.v")],
+        {},
+    )
+    assert inspection.diff(other) == []
+    assert dispatched == ["public.w"]
+    assert inspection.diff_stats == {"compared": 4, "hash_hits": 3}
+
+
+def test_diff_of_identical_inspections_is_all_hash_hits(inspection):
+    assert inspection.diff(inspection) == []
+    assert inspection.diff_stats == {"compared": 4, "hash_hits": 4}
+
+
+SERVER_OBJECTS = [
+    table("t"),
+    view("v"),
+    obj.Index(
+        3, "public", "t", "i", "public.i",
+        "CREATE INDEX i ON public.t USING btree (x)", "1", "0", 1,
+        False, False, False, True, False, "", "", False),
+]
+
+# Self-references, duplicates and pairs to objects outside the
+# inspection are all returned by the server and dropped on the client.
+SERVER_PAIRS = [
+    ("c", 2, "c", 1),
+    ("c", 3, "c", 1),
+    ("c", 2, "c", 2),
+    ("c", 2, "c", 1),
+    ("c", 2, "p", 99),
+]
+
+
+def server_results(sql):
+    # The columns and rows the server would return for `sql`, with
+    # columns in a different order than the record slots.
+    if sql == helpers._batch_query(False, 12):
+        row = [
+            [o.to_dict() for o in SERVER_OBJECTS if o.obj_type == obj_type]
+            for obj_type in helpers.queries
+        ]
+        row.append([
+            {"catalog": a, "oid": b, "dependency_catalog": c,
+             "dependency_oid": d} for a, b, c, d in SERVER_PAIRS
+        ])
+        return [(name,) for name in [*helpers.queries, "dependency"]], [row]
+    pairs = helpers.rendered_query(helpers.DEPENDENCY_OIDS_QUERY, version=12)
+    if sql == pairs:
+        columns = ["catalog", "oid", "dependency_catalog", "dependency_oid"]
+        return [(name,) for name in columns], SERVER_PAIRS
+    for obj_type, path in helpers.queries.items():
+        if sql == helpers.rendered_query(path, version=12):
+            slots = obj.record_types[obj_type].__slots__[::-1]
+            rows = [
+                tuple(o.to_dict()[name] for name in slots)
+                for o in SERVER_OBJECTS if o.obj_type == obj_type
+            ]
+            return [(name,) for name in slots], rows
+    raise AssertionError("unexpected query: %s" % sql)
+
+
+class ServerConnection:
+    server_version = 120000
+
+    def __init__(self):
+        self.cursors = []
+        self.rollbacks = 0
+
+    def cursor(self, name=None):
+        rv = ServerCursor(self, name)
+        self.cursors.append(rv)
+        return rv
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class ServerCursor:
+
+    def __init__(self, connection, name=None):
+        self.connection = connection
+        self.name = name
+        self.itersize = None
+        self.description = None
+        self.pending = None
+        self.rows = []
+        self.closed = False
+
+    def execute(self, sql, params=None):
+        assert params is None
+        description, self.rows = server_results(sql)
+        # Like psycopg2, named cursors are only described once the
+        # first rows are fetched.
+        if self.name is None:
+            self.description = description
+        else:
+            self.pending = description
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def __iter__(self):
+        if self.name is not None:
+            self.description = self.pending
+        return iter(self.rows)
+
+    def close(self):
+        self.closed = True
+
+
+def test_batch_and_serial_inspections_are_equal():
+    serial = inspect(ServerConnection().cursor())
+    batch = inspect(ServerConnection().cursor(), batch=True)
+    assert snapshot.to_dict(batch) == snapshot.to_dict(serial)
+    assert [o.to_dict() for o in serial.objects.values()] == [
+        o.to_dict() for o in SERVER_OBJECTS]
+    assert sorted(serial.dependency_pairs()) == [
+        ("public.i", "public.t"),
+        ("public.v", "public.t"),
+    ]
+    assert serial.ctx == {"pg_version": 120000}
+
+
+def test_itersize_reads_from_named_cursors():
+    conn = ServerConnection()
+    cursor = conn.cursor()
+    rv = inspect(cursor, itersize=2)
+    assert snapshot.to_dict(rv) == snapshot.to_dict(
+        inspect(ServerConnection().cursor()))
+    named = conn.cursors[1:]
+    assert len(named) == len(helpers.queries) + 1
+    assert len({c.name for c in named}) == len(named)
+    assert all(c.itersize == 2 and c.closed for c in named)
+    assert cursor.rows == []
+
+
+def test_batch_inspection_rejects_itersize():
+    with pytest.raises(ValueError, match="invalid inspection options"):
+        inspect(ServerConnection().cursor(), batch=True, itersize=2)
+
+
+class ServerPool:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = []
+        self.connections = []
+        self.acquired = 0
+
+    def getconn(self):
+        with self.lock:
+            self.acquired += 1
+            if self.idle:
+                return self.idle.pop()
+            conn = ServerConnection()
+            self.connections.append(conn)
+            return conn
+
+    def putconn(self, conn):
+        with self.lock:
+            self.idle.append(conn)
+
+
+def test_parallel_inspection_merges_every_query():
+    pool = ServerPool()
+    rv = inspect_parallel(pool, jobs=3)
+    serial = inspect(ServerConnection().cursor())
+    assert snapshot.to_dict(rv) == snapshot.to_dict(serial)
+    # One connection for the server version, one per query type.
+    assert pool.acquired == len(helpers.queries) + 2
+    assert len(pool.idle) == len(pool.connections)
+    cursors = [c for conn in pool.connections for c in conn.cursors]
+    assert len(cursors) == len(helpers.queries) + 1
+    assert all(c.closed for c in cursors)
+    assert sum(conn.rollbacks for conn in pool.connections) == len(cursors)
@@ -0,0 +1,104 @@
+import pytest
+
+from pgdiff import objects as obj
+
+
+def table(oid=1, columns=None, constraints=None):
+    return obj.Table(
+        oid, "t", "public", "public.t", "r", None, None, False, False, "p",
+        columns or [{"name": "x", "type": "integer", "default": None,
+                     "not_null": False}],
+        constraints or [],
+    )
+
+
+def constraint(name, definition, oid):
+    return {"oid": oid, "schema": "public", "name": name,
+            "identity": "public.t." + name, "definition": definition,
+            "index": None}
+
+
+def test_content_hash_ignores_oids():
+    assert table(1).content_hash() == table(2).content_hash()
+    assert (
+        obj.View(1, "public", "v", "public.v", "v", "SELECT 1").content_hash()
+        == obj.View(
+            2, "public", "v", "public.v", "v", "SELECT 1").content_hash()
+    )
+
+
+@pytest.mark.parametrize("field,value", [
+    ("name", "y"),
+    ("type", "bigint"),
+    ("default", "0"),
+    ("not_null", True),
+])
+def test_content_hash_changes_with_any_column_field(field, value):
+    column = {"name": "x", "type": "integer", "default": None,
+              "not_null": False}
+    assert (
+        table(columns=[{**column, field: value}]).content_hash()
+        != table(columns=[column]).content_hash()
+    )
+
+
+def test_content_hash_changes_with_a_definition():
+    a = obj.View(1, "public", "v", "public.v", "v", "SELECT 1")
+    b = obj.View(1, "public", "v", "public.v", "v", "SELECT 2")
+    assert a.content_hash() != b.content_hash()
+
+
+def test_table_hash_ignores_constraint_order():
+    c = constraint("c", "CHECK (x > 0)", 10)
+    d = constraint("d", "UNIQUE (x)", 11)
+    assert (
+        table(constraints=[c, d]).content_hash()
+        == table(constraints=[d, c]).content_hash()
+    )
+    e = constraint("d", "UNIQUE (x, y)", 11)
+    assert (
+        table(constraints=[c, d]).content_hash()
+        != table(constraints=[c, e]).content_hash()
+    )
+
+
+def values(cls):
+    # A distinct value for every slot.
+    return [
+        [] if name in ("columns", "constraints") else "%s-value" % name
+        for name in cls.__slots__
+    ]
+
+
+@pytest.mark.parametrize(
+    "cls", list(obj.record_types.values()), ids=lambda cls: cls.obj_type)
+def test_records_round_trip(cls):
+    expected = dict(zip(cls.__slots__, values(cls)), obj_type=cls.obj_type)
+
+    # Columns come back in any order, and some may be missing.
+    row = ["unused", *reversed(values(cls))]
+    positions = [len(row) - 1 - i for i in range(len(cls.__slots__))]
+    from_row = cls.from_row(row, positions)
+    assert from_row.to_dict() == expected
+
+    from_dict = obj.from_dict(from_row.to_dict())
+    assert type(from_dict) is cls
+    assert from_dict.to_dict() == expected
+    assert from_dict.content_hash() == from_row.content_hash()
+
+    partial = cls.from_row(row, [None] * len(cls.__slots__))
+    assert all(
+        value in (None, [])
+        for name, value in partial.to_dict().items() if name != "obj_type"
+    )
+
+
+def test_records_default_missing_slots_to_none():
+    dependency = obj.Dependency(identity="public.v", dependency_identity="t")
+    assert dependency.to_dict() == {
+        "obj_type": "dependency",
+        "oid": None,
+        "identity": "public.v",
+        "dependency_oid": None,
+        "dependency_identity": "t",
+    }
@@ -0,0 +1,194 @@
+import io
+import json
+
+import pytest
+
+from pgdiff import helpers, plan, sync
+from pgdiff import objects as obj
+from pgdiff.inspect import Inspection
+
+
+def table(name, columns=(("x", "integer"),), oid=1):
+    return obj.Table(
+        oid, name, "public", "public." + name, "r", None, None, False,
+        False, "p", [{"name": n, "type": type_, "default": "NULL",
+                      "not_null": False} for n, type_ in columns], [])
+
+
+def statement(text, identity="public.t", deferred=False):
+    rv = helpers.Statement(text, deferred=deferred)
+    rv.obj_type = "table"
+    rv.identity = identity
+    return rv
+
+
+@pytest.mark.parametrize("old,new,widens", [
+    ("integer", "integer", True),
+    ("character varying(10)", "character varying(20)", True),
+    ("character varying(20)", "character varying(10)", False),
+    ("character varying(10)", "character varying", True),
+    ("character varying", "character varying(10)", False),
+    ("character varying(10)", "text", True),
+    ("text", "character varying", True),
+    ("text", "character varying(10)", False),
+    ("numeric(10,2)", "numeric(12,2)", True),
+    ("numeric(10,2)", "numeric(12,3)", False),
+    ("numeric(10,2)", "numeric", True),
+    ("numeric", "numeric(10,2)", False),
+    ("integer", "bigint", False),
+])
+def test_type_widens(old, new, widens):
+    assert plan._type_widens(old, new) is widens
+
+
+@pytest.mark.parametrize("text,version,expected", [
+    ("CREATE TABLE public.u (x integer);", None, (None, None)),
+    ("CREATE INDEX i ON public.t USING btree (x);", None, ("SHARE", "scan")),
+    ("CREATE INDEX i ON ONLY public.t USING btree (x);", None,
+     ("SHARE", None)),
+    ("CREATE UNIQUE INDEX CONCURRENTLY i ON public.t USING btree (x);",
+     None, ("SHARE UPDATE EXCLUSIVE", "scan")),
+    ("ALTER INDEX public.i RENAME TO j;", 110000,
+     ("ACCESS EXCLUSIVE", None)),
+    ("ALTER INDEX public.i RENAME TO j;", 120000,
+     ("SHARE UPDATE EXCLUSIVE", None)),
+    ("ALTER TABLE public.t ADD CONSTRAINT c FOREIGN KEY (x) "
+     "REFERENCES public.u(x) NOT VALID;", None,
+     ("SHARE ROW EXCLUSIVE", None)),
+    ("ALTER TABLE public.t ADD CONSTRAINT c CHECK (x > 0);", None,
+     ("ACCESS EXCLUSIVE", "scan")),
+    ("ALTER TABLE public.t VALIDATE CONSTRAINT c;", None,
+     ("SHARE UPDATE EXCLUSIVE", "scan")),
+    ("ALTER TABLE public.t ALTER COLUMN x TYPE bigint;", None,
+     ("ACCESS EXCLUSIVE", "rewrite")),
+    ("ALTER TABLE public.t ADD COLUMN y integer DEFAULT 0;", 100000,
+     ("ACCESS EXCLUSIVE", "rewrite")),
+    ("ALTER TABLE public.t ADD COLUMN y integer DEFAULT 0;", 110000,
+     ("ACCESS EXCLUSIVE", None)),
+    ("ALTER TABLE public.t ADD COLUMN y uuid DEFAULT gen_random_uuid();",
+     110000, ("ACCESS EXCLUSIVE", "rewrite")),
+    ("ALTER TABLE public.t ADD COLUMN y integer, "
+     "ALTER COLUMN x SET NOT NULL;", None, ("ACCESS EXCLUSIVE", "scan")),
+    ("DROP TABLE public.t;", None, ("ACCESS EXCLUSIVE", None)),
+])
+def test_classify(text, version, expected):
+    assert plan.classify(text, table("t"), version) == expected
+
+
+def test_classify_knows_which_type_changes_rewrite():
+    t = table("t", [("x", "character varying(10)")])
+    text = "ALTER TABLE public.t ALTER COLUMN x TYPE text;"
+    assert plan.classify(text, t) == ("ACCESS EXCLUSIVE", None)
+
+
+def test_explain_reports_the_referenced_table_of_a_foreign_key():
+    source = Inspection([table("t"), table("u", oid=2)], [], {})
+    steps = plan.explain(
+        [
+            statement(
+                "ALTER TABLE public.t ADD CONSTRAINT c FOREIGN KEY (x) "
+                "REFERENCES u(x) NOT VALID;"),
+            statement(
+                "ALTER TABLE public.t ADD CONSTRAINT d FOREIGN KEY (x) "
+                'REFERENCES "other"."U"(x) NOT VALID;'),
+        ],
+        source,
+        source,
+    )
+    assert [s.referenced for s in steps] == [
+        ("public.u",), ('"other"."U"',)]
+    file = io.StringIO()
+    sync._write_plan(steps, file)
+    assert "SHARE ROW EXCLUSIVE on public.u\n" in file.getvalue()
+
+
+def test_plan_is_written_in_execution_order():
+    source = Inspection([table("t")], [], {})
+    steps = plan.explain(
+        [
+            statement(
+                "CREATE INDEX CONCURRENTLY i ON public.t (x);",
+                deferred=True),
+            statement("ALTER TABLE public.t ADD COLUMN y integer;"),
+        ],
+        source,
+        source,
+    )
+    file = io.StringIO()
+    sync._write_plan(steps, file)
+    text = file.getvalue()
+    assert text.index("ADD COLUMN y") < text.index("CREATE INDEX")
+    assert text.endswith("-- 2 statements, 1 scan\n")
+
+    file = io.StringIO()
+    sync._write_explained(steps, "json", file)
+    assert [s["deferred"] for s in json.loads(file.getvalue())] == [
+        False, True]
+
+
+def index_statement(text, identity):
+    rv = helpers.Statement(text, deferred=True)
+    rv.obj_type = "index"
+    rv.identity = identity
+    return rv
+
+
+def test_tasks_join_related_objects():
+    source = Inspection(
+        [table("t"), table("u", oid=3),
+         obj.View(2, "public", "v", "public.v", "v", "")],
+        [obj.Dependency(identity="public.v", dependency_identity="public.t")],
+        {},
+    )
+    drop = statement("DROP VIEW public.v;", "public.v")
+    alter = statement("ALTER TABLE public.t ALTER COLUMN x TYPE bigint;")
+    other = statement("ALTER TABLE public.u ADD COLUMN y integer;", "public.u")
+    create = statement("CREATE VIEW public.v AS SELECT 1;", "public.v")
+    rv = plan.tasks([drop, alter, other, create], source, source)
+    assert [(task.identity, task.statements, task.after) for task in rv] == [
+        ("public.v", [drop, alter, create], frozenset()),
+        ("public.u", [other], frozenset()),
+    ]
+
+
+def test_tasks_wait_for_barriers():
+    source = Inspection([table("t"), table("u", oid=2)], [], {})
+    t = statement("ALTER TABLE public.t ADD COLUMN y integer;")
+    function = helpers.Statement("CREATE FUNCTION public.f() ...;")
+    function.obj_type = "function"
+    function.identity = "public.f()"
+    u = statement("ALTER TABLE public.u ADD COLUMN y integer;", "public.u")
+    v = statement("ALTER TABLE public.t ADD COLUMN z integer;")
+    rv = plan.tasks([t, function, u, v], source, source)
+    assert [(task.statements, task.after) for task in rv] == [
+        ([t], frozenset()),
+        ([function], frozenset([0])),
+        ([u], frozenset([1])),
+        ([v], frozenset([1])),
+    ]
+
+
+def test_deferred_tasks_wait_for_related_objects():
+    index = obj.Index(
+        3, "public", "t", "i", "public.i", "", "", "", 1, False, False,
+        False, True, False, "", "", False)
+    source = Inspection(
+        [table("t"), table("u", oid=2), index],
+        [obj.Dependency(identity="public.i", dependency_identity="public.t")],
+        {},
+    )
+    alter = statement("ALTER TABLE public.t ADD COLUMN y integer;")
+    validate = statement(
+        "ALTER TABLE public.t VALIDATE CONSTRAINT c;", deferred=True)
+    i = index_statement(
+        "CREATE INDEX CONCURRENTLY i ON public.t (x);", "public.i")
+    j = index_statement(
+        "CREATE INDEX CONCURRENTLY j ON public.u (x);", "public.j")
+    swap = index_statement("ALTER INDEX public.j_new RENAME TO j;", "public.j")
+    rv = plan.tasks([validate, i, alter, j, swap], source, source)
+    assert [(task.statements, task.deferred, task.after) for task in rv] == [
+        ([alter], False, frozenset()),
+        ([validate], True, frozenset([0])),
+        ([i], True, frozenset([1])),
+        ([j, swap], True, frozenset()),
+    ]
@@ -0,0 +1,73 @@
+import pytest
+
+from pgdiff import pool as scratch_pool
+
+
+@pytest.fixture
+def databases(monkeypatch):
+    events = []
+    failing = set()
+
+    def create_database(dsn, template=""):
+        events.append(("create", dsn))
+
+    def drop_database(dsn):
+        if any(name in dsn for name in failing):
+            raise RuntimeError("cannot drop")
+        events.append(("drop", dsn))
+
+    monkeypatch.setattr(scratch_pool, "create_database", create_database)
+    monkeypatch.setattr(scratch_pool, "drop_database", drop_database)
+    return events, failing
+
+
+def test_uncommitted_databases_are_not_reset(databases):
+    events, _ = databases
+    with scratch_pool.ScratchPool("postgresql://localhost/x", size=1) as p:
+        events.clear()
+        with p.acquire(committed=False):
+            pass
+        with p.acquire(timeout=1):
+            pass
+        # Only handed out again once reset.
+        with p.acquire(timeout=1):
+            assert [e for e, _ in events] == ["drop", "create"]
+            assert p.stats()["resets"] == 1
+
+
+def test_acquire_raises_once_every_database_is_retired(databases):
+    events, failing = databases
+    p = scratch_pool.ScratchPool(
+        "postgresql://localhost/x", size=1, prefix="doomed_")
+    p.start()
+    failing.add("doomed_")
+    with p.acquire(timeout=1):
+        pass
+    with pytest.raises(RuntimeError):
+        with p.acquire(timeout=1):
+            pass
+    stats = p.stats()
+    assert stats["size"] == 0
+    assert stats["available"] == 0
+    assert stats["reset_failures"] == 1
+
+
+def test_acquire_times_out_with_a_timeout_error(databases):
+    with scratch_pool.ScratchPool("postgresql://localhost/x", size=1) as p:
+        with p.acquire(timeout=1):
+            with pytest.raises(TimeoutError, match="1 in use"):
+                with p.acquire(timeout=0.01):
+                    pass
+        assert p.stats()["in_use"] == 0
+
+
+def test_close_refuses_while_databases_are_acquired(databases):
+    events, _ = databases
+    p = scratch_pool.ScratchPool("postgresql://localhost/x", size=1).start()
+    with p.acquire(timeout=1):
+        with pytest.raises(RuntimeError, match="still acquired"):
+            p.close()
+        assert not [e for e, _ in events if e == "drop"]
+    p.close()
+    assert [e for e, _ in events].count("drop") == 2
+    assert p.stats()["size"] == 0
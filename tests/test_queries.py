@@ -0,0 +1,72 @@
+import itertools
+import re
+import types
+
+import pytest
+
+from pgdiff import helpers
+
+
+RENDERED = [
+    *helpers.queries.values(),
+    helpers.DEPENDENCY_QUERY,
+    helpers.DEPENDENCY_OIDS_QUERY,
+    helpers.FINGERPRINT_QUERY,
+    helpers.CHANGES_QUERY,
+]
+VERSIONS = [None, 9, 10, 11, 12]
+PARAMS = {"schemas": ["public"], "oids": [1]}
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|--[^\n]*")
+
+
+def _name(path):
+    return path.rsplit("/", 1)[-1]
+
+
+@pytest.mark.parametrize("path", RENDERED, ids=_name)
+@pytest.mark.parametrize("version", VERSIONS)
+@pytest.mark.parametrize(
+    "schemas,oids", list(itertools.product([False, True], repeat=2)))
+def test_queries_render_in_every_combination(path, version, schemas, oids):
+    sql = helpers.render_query(
+        helpers.load_query(path),
+        ["public"] if schemas else None,
+        [1] if oids else None,
+        version,
+    )
+    code = LITERALS.sub("''", sql)
+    assert code.count("(") == code.count(")")
+    assert not re.search(r",\s*\)", code)
+    assert not re.search(r",\s*FROM\b", code)
+    if schemas or oids:
+        # Fails on any placeholder or percent sign left unescaped.
+        sql % PARAMS
+    else:
+        assert "%(" not in sql
+
+
+def test_oid_filter_is_only_kept_when_filtering():
+    sql = helpers.load_query(helpers.SEQUENCE_QUERY)
+    assert "%(oids)s" not in helpers.render_query(sql)
+    assert "= ANY(%(oids)s::oid[])" in helpers.render_query(sql, oids=[1])
+
+
+def test_dependency_oid_filter_applies_before_combining():
+    sql = helpers.render_query(
+        helpers.load_query(helpers.DEPENDENCY_QUERY), oids=[1])
+    assert sql.rstrip().endswith("SELECT * FROM combined;")
+    assert sql.count("= ANY(%(oids)s::oid[])") == 8
+
+
+def test_sequence_changes_render_for_9_6():
+    # Servers before 10 have no pg_sequence catalog.
+    conn = types.SimpleNamespace(server_version=90600)
+    sql = helpers.render_query(
+        helpers.load_query(helpers.CHANGES_QUERY),
+        version=helpers.server_major(conn),
+    )
+    assert "pg_sequence " not in sql
+    assert "c.xmin\n" in sql
+    assert "pg_sequence " in helpers.render_query(
+        helpers.load_query(helpers.CHANGES_QUERY), version=10)
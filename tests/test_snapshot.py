@@ -0,0 +1,51 @@
+import io
+
+import pytest
+
+from pgdiff import objects as obj
+from pgdiff import snapshot
+from pgdiff.inspect import Inspection
+
+
+def inspection():
+    return Inspection(
+        [
+            obj.Table(
+                1, "t", "public", "public.t", "r", None, None, False, False,
+                "p", [{"name": "x", "type": "integer", "default": "NULL",
+                       "not_null": True}], []),
+            obj.View(2, "public", "v", "public.v", "v", "SELECT x FROM t"),
+            obj.Index(
+                3, "public", "t", "i", "public.i",
+                "CREATE INDEX i ON public.t USING btree (x)", "1", "0", 1,
+                False, False, False, True, False, "", "", False),
+        ],
+        [
+            obj.Dependency(
+                identity="public.v", dependency_identity="public.t"),
+            obj.Dependency(
+                identity="public.i", dependency_identity="public.t"),
+        ],
+        {"pg_version": 120005},
+    )
+
+
+def test_snapshot_round_trip():
+    original = inspection()
+    file = io.StringIO()
+    snapshot.dump(original, file)
+    file.seek(0)
+    loaded = snapshot.load(file)
+    assert snapshot.to_dict(loaded) == snapshot.to_dict(original)
+    assert loaded.ctx == original.ctx
+    assert sorted(loaded.dependency_pairs()) == sorted(
+        original.dependency_pairs())
+    assert loaded.diff(original) == []
+    assert original.diff(loaded) == []
+
+
+def test_snapshot_of_another_version_is_refused():
+    data = snapshot.to_dict(inspection())
+    data["version"] = snapshot.FORMAT_VERSION + 1
+    with pytest.raises(ValueError, match="unsupported snapshot version"):
+        snapshot.from_dict(data)
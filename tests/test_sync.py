@@ -0,0 +1,25 @@
+import pytest
+
+from pgdiff import sync
+
+
+class Connection:
+
+    autocommit = False
+    server_version = 120000
+
+    def cursor(self):
+        raise AssertionError("nothing should run")
+
+
+def test_diff_databases_refuses_autocommit_scratch():
+    scratch = Connection()
+    scratch.autocommit = True
+    with pytest.raises(ValueError, match="autocommit"):
+        sync.diff_databases("CREATE TABLE t ();", Connection(), scratch)
+
+
+def test_diff_databases_refuses_transaction_control():
+    with pytest.raises(ValueError, match="transaction control"):
+        sync.diff_databases(
+            "CREATE TABLE t (); COMMIT;", Connection(), Connection())
@@ -0,0 +1,151 @@
+import time
+
+import pytest
+
+from pgdiff import utils
+from pgdiff.utils import has_transaction_control
+
+
+@pytest.mark.parametrize("schema", [
+    "CREATE TABLE t (x int);\nCOMMIT;",
+    "BEGIN;\nCREATE TABLE t (x int);",
+    "create table t (x int); commit",
+    "START TRANSACTION;",
+    "CREATE TABLE t (x int);\nROLLBACK;",
+    "END TRANSACTION;",
+    "PREPARE TRANSACTION 'x';",
+])
+def test_detects_transaction_control(schema):
+    assert has_transaction_control(schema)
+
+
+@pytest.mark.parametrize("schema", [
+    "CREATE TABLE t (x int);",
+    "CREATE FUNCTION f() RETURNS int AS $$\nBEGIN\n  RETURN 1;\nEND;\n"
+    "$$ LANGUAGE plpgsql;",
+    "CREATE TABLE commits (x int);",
+    "COMMENT ON TABLE t IS 'x';",
+])
+def test_ignores_other_statements(schema):
+    assert not has_transaction_control(schema)
+
+
+class Cursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+
+    def execute(self, query, params=None):
+        self.conn.executed.append(query)
+        if query is utils.TEMPLATE_DESCRIPTION:
+            comment = self.conn.comments.get(params[0])
+            self.rows = [] if comment is None else [(comment, )]
+        elif query is utils.LIST_TEMPLATES:
+            self.rows = sorted(self.conn.comments.items())
+        elif "RENAME" in repr(query) and self.conn.rename_error:
+            raise self.conn.rename_error
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class AdminConnection:
+
+    def __init__(self, comments=None, rename_error=None):
+        self.comments = comments or {}
+        self.rename_error = rename_error
+        self.executed = []
+
+    def cursor(self):
+        return Cursor(self)
+
+    def close(self):
+        pass
+
+    def touches(self):
+        return [q for q in self.executed if "COMMENT ON" in repr(q)]
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    conn = AdminConnection()
+    dropped = []
+    monkeypatch.setattr(utils, "admin_connect", lambda dsn: conn)
+    monkeypatch.setattr(
+        utils, "drop_database",
+        lambda dsn: dropped.append(utils.parse_db_dsn(dsn).database))
+    monkeypatch.setattr(utils, "create_database", lambda dsn: None)
+    monkeypatch.setattr(utils, "apply_schema", lambda dsn, schema: None)
+    conn.dropped = dropped
+    return conn
+
+
+def test_template_name_is_stable_per_schema():
+    name = utils.template_name("CREATE TABLE t ();")
+    assert name == utils.template_name("CREATE TABLE t ();")
+    assert name != utils.template_name("CREATE TABLE u ();")
+    assert name.startswith(utils.TEMPLATE_PREFIX)
+    assert len(name) < 64
+
+
+def test_template_use_is_only_recorded_once_in_a_while(admin, monkeypatch):
+    schema = "CREATE TABLE t ();"
+    name = utils.template_name(schema)
+    monkeypatch.setattr(utils, "database_exists", lambda conn, name: True)
+    admin.comments[name] = utils.TEMPLATE_COMMENT + str(int(time.time()))
+    dsn = utils.ensure_template_db("postgresql://localhost/x", schema)
+    assert utils.parse_db_dsn(dsn).database == name
+    assert admin.touches() == []
+
+    admin.comments[name] = utils.TEMPLATE_COMMENT + str(
+        int(time.time() - utils.TEMPLATE_TOUCH_INTERVAL - 1))
+    utils.ensure_template_db("postgresql://localhost/x", schema)
+    assert len(admin.touches()) == 1
+
+
+def test_template_built_concurrently_is_kept(admin, monkeypatch):
+    admin.rename_error = utils.DuplicateDatabase()
+    monkeypatch.setattr(utils, "database_exists", lambda conn, name: False)
+    utils.ensure_template_db("postgresql://localhost/x", "CREATE TABLE t ();")
+    # Only the copy built by this run is dropped, and the template
+    # that won is marked as used.
+    build, = admin.dropped
+    assert build != utils.template_name("CREATE TABLE t ();")
+    assert len(admin.touches()) == 1
+
+
+def test_template_build_errors_drop_the_copy(admin, monkeypatch):
+    admin.rename_error = RuntimeError("boom")
+    monkeypatch.setattr(utils, "database_exists", lambda conn, name: False)
+    with pytest.raises(RuntimeError, match="boom"):
+        utils.ensure_template_db(
+            "postgresql://localhost/x", "CREATE TABLE t ();")
+    assert len(admin.dropped) == 1
+    assert admin.touches() == []
+
+
+def test_gc_templates_keeps_the_most_recently_used(admin):
+    now = time.time()
+    admin.comments.update({
+        "pgdiff_tpl_a": utils.TEMPLATE_COMMENT + str(int(now - 10)),
+        "pgdiff_tpl_b": utils.TEMPLATE_COMMENT + str(int(now - 7200)),
+        "pgdiff_tpl_c": utils.TEMPLATE_COMMENT + str(int(now - 60)),
+        "pgdiff_tpl_d": None,
+    })
+    assert utils.gc_templates("postgresql://localhost/x", keep=2) == [
+        "pgdiff_tpl_b", "pgdiff_tpl_d"]
+
+
+def test_gc_templates_drops_templates_over_max_age(admin):
+    now = time.time()
+    admin.comments.update({
+        "pgdiff_tpl_a": utils.TEMPLATE_COMMENT + str(int(now - 10)),
+        "pgdiff_tpl_b": utils.TEMPLATE_COMMENT + str(int(now - 7200)),
+    })
+    assert utils.gc_templates(
+        "postgresql://localhost/x", keep=5, max_age=3600) == [
+        "pgdiff_tpl_b"]